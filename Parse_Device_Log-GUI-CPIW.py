@@ -26,19 +26,45 @@ import PySimpleGUI as sg
 import os.path
 import fnmatch
 from logparser3_9 import parse
+from record_decoders import imu_schema_from_payload, decode_imu_samples, LowRateRecords, LOW_RATE_TYPES, \
+    LOW_RATE_CHUNK_RECORDS, ACTIVITY_TYPES, calibration_matrices, CALIBRATION_ORDER, TEMPERATURE_CALIBRATION_ORDER, \
+    CALIBRATION_ORIENTATION_TYPES, CALIBRATION_SAMPLE_TYPES
+from record_registry import RecordRegistry
+from output_writer import BackgroundWriter, ActivityCsvSink, DURABILITY_POLICIES, FSYNC_PER_FILE, COMPRESSIONS, \
+    NO_COMPRESSION
+from detectors import TimestampGapDetector, DUPLICATE, find_timestamp_gaps
+from streaming import ActivityStream, MEMORY_BUDGET_MB, NS
+from nebula_log import NebulaLog, ticks_to_unix, RECORD_EVENT_NAMES
+from chunk_store import ChunkStore
+from npy_output import NpyActivitySink
+from activity_counts import ActivityCounts
+from temperature_drift import TemperatureCompensation, read_drift_coefficients, log_temperatures, \
+    stream_temperatures
+from watch_folder import FolderWatcher, WATCH_INTERVAL, ZIP_EXTENSIONS
+from log_merge import merge_logs, group_by_device, device_serial
+from pipeline import time_window, Checkpoints
+from job_queue import JobQueue, JOB_WORKERS, QUEUED, RUNNING
+from event_store import EventStore, EVENT_DB_NAME, PEG, PEG_CLEARED, FLAT_REGION, FLAT_REGION_CLEARED, \
+    TIMESTAMP_GAP, DUPLICATE_TIMESTAMP, INVALID_RECORD, CHECKSUM_COLLISION, CORRUPT_BYTES, NON_WEAR, \
+    merge_event_databases
+from work_queue import SharedQueue, run_worker, merge_fragments, QUEUE_DIR
 import os
 from datetime import datetime, timezone, timedelta
 from bitstring import BitStream
-import math
 import numpy as np
 import csv
-from threading import Thread
 import json
 import pandas as pd          # library to get function to read csv into a data frame
 import plotly.express as px  # this library is to do plotting
 import plotly.io as pio      # this is to direct where plot output goes
 import zipfile
-import struct
+import tempfile
+import shutil
+import argparse
+import functools
+import multiprocessing
+import concurrent.futures
+import glob
 
 pio.renderers.default = 'browser'  # this is to plot into default web broswer
 
@@ -58,239 +84,48 @@ VERSION = '3.0.1.5'   # CHANGE ABOVE IN FILE DESCRIPTION!!!
 #####################
 # CONSTANTS/GLOBALS #
 #####################
-message = ''
-progress = 0
-totallogsize = 0
-
-File_Split_Level = 172800  # Seconds
-consecutiveSamples = 8
+File_Split_Level = 172800  # Seconds, activity CSVs are split on multiples of this (0: no split)
+Subsecond_Timestamps = 0   # 1: the activity CSV ts also holds each sample's fraction of a second (ns)
+Index_Dir = None           # Folder of the .nidx record indexes (None: next to each log)
+Temperature_Drift_File = None  # JSON of per device temperature drift coefficients (None: no correction)
+JOB_CHECK_RECORDS = 4096   # Records parsed between job progress updates and cancel checks
 LOG_IMU = 0
 createHtmlPlot = 0
 
-# Filter Coefficient for Flat area detection #
-alpha = 0.8
-
 # Default Sample Rate #
 # FS = 32
 
 # Date/Time Format #
 FMT = '%Y/%m/%d %H:%M:%S'
-CalibrationOrder = ["negativeZeroGOffsetX_32",
-                    "negativeZeroGOffsetY_32",
-                    "negativeZeroGOffsetZ_32",
-                    "positiveZeroGOffsetX_32",
-                    "positiveZeroGOffsetY_32",
-                    "positiveZeroGOffsetZ_32",
-                    "zeroGOffsetX_32",
-                    "zeroGOffsetY_32",
-                    "zeroGOffsetZ_32",
-                    "offsetX_32",
-                    "offsetY_32",
-                    "offsetZ_32",
-                    "sensitivityXX_32",
-                    "sensitivityYY_32",
-                    "sensitivityZZ_32",
-                    "sensitivityXY_32",
-                    "sensitivityXZ_32",
-                    "sensitivityYZ_32",
-                    "negativeZeroGOffsetX_64",
-                    "negativeZeroGOffsetY_64",
-                    "negativeZeroGOffsetZ_64",
-                    "positiveZeroGOffsetX_64",
-                    "positiveZeroGOffsetY_64",
-                    "positiveZeroGOffsetZ_64",
-                    "zeroGOffsetX_64",
-                    "zeroGOffsetY_64",
-                    "zeroGOffsetZ_64",
-                    "offsetX_64",
-                    "offsetY_64",
-                    "offsetZ_64",
-                    "sensitivityXX_64",
-                    "sensitivityYY_64",
-                    "sensitivityZZ_64",
-                    "sensitivityXY_64",
-                    "sensitivityXZ_64",
-                    "sensitivityYZ_64",
-                    "negativeZeroGOffsetX_128",
-                    "negativeZeroGOffsetY_128",
-                    "negativeZeroGOffsetZ_128",
-                    "positiveZeroGOffsetX_128",
-                    "positiveZeroGOffsetY_128",
-                    "positiveZeroGOffsetZ_128",
-                    "zeroGOffsetX_128",
-                    "zeroGOffsetY_128",
-                    "zeroGOffsetZ_128",
-                    "offsetX_128",
-                    "offsetY_128",
-                    "offsetZ_128",
-                    "sensitivityXX_128",
-                    "sensitivityYY_128",
-                    "sensitivityZZ_128",
-                    "sensitivityXY_128",
-                    "sensitivityXZ_128",
-                    "sensitivityYZ_128",
-                    "negativeZeroGOffsetX_256",
-                    "negativeZeroGOffsetY_256",
-                    "negativeZeroGOffsetZ_256",
-                    "positiveZeroGOffsetX_256",
-                    "positiveZeroGOffsetY_256",
-                    "positiveZeroGOffsetZ_256",
-                    "zeroGOffsetX_256",
-                    "zeroGOffsetY_256",
-                    "zeroGOffsetZ_256",
-                    "offsetX_256",
-                    "offsetY_256",
-                    "offsetZ_256",
-                    "sensitivityXX_256",
-                    "sensitivityYY_256",
-                    "sensitivityZZ_256",
-                    "sensitivityXY_256",
-                    "sensitivityXZ_256",
-                    "sensitivityYZ_256"
-                    ]
-
-TemperatureCalibrationOrder = [ "mcuTempHigh",
-                                "mcuTempLow",
-                                "adxlTempHigh",
-                                "adxlTempLow",
-                                "tempHigh",
-                                "tempLow",
-                                "mcuTempCal1",
-                                "mcuTempCal2",
-                                "calibrationMethod",
-                                "calibrationTime",
-                                "isCalibrated"
-                                ]
+EPOCH = datetime.fromtimestamp(0, timezone.utc)
+
+####### Output Folder Structure ########################################################
+adxl_dir = '/Activity Files - Primary Accel/'
+timeGap_dir = '/Time Gap Files/'
+battery_dir = '/Battery Logs/'
+temperature_dir = '/Temperature_Files/'
+calibration_dir = '/Calibration Logs/'
+output_dir = '/output_files/'
+time_stamp_only_dir = 'ts_only/'
+epoch_dir = '/Epoch Files/'
+imu_dir = '/IMU Files/'
+store_dir = '/Store/'
+npy_dir = '/NumPy Files/'
+merge_dir = '/Merged Logs/'
+nonwear_dir = '/Non-Wear Files/'
+
+SUMMARY_HEADER = ('filename,firmware version,First Activity Timestamp,Last Activity Timestamp,'
+                  'Activity records,Unexpected Resets,Expected Resets,Pegs,flat areas,'
+                  'Timestamp Gaps,Non-wear Periods,Non-wear Hours\n')
+
+# Records that never write to the summary, activity is only flushed ahead of the others #
+QUIET_RECORD_TYPES = set(ACTIVITY_TYPES) | LOW_RATE_TYPES | {25}
 
 #############
 # FUNCTIONS #
 #############
 
 
-def check_for_peg(xp, yp, zp, activityCountp, calibratedp):
-    if activityCountp <= 1:
-        check_for_peg.xcount = check_for_peg.ycount = check_for_peg.zcount = 0
-        check_for_peg.status = 0
-    if calibratedp:
-        maxvalue = 7.0
-    else:
-        maxvalue = 2000
-    # Check For Pegged Data #
-    if abs(xp) > maxvalue:
-        check_for_peg.xcount = check_for_peg.xcount + 1
-    elif abs(yp) > maxvalue:
-        check_for_peg.ycount = check_for_peg.ycount + 1
-    elif abs(zp) > maxvalue:
-        check_for_peg.zcount = check_for_peg.zcount + 1
-    else:
-        check_for_peg.xcount = check_for_peg.ycount = check_for_peg.zcount = 0
-        check_for_peg.status = 0
-
-    if (
-        check_for_peg.xcount > consecutiveSamples
-        or check_for_peg.ycount > consecutiveSamples
-        or check_for_peg.zcount > consecutiveSamples
-    ):
-        check_for_peg.status = 1
-
-    return check_for_peg.status
-
-
-check_for_peg.xcount = check_for_peg.ycount = check_for_peg.zcount = 0
-check_for_peg.status = 0
-
-
-def check_for_flat(xf, yf, zf, activityCountf, calibratedf, flatFS):
-    if activityCountf <= 1:
-        check_for_flat.y_xn = check_for_flat.y_yn = check_for_flat.y_zn = 0
-        check_for_flat.previous_x = (
-            check_for_flat.previous_y
-        ) = check_for_flat.previous_z = 0
-        check_for_flat.flatCount_x = (
-            check_for_flat.flatCount_y
-        ) = check_for_flat.flatCount_z = 0
-        check_for_flat.flatStatus = check_for_flat.vmCount = 0
-
-    if calibratedf:
-        flatLimit = 0.05
-        VectorMag = math.sqrt(
-            check_for_flat.y_xn**2
-            + check_for_flat.y_yn**2
-            + check_for_flat.y_zn**2
-        )
-    else:
-        flatLimit = 5
-        VectorMag = (
-            math.sqrt(
-                check_for_flat.y_xn**2
-                + check_for_flat.y_yn**2
-                + check_for_flat.y_zn**2
-            )
-            / 250
-        )
-
-    check_for_flat.y_xn = alpha * xf + (1 - alpha) * check_for_flat.previous_x
-    check_for_flat.y_yn = alpha * yf + (1 - alpha) * check_for_flat.previous_y
-    check_for_flat.y_zn = alpha * zf + (1 - alpha) * check_for_flat.previous_z
-    check_for_flat.y_vm = alpha * VectorMag + (1 - alpha) * check_for_flat.previous_vm
-
-    if activityCountf > 1:
-        # CHECK X #
-        if abs(check_for_flat.y_xn - xf) < flatLimit:
-            check_for_flat.flatCount_x += 1
-        else:
-            check_for_flat.flatCount_x = 0
-
-        # CHECK Y #
-        if abs(check_for_flat.y_yn - yf) < flatLimit:
-            check_for_flat.flatCount_y += 1
-        else:
-            check_for_flat.flatCount_y = 0
-
-        # CHECK Z #
-        if abs(check_for_flat.y_zn - zf) < flatLimit:
-            check_for_flat.flatCount_z += 1
-        else:
-            check_for_flat.flatCount_z = 0
-
-        # CHECK VECTOR MAG #
-        if check_for_flat.y_vm > 1.5:
-            check_for_flat.vmCount += 1
-        else:
-            check_for_flat.vmCount = 0
-
-        if (
-            check_for_flat.flatCount_x == 0
-            and check_for_flat.flatCount_y == 0
-            and check_for_flat.flatCount_z == 0
-        ):
-            check_for_flat.flatStatus = 0
-
-        if ((check_for_flat.flatCount_x > flatFS and check_for_flat.flatCount_y > flatFS)
-            or (check_for_flat.flatCount_z > flatFS and check_for_flat.flatCount_y > flatFS)
-            or (check_for_flat.flatCount_x > flatFS and check_for_flat.flatCount_z > flatFS)) \
-                and check_for_flat.vmCount > flatFS:
-            check_for_flat.flatStatus = 1
-
-    check_for_flat.previous_x = xf
-    check_for_flat.previous_y = yf
-    check_for_flat.previous_z = zf
-    check_for_flat.previous_vm = VectorMag
-
-    return check_for_flat.flatStatus
-
-
-check_for_flat.y_xn = (
-    check_for_flat.y_yn
-) = check_for_flat.y_zn = check_for_flat.y_vm = 0
-check_for_flat.previous_x = (
-    check_for_flat.previous_y
-) = check_for_flat.previous_z = check_for_flat.previous_vm = 0
-check_for_flat.flatCount_x = check_for_flat.flatCount_y = check_for_flat.flatCount_z = 0
-check_for_flat.flatStatus = 0
-check_for_flat.vmCount = 0
-
-
 def import_calibration_values(cal_file):
 
     with open(cal_file, 'r') as cfile:
@@ -302,9 +137,9 @@ def import_calibration_values(cal_file):
                 v += 1
         else:
             jsonReader = json.load(cfile)
-            while v < len(CalibrationOrder):
+            while v < len(CALIBRATION_ORDER):
                 import_calibration_values.calval_temp[v] = jsonReader[
-                    CalibrationOrder[v]
+                    CALIBRATION_ORDER[v]
                 ]
                 v += 1
     return import_calibration_values.calval_temp
@@ -317,51 +152,840 @@ def import_temperature_calibration_values(temp_cal_file):
     with open(temp_cal_file, 'r') as cfile:
         v = 0
         jsonReader = json.load(cfile)
-        while v < len(TemperatureCalibrationOrder):
-            import_temperature_calibration_values.calval_temperature[v] = jsonReader[TemperatureCalibrationOrder[v]]
+        while v < len(TEMPERATURE_CALIBRATION_ORDER):
+            import_temperature_calibration_values.calval_temperature[v] = jsonReader[TEMPERATURE_CALIBRATION_ORDER[v]]
             v += 1
     return import_temperature_calibration_values.calval_temperature
 
 
 import_temperature_calibration_values.calval_temperature = np.empty(12, int)
 
-def ticks_to_unix(ticks):
-    # Calculate the difference between Unix epoch and .NET epoch
-    epoch_diff = datetime(1970, 1, 1) - datetime(1, 1, 1)
-    epoch_diff_ticks = epoch_diff.total_seconds() * 10 ** 7
-
-    # Calculate Unix timestamp
-    ticks_to_unix_timestamp = (ticks - epoch_diff_ticks) / 10 ** 7
-    return ticks_to_unix_timestamp
-
-def main_process(Log_Activity_Data, NoFilter, UseCalValues, zipfiles, basePath, begin_timestamp, end_timestamp):
-
-    ####### Create Folder Structure ########################################################
-    adxl_dir = '/Activity Files - Primary Accel/'
-    timeGap_dir = '/Time Gap Files/'
-    battery_dir = '/Battery Logs/'
-    temperature_dir = '/Temperature_Files/'
-    calibration_dir = '/Calibration Logs/'
-    output_dir = '/output_files/'
-    time_stamp_only_dir = 'ts_only/'
-    epoch_dir = '/Epoch Files/'
-
-    outPutPath = basePath + output_dir
+def summary_row(file, firmware_version, firstTimestampUnix, lastTimestampUnix, activity_count,
+                unexpected_reset_count, expected_reset_count, pegs, flats, timestampGap, nonWear):
+    return '%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s\n' % (str(file), firmware_version.rstrip(), str(firstTimestampUnix),
+                                                     str(lastTimestampUnix), str(activity_count),
+                                                     str(unexpected_reset_count), str(expected_reset_count),
+                                                     str(pegs), str(flats), str(timestampGap), str(len(nonWear)),
+                                                     str(nonwear_hours(nonWear)))
+
+
+def nonwear_periods(activityStream):
+    # (start, end) unix seconds of the non-wear periods of the activity #
+    starts, ends = activityStream.nonwear.intervals()
+    return list(zip((starts / NS).tolist(), (ends / NS).tolist()))
+
+
+def nonwear_hours(nonWear):
+    return round(sum(end - start for start, end in nonWear) / 3600, 2)
+
+
+def write_nonwear(nonWear, fout, eventStore=None):
+    for start, end in nonWear:
+        minutes = (end - start) / 60
+        fout.write('%s,%s,%s,%s,%.1f\n' % (datetime.fromtimestamp(start, tz=timezone.utc).strftime(FMT),
+                                           datetime.fromtimestamp(end, tz=timezone.utc).strftime(FMT),
+                                           start, end, minutes))
+        if eventStore is not None:
+            eventStore.add(NON_WEAR, start, minutes)
+
+
+def temperature_drift(file, temperatures):
+    # TemperatureCompensation of the log from Temperature_Drift_File, None
+    # when the device has no coefficients or the log no calibrated
+    # temperature readings. temperatures() returns the (ns, degC)
+    # readings, it is only called for a device with coefficients.
+    if Temperature_Drift_File is None:
+        return None
+    coefficients = read_drift_coefficients(Temperature_Drift_File).get(device_serial(file))
+    if coefficients is None:
+        return None
+    times, celsius = temperatures()
+    if not len(times):
+        return None
+    return TemperatureCompensation(times, celsius, *coefficients)
+
+
+def drift_report(drift):
+    return '%-45s %5s\n' % ('Temperature drift correction: ', 'none' if drift is None
+                             else '%d readings' % len(drift.times))
+
+
+def write_summary_events(sumFile, events):
+    for label, timestamp, unixTime in events:
+        print('%-35s %-15s %10s' % (label, timestamp, str(unixTime)))
+        sumFile.write('%-35s %-15s %10s\n' % (label, timestamp, str(unixTime)))
+
+
+# Event database names of the activity stream's summary labels #
+ACTIVITY_EVENT_NAMES = {'peg @ : ': PEG,
+                        'peg cleared @ : ': PEG_CLEARED,
+                        'Flat Region @ : ': FLAT_REGION,
+                        'Flat region cleared @ : ': FLAT_REGION_CLEARED}
+
+
+def record_event(state, event, unixTime, value=None, detail=None):
+    # Adds a summary event to the event database, if it is written #
+    if state.events is not None:
+        state.events.add(event, unixTime, value, detail)
+
+
+def flush_activity(activityStream, gapDetector, sumFile, fout1, eventStore=None):
+    # Decode/detect the buffered activity chunk and check its timestamps. Both
+    # buffers hold the same records, so their summary lines are merged back
+    # into record order (a gap is reported ahead of its record's pegs).
+    events = activityStream.flush()
+    k = 0
+    if eventStore is not None:
+        for _, label, _, unixTime in events:
+            eventStore.add(ACTIVITY_EVENT_NAMES[label], unixTime)
+
+    gaps = gapDetector.update()
+    for record, current, previous, delta, kind, event, event_time in zip(
+            gaps.index.tolist(), gaps.current.tolist(), gaps.previous.tolist(), gaps.delta.tolist(),
+            gaps.kind.tolist(), gaps.event.tolist(), gaps.event_time.tolist()):
+        while k < len(events) and events[k][0] < record:
+            write_summary_events(sumFile, [events[k][1:]])
+            k += 1
+
+        currenttimestamp = datetime.fromtimestamp(current, tz=timezone.utc)
+        previoustimestamp = datetime.fromtimestamp(previous, tz=timezone.utc)
+        if event:
+            eventtimestamp = datetime.fromtimestamp(event_time, tz=timezone.utc)
+            cause = '%s @ %s' % (event, eventtimestamp.strftime(FMT))
+        else:
+            eventtimestamp = ''
+            cause = 'no event nearby'
+        if kind == DUPLICATE:
+            label = 'Duplicate Timestamp @ : '
+        else:
+            label = 'Timestamp Gap @ : '
+        sumFile.write('%-35s %-15s %10s   (%s)\n' % (label, currenttimestamp.strftime(FMT),
+                                                    str(float(current)), cause))
+        if eventStore is not None:
+            eventStore.add(DUPLICATE_TIMESTAMP if kind == DUPLICATE else TIMESTAMP_GAP, current, float(delta),
+                           '%s, %s' % (kind, cause))
+        fout1.write("%s,%s,%s,%s,%s,%s\n" % (currenttimestamp, previoustimestamp, float(delta), kind,
+                                             event, eventtimestamp))
+    write_summary_events(sumFile, [e[1:] for e in events[k:]])
+
+
+def write_low_rate_records(lowRateRecords, fout2, fout3, fout_cal, temperatureGains, temperatureOffsets):
+    # Outputs that were not requested are None, their records are never collected #
+    if fout2 is not None:
+        fout2.writelines(lowRateRecords.battery_lines())
+    if fout3 is not None:
+        fout3.writelines(lowRateRecords.temperature_lines(temperatureGains, temperatureOffsets))
+    if fout_cal is not None:
+        fout_cal.writelines(lowRateRecords.calibration_lines())
+    print_register_dumps(lowRateRecords)
+
+
+def print_register_dumps(lowRateRecords):
+    # Register dumps only go to the console. The pending ones are printed
+    # ahead of any other console line, so the output stays in record order.
+    for line in lowRateRecords.register_dump_lines():
+        print(line)
+
+
+###################
+# RECORD HANDLERS #
+###################
+# Outputs a caller can ask main_process for. The summary is always written. #
+OUTPUT_ACTIVITY = 'activity'
+OUTPUT_BATTERY = 'battery'
+OUTPUT_TEMPERATURE = 'temperature'
+OUTPUT_CALIBRATION = 'calibration'
+OUTPUT_REGISTER_DUMP = 'register dump'
+OUTPUT_IMU = 'imu'
+# Summary events are also written to an SQLite database (event_store.py) #
+OUTPUT_EVENTS = 'events'
+# Non-wear periods (detectors.NonWearDetector) of each log as a CSV #
+OUTPUT_NONWEAR = 'non-wear'
+ALL_OUTPUTS = frozenset((OUTPUT_ACTIVITY, OUTPUT_BATTERY, OUTPUT_TEMPERATURE, OUTPUT_CALIBRATION,
+                         OUTPUT_REGISTER_DUMP, OUTPUT_IMU, OUTPUT_EVENTS, OUTPUT_NONWEAR))
+# Opt-in, needs h5py: activity, battery and temperature in one chunked HDF5 file per log #
+OUTPUT_STORE = 'store'
+# Opt-in: activity as memory mappable .npy arrays with a JSON sidecar #
+OUTPUT_NPY = 'npy'
+# Opt-in, needs scipy: ActiGraph activity counts of 1/10/60 s epochs in Epoch Files #
+OUTPUT_COUNTS = 'counts'
+# Opt-in: the record index of each log in a .nidx file (log_index.py) for later runs #
+OUTPUT_INDEX = 'index'
+
+# Records that can hold the first record timestamp of a file #
+FIRST_TIMESTAMP_TYPES = (0, 26, 27, 37, 36, 35, 33, 32, 31, 100)
+
+RECORD_HANDLERS = RecordRegistry()
+
+
+class ParseState:
+    # Per file state shared by the record handlers #
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+############################
+# Parse if Activity Record #
+############################
+@RECORD_HANDLERS.register(ACTIVITY_TYPES)
+def handle_activity(state, record, timestamp, unixTime):
+    state.record_type = record.type
+    activityRecordLen = len(record.payload) / 2
+
+    # Locate and log first Activity Timestamp #
+    if state.i < 1:
+        if record.type == 27:
+            base_file = os.path.splitext(state.file)[0]
+            if os.path.isfile(base_file + '.cal') or os.path.isfile(state.extractPath + '/calibration.json') and state.UseCalValues:
+                FS = int(len(record.payload) / 2 / 4.5)
+                if os.path.isfile(base_file + '.cal'):
+                    calvals = import_calibration_values(base_file + '.cal')
+                else:
+                    calvals = import_calibration_values(state.extractPath + '/calibration.json')
+                state.activityStream.calibration = calibration_matrices(calvals, FS)
+                state.activityStream.calibrated = True
+
+    # Check for 0 length Record (i.e. USB connect) #
+    if 1 < len(record.payload) / 2:
+        state.activity_count = state.activity_count + 1
+        state.adxl.write('%s,%d,%s\n' % (timestamp, activityRecordLen, str(unixTime)))
+
+        if state.activityStream.needs_flush(record.type) or state.gapDetector.full():
+            flush_activity(state.activityStream, state.gapDetector, state.sumFile, state.fout1, state.events)
+        state.gapDetector.add(int(unixTime))
+        state.lasttimestamp = record.timestamp
+
+        ##########################
+        # Parse activity records #
+        ##########################
+        if state.activityStream.sinks:
+            state.activityStream.add(record.type, timestamp, unixTime, bytes.fromhex(record.payload),
+                                     state.activity_count == 1)
 
+    else:
+        print('%-35s %-15s %10s' % ('USB DOCK @ : ', timestamp, str(unixTime)))
+        state.sumFile.write('%-35s %-15s %10s\n' % ('USB DOCK @ : ', timestamp, str(unixTime)))
+        state.gapDetector.add_event(int(unixTime), 'USB DOCK')
+        record_event(state, 'USB DOCK', unixTime)
+    state.i = state.i + 1
+
+
+###########################
+# Parse STM32 IMU Schema  #
+###########################
+@RECORD_HANDLERS.register((24,), output=OUTPUT_IMU)
+def handle_imu_schema(state, record, timestamp, unixTime):
+    imuSchema = imu_schema_from_payload(bytes.fromhex(record.payload))
+    if state.isIMUdata:
+        if imuSchema.names == state.imuSchema.names and imuSchema.dtype == state.imuSchema.dtype:
+            return
+        # A changed schema starts a new IMU part, so each CSV matches its header #
+        state.fout_imu.close()
+    state.isIMUdata = 1
+    state.imuSchema = imuSchema
+    state.imuHeader = imuSchema.names
+    part = '_imu.csv' if not state.imuParts else '_imu-%d.csv' % (len(state.imuParts) + 1)
+    state.imuFileName = state.outPutPath + state.imu_dir + state.filename + part
+    state.fout_imu = state.writer.open(state.imuFileName)
+    state.fout_imu.write("Timestamp,t,%s\n" % ','.join(state.imuHeader))
+    state.imuParts.append((state.fout_imu.name, state.imuHeader, state.filename + part[:-len('.csv')]))
+
+
+###########################
+# Parse Taso IMU Records #
+###########################
+@RECORD_HANDLERS.register((25,), output=OUTPUT_IMU)
+def handle_imu(state, record, timestamp, unixTime):
+    if state.isIMUdata:
+        imu = decode_imu_samples(bytes.fromhex(record.payload), state.imuSchema)
+        if len(imu):
+            t_imu = state.timedelta + np.arange(1, len(imu) + 1) / len(imu)
+            state.timedelta = t_imu[-1]
+            np.savetxt(state.fout_imu, np.column_stack((t_imu, imu)),
+                       fmt=timestamp + ',' + ','.join(['%f'] * (imu.shape[1] + 1)))
+
+
+#####################################################
+# Collect Battery/Temperature/Calibration/Registers #
+#####################################################
+@RECORD_HANDLERS.register((2,), output=OUTPUT_BATTERY)
+@RECORD_HANDLERS.register((30, 31), output=OUTPUT_TEMPERATURE)
+@RECORD_HANDLERS.register(CALIBRATION_ORIENTATION_TYPES, output=OUTPUT_CALIBRATION)
+@RECORD_HANDLERS.register(CALIBRATION_SAMPLE_TYPES, output=OUTPUT_CALIBRATION)
+@RECORD_HANDLERS.register((40,), output=OUTPUT_REGISTER_DUMP)
+def handle_low_rate(state, record, timestamp, unixTime):
+    state.lowRateRecords.add(record.type, timestamp, bytes.fromhex(record.payload))
+    if len(state.lowRateRecords) >= LOW_RATE_CHUNK_RECORDS:
+        write_low_rate_records(state.lowRateRecords, state.fout2, state.fout3, state.fout_cal,
+                               *state.temperatureCal)
+
+
+@RECORD_HANDLERS.register((2, 30, 31), output=OUTPUT_STORE)
+def handle_store_low_rate(state, record, timestamp, unixTime):
+    state.store.add_low_rate(record.type, unixTime, bytes.fromhex(record.payload))
+
+
+###########################
+# Parse Event Type Record #
+###########################
+@RECORD_HANDLERS.register((3,))
+def handle_event(state, record, timestamp, unixTime):
+    if record.payload == '0d':
+        state.expected_reset_count = state.expected_reset_count + 1
+        print('%-35s %-15s %10s' % ('Expected Reset @ :', timestamp, str(unixTime)))
+        state.sumFile.write(
+            '%-35s %-15s %10s\n' % ('Expected Reset @ :', timestamp, str(unixTime)))
+        state.gapDetector.add_event(int(unixTime), 'Expected Reset')
+        record_event(state, 'Expected Reset', unixTime)
+    elif record.payload == '01':
+        state.unexpected_reset_count = state.unexpected_reset_count + 1
+        print('%-35s %-15s %10s' % ('Unexpected Reset @ :', timestamp, str(unixTime)))
+        state.sumFile.write(
+            '%-35s %-15s %10s\n' % ('Unexpected Reset @ :', timestamp, str(unixTime)))
+        state.gapDetector.add_event(int(unixTime), 'Unexpected Reset')
+        record_event(state, 'Unexpected Reset', unixTime)
+    elif record.payload == '08':
+        #print('%-35s %-15s %10s' % ('ENTER IDLE SLEEP @ ', timestamp, str(unixTime)))
+        state.sumFile.write(
+            '%-35s %-15s %10s\n' % ('ENTER IDLE SLEEP @ ', timestamp, str(unixTime)))
+        state.gapDetector.add_event(int(unixTime), 'ENTER IDLE SLEEP')
+        record_event(state, 'ENTER IDLE SLEEP', unixTime)
+    elif record.payload == '09':
+        #print('%-35s %-15s %10s' % ('EXIT IDLE SLEEP @ ', timestamp, str(unixTime)))
+        state.sumFile.write(
+            '%-35s %-15s %10s\n' % ('EXIT IDLE SLEEP @ ', timestamp, str(unixTime)))
+        state.gapDetector.add_event(int(unixTime), 'EXIT IDLE SLEEP')
+        record_event(state, 'EXIT IDLE SLEEP', unixTime)
+    else:
+        print('%-35s %-15s %10s' % (('Event Type %s @ ' % record.payload),
+                                    timestamp, str(unixTime)))
+        state.sumFile.write('%-35s %-15s %10s\n' % (('Event Type %s @ ' % record.payload),
+                                                    timestamp, str(unixTime)))
+        record_event(state, 'Event Type %s' % record.payload, unixTime)
+
+
+#########################################################
+# Parse FIFO_ERROR/DEBUG_ERROR/RAM_DUMP/EVENT_MARKER    #
+#########################################################
+RECORD_EVENT_LABELS = {19: 'FIFO ERROR @ : ',
+                       23: 'DEBUG_ERROR @ : ',
+                       24: 'RAM_DUMP @ : ',
+                       28: 'EVENT MARKER @ : '}
+
+
+@RECORD_HANDLERS.register(tuple(RECORD_EVENT_LABELS))
+def handle_record_event(state, record, timestamp, unixTime):
+    label = RECORD_EVENT_LABELS[record.type]
+    print('%-35s %-15s %10s' % (label, timestamp, str(unixTime)))
+    state.sumFile.write('%-35s %-15s %10s\n' % (label, timestamp, str(unixTime)))
+    record_event(state, RECORD_EVENT_NAMES[record.type], unixTime)
+
+
+############################################
+# Parse BUTTON_PRESS/BUTTON_RELEASE Record #
+############################################
+@RECORD_HANDLERS.register((29,))
+def handle_button(state, record, timestamp, unixTime):
+    if record.payload == '00':
+        print('%-35s %-15s %10s' % ('BUTTON PRESS @ : ', timestamp, str(unixTime)))
+        state.sumFile.write(
+            '%-35s %-15s %10s\n' % ('BUTTON PRESS @ : ', timestamp, str(unixTime)))
+        record_event(state, 'BUTTON PRESS', unixTime)
+
+    if record.payload == '01':
+        print('%-35s %-15s %10s' % ('BUTTON RELEASE @ : ', timestamp, str(unixTime)))
+        state.sumFile.write(
+            '%-35s %-15s %10s\n' % ('BUTTON RELEASE @ : ', timestamp, str(unixTime)))
+        record_event(state, 'BUTTON RELEASE', unixTime)
+
+
+####################
+# Parse Taso Epoch #
+####################
+@RECORD_HANDLERS.register((99,))
+def handle_taso_epoch(state, record, timestamp, unixTime): ###TODO
+    print(timestamp)
+    h = BitStream(hex=record.payload)
+    # s = Bits(h)
+    for j in range(0, 36):
+        r = h.readlist("hex:n, hex:n", n=8)
+        reg, value = map(lambda t: t, r)
+        print(reg + ' ' + value)
+
+
+
+
+def resolve_outputs(Log_Activity_Data, outputs):
+    # Only the record types feeding the summary and the requested outputs are framed #
+    outputs = set(outputs)
+    if not Log_Activity_Data:
+        outputs.discard(OUTPUT_ACTIVITY)
+    if not LOG_IMU:
+        outputs.discard(OUTPUT_IMU)
+    return outputs
+
+
+def create_output_folders(outPutPath):
     Path(outPutPath + adxl_dir + time_stamp_only_dir).mkdir(parents=True, exist_ok=True)
     Path(outPutPath + timeGap_dir).mkdir(parents=False, exist_ok=True)
     Path(outPutPath + battery_dir).mkdir(parents=False, exist_ok=True)
     Path(outPutPath + calibration_dir).mkdir(parents=False, exist_ok=True)
     Path(outPutPath + temperature_dir).mkdir(parents=False, exist_ok=True)
     Path(outPutPath + epoch_dir).mkdir(parents=False, exist_ok=True)
+    if LOG_IMU:
+        Path(outPutPath + imu_dir).mkdir(parents=False, exist_ok=True)
+
+
+def process_file(file, zipfiles, basePath, writer, sumFile, fout_summary, outputs, NoFilter, UseCalValues,
+                 begin_timestamp, end_timestamp, memory_budget_mb=MEMORY_BUDGET_MB, split_seconds=File_Split_Level,
+                 job=None, event_db=None):
+    # Parses one log into the output folders of basePath, adds its report to
+    # sumFile and its row to fout_summary and its events to the event_db
+    # database (default: EVENT_DB_NAME in the output folder). A cancelled job stops the parse
+    # between record batches, the outputs written so far are kept but the
+    # log gets no summary row. Returns True once the log is parsed.
+
+    Log_Activity_Data = OUTPUT_ACTIVITY in outputs
+    recordHandlers = RECORD_HANDLERS.dispatch_table(outputs)
+    recordTypes = set(recordHandlers) | set(FIRST_TIMESTAMP_TYPES)
+    outPutPath = basePath + output_dir
+    skip_file = 0
+    temperatureCalibration = False
 
+    # Containers are extracted to a private folder so several files can be parsed at once #
+    extractPath = tempfile.mkdtemp(prefix='nebula_') if zipfiles else basePath
+    try:
+        if file.name.startswith('CPW'):
+            min_dateTime_unix = 1514764800
+        else:
+            min_dateTime_unix = 1262304000
 
-    ###########################################################################################
+        if zipfiles:
+            # Iterate through each file #
+            if zipfile.is_zipfile(file):
+                with zipfile.ZipFile(file, 'r') as zf:
+                    zf.extract('log.bin', extractPath)
+                    if str(file).endswith('.agdc'):
+                        zf.extract('calibration.json', extractPath)
+                        try:
+                            zf.extract('temperature_calibration.json', extractPath)
+                            tempcalvals = import_temperature_calibration_values(extractPath + '/temperature_calibration.json')
+                            if tempcalvals[0] != 0:
+                                temperatureCalibration = True
+                                gainMcu = (tempcalvals[4] - tempcalvals[5]) / (tempcalvals[0] - tempcalvals[1])
+                                gainAdxl = (tempcalvals[4] - tempcalvals[5]) / (tempcalvals[2] - tempcalvals[3])
+                                offsetMcu = tempcalvals[4] - (gainMcu * tempcalvals[0])
+                                offsetAdxl = tempcalvals[4] - (gainAdxl * tempcalvals[2])
+                                temperatureGains = np.array([gainMcu, gainAdxl])
+                                temperatureOffsets = np.array([offsetMcu, offsetAdxl])
+                            else:
+                                temperatureCalibration = False
+                                print('\nWARNING!!!!!!!   Temperature Calibration File has default values!!!!!!!!!\n')
+                        except:
+                            temperatureCalibration = False
+
+
+                        zf.extract('info.json', extractPath)
+
+                        with open(extractPath + '/info.json', 'r') as info_file:
+                            jsonReader = json.load(info_file)
+                            firmware_version = jsonReader["firmware"]
+                            #target_start_time_unix = jsonReader["startDate"]
+                            downloadDate_unix = jsonReader["lastSampleTime"] + 86400
+                    else:
+                        zf.extract('info.txt',extractPath)
+
+                        with open(extractPath + '/info.txt', 'r') as info_file:
+                            for line in info_file:
+                                if "Firmware" in line:
+                                    firmware_version = line[-6:].rstrip('\n')
+                                if "Last Sample Time" in line:
+                                    number = int(line[-19:].rstrip('\n'))
+                                    downloadDate_unix = ticks_to_unix(number)
+
+                filetoopen = extractPath + '/log.bin'
+            else:
+                skip_file = 1
+        else:
+            filetoopen = file
+            firmware_version = "dat or bin file only"
+
+        if not skip_file:
+            filename = Path(file).stem
+            with open(filetoopen, 'rb') as fin:
+                activitySinks = []
+                if Log_Activity_Data:
+                    activityCsv = ActivityCsvSink(writer, outPutPath + adxl_dir, filename, split_seconds,
+                                                  Subsecond_Timestamps)
+                    activitySinks.append(activityCsv)
+                store = None
+                if OUTPUT_STORE in outputs:
+                    Path(outPutPath + store_dir).mkdir(parents=False, exist_ok=True)
+                    store = ChunkStore(outPutPath + store_dir + filename + '.h5')
+                    activitySinks.append(store)
+                npySink = None
+                if OUTPUT_NPY in outputs:
+                    Path(outPutPath + npy_dir).mkdir(parents=False, exist_ok=True)
+                    npySink = NpyActivitySink(outPutPath + npy_dir, filename)
+                    activitySinks.append(npySink)
+                countsSink = None
+                if OUTPUT_COUNTS in outputs:
+                    countsSink = ActivityCounts(writer, outPutPath + epoch_dir + filename)
+                    activitySinks.append(countsSink)
+                eventStore = None
+                if OUTPUT_EVENTS in outputs:
+                    eventStore = EventStore(event_db or outPutPath + EVENT_DB_NAME, file, device_serial(file),
+                                            firmware_version.rstrip() if zipfiles else None)
+
+                adxl = writer.open(outPutPath + adxl_dir + time_stamp_only_dir + filename + '_ts_only.csv')
+                adxl.write('ts,record_length,Unix Timestamp\n')
+
+                # Create and open Timestamp Issue CSV File #
+                fout1 = writer.open(outPutPath + timeGap_dir + filename
+                                    + '_datetime_Gap.csv')
+
+                # Create and open Battery Log CSV File #
+                fout2 = None
+                if OUTPUT_BATTERY in outputs:
+                    fout2 = writer.open(outPutPath + battery_dir + filename
+                                        + 'battery_log.csv')
+                    fout2.write("Time Stamp,Batter_Voltage\n")
 
-    filenumber = 1
-    temperatureCalibration = False
+                # Create and open Temperature Log CSV File #
+                fout3 = None
+                if OUTPUT_TEMPERATURE in outputs:
+                    fout3 = writer.open(outPutPath + temperature_dir + filename
+                                        + 'temperature_log.csv')
+                    fout3.write("Time Stamp,ADXL_Temp,STM32_Temp, STM32_CAL1, STM32CAL2\n")
+
+                # Create and open Epoch File Log CSV File #
+                fout4 = writer.open(outPutPath + epoch_dir + filename
+                                    + 'epoch.csv')
+                fout4.write("Time Stamp,X, Y, Z\n")
+
+                # Create and open calibration Log CSV File #
+                fout_cal = None
+                if OUTPUT_CALIBRATION in outputs:
+                    fout_cal = writer.open(outPutPath + calibration_dir + filename
+                                           + 'calibration_log.csv')
+                    fout_cal.write('ts,x,y,z\n')
+
+                # Print File to console and Summary.txt file #
+                print('############  ' + file.name + '  ############')
+                if zipfiles:
+                    print('firmware version: %s' % firmware_version)
+                sumFile.write('Filename: %s\n' % str(file))
+                if zipfiles:
+                    sumFile.write('Firmware Version: %s\n' % firmware_version)
+                parse_start_date = datetime.now()
+                writer.sync(sumFile)
+
+                # Initialize Variables at beginning of each file #
+                if temperatureCalibration:
+                    temperatureCal = (temperatureGains, temperatureOffsets)
+                else:
+                    temperatureCal = (None, None)
+                state = ParseState(
+                    file=file, filename=filename, extractPath=extractPath, outPutPath=outPutPath, imu_dir=imu_dir,
+                    UseCalValues=UseCalValues, Log_Activity_Data=Log_Activity_Data, writer=writer,
+                    sumFile=sumFile, store=store, events=eventStore, adxl=adxl, fout1=fout1, fout2=fout2, fout3=fout3, fout_cal=fout_cal,
+                    i=0,
+                    activity_count=0,
+                    expected_reset_count=0,
+                    unexpected_reset_count=0,
+                    lasttimestamp=datetime.fromtimestamp(94694400, tz=timezone.utc),  #January 1, 1973 12:00:00 AM
+                    record_type=255,
+                    isIMUdata=0,
+                    imuParts=[],
+                    timedelta=0.0,
+                    # Activity data is decoded, checked and written in chunks bounded by the memory budget #
+                    activityStream=ActivityStream(memory_budget_mb, activitySinks),
+                    gapDetector=TimestampGapDetector(),
+                    lowRateRecords=LowRateRecords(),
+                    temperatureCal=temperatureCal)
+                if not(zipfiles):
+                    downloadDate_unix = int((datetime.now(tz=timezone.utc)- datetime.fromtimestamp(0, timezone.utc)).total_seconds())
+                if Temperature_Drift_File is not None:
+                    # The readings come from a framing pass over the log being parsed #
+                    def read_temperatures():
+                        with open(filetoopen, 'rb') as tin:
+                            return stream_temperatures(tin, min_dateTime_unix, downloadDate_unix, *temperatureCal)
+                    state.activityStream.drift = temperature_drift(file, read_temperatures)
+                    print(drift_report(state.activityStream.drift), end='')
+                    sumFile.write(drift_report(state.activityStream.drift))
+                logSize = os.path.getsize(filetoopen)
+                invalidRecordCount = 0
+                firstTimestampFound = False
+                getInvalidRecordBytes = False
+
+                # Create Raw Activity CSV file if Logging is enabled #
+                if Log_Activity_Data:
+                    fout1.write("Current Time Stamp,Previous Time Stamp, Delta,Type,Nearest Event,Event Time Stamp\n")
+
+                ##########################
+                # Start Parsing Log file #
+                ##########################
+
+                # Chain only the stages the options need (pipeline.py) #
+                records = parse(fin, min_dateTime_unix, downloadDate_unix, recordTypes)
+                jobCheckpoints = None
+                if job is not None:
+                    def check_job(record):
+                        job.set_part_progress(record.offset / logSize)
+                        return not job.cancelled
+                    jobCheckpoints = Checkpoints(JOB_CHECK_RECORDS, check_job)
+                    records = jobCheckpoints(records)
+                if not NoFilter:
+                    records = time_window(records, begin_timestamp, end_timestamp)
+
+                for record in records:
+                    timestamp = record.timestamp.strftime(FMT)
+                    unixTime = (record.timestamp - EPOCH).total_seconds()
+
+                    # Keep the summary in record order: finish pending activity before other events #
+                    if (getInvalidRecordBytes or record.type not in QUIET_RECORD_TYPES
+                            or (record.type in ACTIVITY_TYPES and len(record.payload) <= 2)):
+                        flush_activity(state.activityStream, state.gapDetector, sumFile, fout1, state.events)
+                        print_register_dumps(state.lowRateRecords)
+
+                    ############################
+                    # Invalid Record with      #
+                    # Valid Timestamp          #
+                    ############################
+                    error_list = [252, 253, 254]
+                    if record.type in error_list or getInvalidRecordBytes is True:
+
+                        if getInvalidRecordBytes is True:
+                            getInvalidRecordBytes = False
+                            # Bytes skipped after an invalid record come as a CORRUPT_BYTES record, reported below #
+                            if record.type != 252:
+                                sumFile.write('%-35s %-10s\n' % ('Invalid Record Size: ', str(record.bad_size)))
+                        if record.type == 252:
+                            # Bytes skipped to resynchronize, no record header to report #
+                            invalidRecordCount = invalidRecordCount + 1
+                            sumFile.write(
+                                '%-35s %-10s\n' % ('Corrupt Bytes @ Position: ', str(hex(record.payload))))
+                            sumFile.write('%-35s %-10s\n' % ('Invalid Record Size: ', str(record.size)))
+                            record_event(state, CORRUPT_BYTES, unixTime, record.size, hex(record.payload))
+                        elif record.type in error_list:
+                            invalidRecordCount = invalidRecordCount + 1
+                            address = hex(record.payload)
+                            if record.type == 253:
+                                sumFile.write(
+                                    '%-35s %-10s %10s\n' % ('Checksum Collision: ', timestamp,
+                                                            str(unixTime)))
+                                sumFile.write(
+                                    '%-35s %-10s\n' % ('Checksum Collision @ Position: ', str(address)))
+                                record_event(state, CHECKSUM_COLLISION, unixTime, record.size, address)
+                            else:
+                                sumFile.write(
+                                    '%-35s %-10s %10s\n' % ('Invalid Record @ Timestamp: ', timestamp,
+                                                            str(unixTime)))
+                                sumFile.write(
+                                    '%-35s %-10s\n' % ('Invalid Record @ Position: ', str(address)))
+                                record_event(state, INVALID_RECORD, unixTime, record.size, address)
+                            getInvalidRecordBytes = True
+
+                    if record.type in FIRST_TIMESTAMP_TYPES and firstTimestampFound is False:
+                        print_register_dumps(state.lowRateRecords)
+                        firstTimestampUnix = unixTime
+                        print('%-35s %-10s %10s' % (
+                            'First Record Timestamp: ', timestamp, str(unixTime)))
+                        sumFile.write(
+                            '%-35s %-10s %10s\n' % ('First Record Timestamp: ', timestamp,
+                                                    str(unixTime)))
+                        firstTimestampFound = True
+
+                    for handler in recordHandlers.get(record.type, ()):
+                        handler(state, record, timestamp, unixTime)
+
+                ######################################################
+                # Finish the last activity and low rate record chunk #
+                ######################################################
+                cancelled = jobCheckpoints is not None and jobCheckpoints.stopped
+                flush_activity(state.activityStream, state.gapDetector, sumFile, fout1, state.events)
+                write_low_rate_records(state.lowRateRecords, fout2, fout3, fout_cal, *state.temperatureCal)
+                activity_count = state.activity_count
+                expected_reset_count = state.expected_reset_count
+                unexpected_reset_count = state.unexpected_reset_count
+                lasttimestamp = state.lasttimestamp
+                record_type = state.record_type
+                pegs = state.activityStream.pegs
+                flats = state.activityStream.flats
+                timestampGap = state.gapDetector.count
+                nonWear = nonwear_periods(state.activityStream)
+                fout_nonwear = None
+                if OUTPUT_NONWEAR in outputs:
+                    Path(outPutPath + nonwear_dir).mkdir(parents=False, exist_ok=True)
+                    fout_nonwear = writer.open(outPutPath + nonwear_dir + filename + '_nonwear.csv')
+                    fout_nonwear.write('Start,End,Start Unix,End Unix,Minutes\n')
+                    write_nonwear(nonWear, fout_nonwear, state.events)
+
+                unixTime = (lasttimestamp - datetime.fromtimestamp(0, timezone.utc)).total_seconds()
+                print('%-35s %-15s %10s' % ('Last Timestamp: ', lasttimestamp.strftime(FMT), str(unixTime)))
+                print('%-35s %-15s ' % ('Total Time: ', (str(unixTime - firstTimestampUnix))))
+                print(' ')
+                print('%-45s %5s' % (('Total number of Activity (%s) records: ' %
+                                      hex(record_type)), str(activity_count)))
+                print('%-45s %5s' % ('Total number of Unexpected Resets: ', str(unexpected_reset_count)))
+                print('%-45s %5s' % ('Total number of Expected Resets: ', str(expected_reset_count)))
+                print('%-45s %5s' % ('Total number of Pegs: ', str(pegs)))
+                print('%-45s %5s' % ('Total flat areas: ', str(flats)))
+                print('%-45s %5s' % ('Timestamp Gaps: ', str(timestampGap)))
+                print('%-45s %5s' % ('Non-wear periods: ', str(len(nonWear))))
+                print('%-45s %5s' % ('Non-wear hours: ', str(nonwear_hours(nonWear))))
+                print(' ')
+                print('%-35s %-15s' % ('Parsing Start Date/Time: ', str(parse_start_date.strftime(FMT))))
+                print('%-35s %-15s' % ('Parsing Complete Date/Time: ', str(datetime.now().strftime(FMT))))
+                print(
+                    '%-35s %-15s' % ('Total Time to Parse: ', str(datetime.now() - parse_start_date)))
+                print(' ')
+
+                sumFile.write('%-35s %-15s %10s\n\n' % ('Last Timestamp: ', lasttimestamp.strftime(FMT), str(unixTime)))
+                sumFile.write('%-45s %5s\n' % (('Total number of Activity (%s) records: ' %
+                                                hex(record_type)), str(activity_count)))
+                sumFile.write(
+                    '%-45s %5s\n' % ('Total number of Unexpected Resets: ', str(unexpected_reset_count)))
+                sumFile.write('%-45s %5s\n' % ('Total number of Expected Resets: ', str(expected_reset_count)))
+                sumFile.write('%-45s %5s\n' % ('Total number of Pegs: ', str(pegs)))
+                sumFile.write('%-45s %5s\n' % ('Total flat areas: ', str(flats)))
+                sumFile.write('%-45s %5s\n' % ('Timestamp Gaps: ', str(timestampGap)))
+                sumFile.write('%-45s %5s\n' % ('Non-wear periods: ', str(len(nonWear))))
+                sumFile.write('%-45s %5s\n' % ('Non-wear hours: ', str(nonwear_hours(nonWear))))
+                sumFile.write('\n')
+                sumFile.write('%-35s %-15s\n' % ('Parsing Start Date/Time: ', str(parse_start_date.strftime(FMT))))
+                sumFile.write('%-35s %-15s\n' % ('Parsing Complete Date/Time: ', str(datetime.now().strftime(FMT))))
+                sumFile.write('%-35s %-15s\n' % ('Total Time to Parse: ',
+                                                 str(datetime.now() - parse_start_date)))
+                if cancelled:
+                    print('PARSE CANCELLED\n')
+                    sumFile.write('PARSE CANCELLED, outputs are incomplete\n')
+                sumFile.write('\n')
+
+                if not cancelled:
+                    fout_summary.write(summary_row(file, firmware_version, firstTimestampUnix, unixTime, activity_count,
+                                                   unexpected_reset_count, expected_reset_count, pegs, flats,
+                                                   timestampGap, nonWear))
+
+                writer.sync(sumFile, fout_summary)
+
+
+                if Log_Activity_Data:
+                    activityCsv.close()
+                    # read in data
+                    if createHtmlPlot:
+                        writer.wait()
+                        df = pd.read_csv(str(file) + '.csv')
+                        fig = px.line(df, x="t", y=['x', 'y', 'z', 'vm'], title='Acceleration',
+                                      labels={"value": "acceleration in G",
+                                              "t": "Seconds"
+                                              }
+                                      )
+                        fig.write_html(str(file) + '.html')
+                if state.isIMUdata:
+                    state.fout_imu.close()
+                    writer.wait()
+                for imuPath, imuHeader, imuName in state.imuParts:
+                    df_imu = pd.read_csv(imuPath)
+                    fig = px.line(df_imu, x="t", y=imuHeader[0:3], title='Acceleration',
+                                  labels={"value": "acceleration in G",
+                                          "Timestamp": "Seconds"
+                                          }
+                                  )
+                    fig2 = px.line(df_imu, x="t", y=imuHeader[4:7], title='Gyro',
+                                  labels={"value": "degrees/sec",
+                                          "Timestamp": "Seconds"
+                                          }
+                                  )
+                    fig3 = px.line(df_imu, x="t", y=imuHeader[3], title='Temperature',
+                                   labels={imuHeader[6]: "Celsius",
+                                           "Timestamp": "Seconds"
+                                           }
+                                   )
+                    imuBaseName = outPutPath + imu_dir + imuName
+                    fig.write_html(imuBaseName + '_accel.html')
+                    fig2.write_html(imuBaseName + '_gyro.html')
+                    fig3.write_html(imuBaseName + '_temp.html')
+                if store is not None:
+                    store.close()
+                if npySink is not None:
+                    npySink.close(state.activityStream.calibration is not None)
+                if countsSink is not None:
+                    countsSink.close()
+                if eventStore is not None:
+                    eventStore.close(complete=not cancelled)
+                adxl.close()
+                fout1.close()
+                for fout in (fout2, fout3, fout_cal, fout_nonwear):
+                    if fout is not None:
+                        fout.close()
+                fout4.close()
+                if OUTPUT_INDEX in outputs and not cancelled:
+                    save_record_index(file)
+                return not cancelled
+    finally:
+        if zipfiles:
+            shutil.rmtree(extractPath, ignore_errors=True)
+
+
+def save_record_index(file):
+    # Frames the log again for its .nidx file, unless it has a current one #
+    with NebulaLog.open(file, use_calibration=False, persist_index=True, index_dir=Index_Dir) as log:
+        log.index
+
+
+def merge_device_logs(files, outPutPath, sumFile):
+    # Logs to parse: single logs as they are, the logs of a device with
+    # several downloads merged into '<serial>_merged' under merge_dir. The
+    # merge report goes to sumFile.
+    parseFiles = []
+    for serial, paths in group_by_device(files).items():
+        if len(paths) == 1:
+            parseFiles.append(paths[0])
+            continue
+        Path(outPutPath + merge_dir).mkdir(parents=False, exist_ok=True)
+        merged = Path(outPutPath + merge_dir + serial + '_merged' + paths[0].suffix)
+        report = merge_logs(paths, merged)
+        text = ('MERGED %s: %s\n%d records, %d duplicates dropped, %d corrupt bytes skipped\n'
+                % (merged.name, ', '.join(p.name for p in paths), report.records, report.duplicates,
+                   report.corrupt_bytes))
+        for conflict in report.conflicts:
+            text += ('Merge conflict @ %s: record type %d differs in %s\n'
+                     % (conflict.timestamp.strftime(FMT), conflict.record_type,
+                        ', '.join(os.path.basename(p) for p in conflict.inputs)))
+        sumFile.write(text + '\n')
+        print(text)
+        parseFiles.append(merged)
+    return parseFiles
+
+
+def log_files(basePath, zipfiles):
+    # (log files of basePath, number of files) #
+    if zipfiles:
+        files = Path(basePath).glob('*.[ag][gt][d3][cx]')
+        filetotal = len(fnmatch.filter(os.listdir(basePath), '*.agdc'))
+        filetotal += len(fnmatch.filter(os.listdir(basePath), '*.gt3x'))
+    else:
+        files = Path(basePath).glob('*.[db][ai][tn]')
+        filetotal = len(fnmatch.filter(os.listdir(basePath), '*.bin'))
+        filetotal += len(fnmatch.filter(os.listdir(basePath), '*.dat'))
+    return files, filetotal
 
-    global message, progress, totallogsize
+
+def main_process(Log_Activity_Data, NoFilter, UseCalValues, zipfiles, basePath, begin_timestamp, end_timestamp,
+                 durability=FSYNC_PER_FILE, memory_budget_mb=MEMORY_BUDGET_MB, outputs=ALL_OUTPUTS,
+                 compression=NO_COMPRESSION, split_seconds=File_Split_Level, merge=False, files=None, job=None,
+                 event_db=None):
+    # Parses every log of basePath, or only the logs in files. With a job
+    # the progress is reported per file and a cancelled job stops after the
+    # current record batch. Returns (parse summary path, files parsed).
+
+    outputs = resolve_outputs(Log_Activity_Data, outputs)
+
+    outPutPath = basePath + output_dir
+    create_output_folders(outPutPath)
+
+    filenumber = 1
 
     if begin_timestamp != "":
         begin_timestamp = datetime.fromtimestamp(int(begin_timestamp), tz=timezone.utc)
@@ -369,811 +993,343 @@ def main_process(Log_Activity_Data, NoFilter, UseCalValues, zipfiles, basePath,
     if end_timestamp != "":
         end_timestamp = datetime.fromtimestamp(int(end_timestamp), tz=timezone.utc)
 
+    # All outputs are written by a background thread so parsing never waits on the disk #
+    writer = BackgroundWriter(durability, compression=compression)
+
     d = datetime.now()
-    with open(outPutPath + '/Parse_Summary_%s.txt' % d.strftime('%Y_%m_%d-%H_%M_%S'), "w") as sumFile:
+    summaryPath = outPutPath + '/Parse_Summary_%s.txt' % d.strftime('%Y_%m_%d-%H_%M_%S')
+    parsedFiles = 0
+    with writer.open(summaryPath, compress=False) as sumFile:
 
         sumFile.write('APP_VERSION: %s\n\n' % VERSION)
         print('\nAPP_VERSION: %s\n' % VERSION)
         # Create and open Summary File #
-        fout_summary = open(outPutPath + 'summary_file.csv', "w")
-        fout_summary.write('filename,firmware version,First Activity Timestamp,Last Activity Timestamp,'
-                           'Activity records,Unexpected Resets,Expected Resets,Pegs,flat areas,'
-                           'Timestamp Gaps\n')
+        fout_summary = writer.open(outPutPath + 'summary_file.csv', compress=False)
+        fout_summary.write(SUMMARY_HEADER)
 
         #zipfiles = 1
-        if zipfiles:
-            files = Path(basePath).glob('*.[ag][gt][d3][cx]')
-            filetotal = len(fnmatch.filter(os.listdir(basePath), '*.agdc'))
-            filetotal += len(fnmatch.filter(os.listdir(basePath), '*.gt3x'))
+        if files is not None:
+            files = [Path(f) for f in files]
+            filetotal = len(files)
         else:
-            files = Path(basePath).glob('*.[db][ai][tn]')
-            filetotal = len(fnmatch.filter(os.listdir(basePath), '*.bin'))
-            filetotal += len(fnmatch.filter(os.listdir(basePath), '*.dat'))
+            files, filetotal = log_files(basePath, zipfiles)
+
+        # Overlapping downloads of one device are merged into one log first #
+        if merge:
+            files = merge_device_logs(sorted(files), outPutPath, sumFile)
+            filetotal = len(files)
 
         # Get all log files #
         #for file in glob.glob(basePath + "/*.[dat][bin]"):
         for file in files:
-            skip_file = 0
+            if job is not None:
+                if job.cancelled:
+                    break
+                job.start_part(filenumber - 1, filetotal)
             print("file %s of %s" % (filenumber, filetotal))
             filenumber += 1
-            if file.name.startswith('CPW'):
-                min_dateTime_unix = 1514764800
-            else:
-                min_dateTime_unix = 1262304000
-
-            if zipfiles:
-                # Iterate through each file #
-                if zipfile.is_zipfile(file):
-                    with zipfile.ZipFile(file, 'r') as zf:
-                        zf.extract('log.bin', basePath)
-                        if str(file).endswith('.agdc'):
-                            zf.extract('calibration.json', basePath)
-                            try:
-                                zf.extract('temperature_calibration.json', basePath)
-                                tempcalvals = import_temperature_calibration_values(basePath + '/temperature_calibration.json')
-                                if tempcalvals[0] != 0:
-                                    temperatureCalibration = True
-                                    gainMcu = (tempcalvals[4] - tempcalvals[5]) / (tempcalvals[0] - tempcalvals[1])
-                                    gainAdxl = (tempcalvals[4] - tempcalvals[5]) / (tempcalvals[2] - tempcalvals[3])
-                                    offsetMcu = tempcalvals[4] - (gainMcu * tempcalvals[0])
-                                    offsetAdxl = tempcalvals[4] - (gainAdxl * tempcalvals[2])
-                                else:
-                                    temperatureCalibration = False
-                                    print('\nWARNING!!!!!!!   Temperature Calibration File has default values!!!!!!!!!\n')
-                            except:
-                                temperatureCalibration = False
-
-
-                            zf.extract('info.json', basePath)
-
-                            with open(basePath + '/info.json', 'r') as info_file:
-                                jsonReader = json.load(info_file)
-                                firmware_version = jsonReader["firmware"]
-                                #target_start_time_unix = jsonReader["startDate"]
-                                downloadDate_unix = jsonReader["lastSampleTime"] + 86400
-                        else:
-                            zf.extract('info.txt',basePath)
+            if process_file(file, zipfiles, basePath, writer, sumFile, fout_summary, outputs, NoFilter, UseCalValues,
+                            begin_timestamp, end_timestamp, memory_budget_mb, split_seconds, job, event_db):
+                parsedFiles += 1
+    sumFile.close()
+    fout_summary.close()
+    writer.close()
+    print('FINISHED\n')
+    return summaryPath, parsedFiles
 
-                            with open(basePath + '/info.txt', 'r') as info_file:
-                                for line in info_file:
-                                    if "Firmware" in line:
-                                        firmware_version = line[-6:].rstrip('\n')
-                                    if "Last Sample Time" in line:
-                                        number = int(line[-19:].rstrip('\n'))
-                                        downloadDate_unix = ticks_to_unix(number)
 
-                    filetoopen = basePath + '/log.bin'
-                else:
-                    skip_file = 1
-            else:
-                filetoopen = file
-                firmware_version = "dat or bin file only"
-
-            if not skip_file:
-                filename = Path(file).stem
-                with open(filetoopen, 'rb') as fin:
-                    if Log_Activity_Data:
-                        fout = open(outPutPath + adxl_dir + filename + '.csv', "w")
-                        fout.write('ts,t,x,y,z,vm\n')
-
-                    adxl = open(outPutPath + adxl_dir + time_stamp_only_dir + filename + '_ts_only.csv', "w")
-                    adxl.write('ts,record_length,Unix Timestamp\n')
-
-                    # Create and open Timestamp Issue CSV File #
-                    fout1 = open(outPutPath + timeGap_dir + filename
-                                 + '_datetime_Gap.csv', "w")
-
-                    # Create and open Battery Log CSV File #
-                    fout2 = open(outPutPath + battery_dir + filename
-                                 + 'battery_log.csv', "w")
-                    fout2.write("Time Stamp,Batter_Voltage\n")
+#####################################################################
+# Triage mode: only the summary_file.csv row of each log. Records are
+# framed in bulk (NebulaLog), activity only goes through the peg/flat
+# detectors and timestamps through find_timestamp_gaps, no sample is
+# written. The row is the one a full parse with activity logging
+# writes. Logs are triaged in parallel worker processes.
+#####################################################################
+TRIAGE_REPORT = 'Parse_Summary_triage_%s.txt'
+
+
+def container_firmware(file):
+    # Firmware version as process_file reads it from info.json/info.txt #
+    with zipfile.ZipFile(file, 'r') as zf:
+        if str(file).endswith('.agdc'):
+            return json.loads(zf.read('info.json'))["firmware"]
+        firmware_version = ''
+        for line in zf.read('info.txt').decode('utf-8', 'replace').splitlines(keepends=True):
+            if "Firmware" in line:
+                firmware_version = line[-6:].rstrip('\n')
+        return firmware_version
+
+
+def triage_file(path, UseCalValues=False, memory_budget_mb=MEMORY_BUDGET_MB, persist_index=False):
+    # (summary row, report text) of one log. persist_index reads the
+    # record index from the log's .nidx file, or saves it there. The log
+    # is memory mapped (a container's log.bin after extracting it to a
+    # temporary file), so a worker never holds the whole log in memory.
+    file = Path(path)
+    zipped = file.suffix.lower() in ZIP_EXTENSIONS
+    firmware_version = container_firmware(file) if zipped else "dat or bin file only"
+    with NebulaLog.open(file, persist_index=persist_index, index_dir=Index_Dir) as log:
+        return triage_log(log, file, zipped, firmware_version, UseCalValues, memory_budget_mb)
+
+
+def triage_log(log, file, zipped, firmware_version, UseCalValues, memory_budget_mb):
+    types, times, sizes = log.index.types, log.index.times, log.index.sizes
+
+    first = np.flatnonzero(np.isin(types, FIRST_TIMESTAMP_TYPES))
+    firstTimestampUnix = float(times[first[0]]) if len(first) else ''
+
+    # Resets (one byte event records) and USB dock (empty activity records) #
+    events = np.flatnonzero((types == 3) & (sizes == 1))
+    codes = np.array([bytes(p)[0] for p in log._payloads(events)], dtype=np.int64)
+    expected_reset_count = int(np.count_nonzero(codes == 0x0d))
+    unexpected_reset_count = int(np.count_nonzero(codes == 0x01))
+
+    isActivity = np.isin(types, ACTIVITY_TYPES)
+    activityRows = np.flatnonzero(isActivity & (sizes > 1))
+    activity_count = len(activityRows)
+    lastTimestampUnix = float(times[activityRows[-1]]) if activity_count else 94694400.0
+
+    # Gaps between activity timestamps, duplicates are not counted #
+    gaps = find_timestamp_gaps(times[activityRows])
+    timestampGap = int(np.count_nonzero(gaps.kind != DUPLICATE))
+
+    # Calibration as handle_activity applies it, from the first activity record #
+    stream = ActivityStream(memory_budget_mb)
+    stream.drift = temperature_drift(file, lambda: log_temperatures(log))
+    firstActivity = np.flatnonzero(isActivity)[:1]
+    if len(firstActivity) and types[firstActivity[0]] == 27:
+        calFile = os.path.splitext(str(file))[0] + '.cal'
+        calvals = None
+        if os.path.isfile(calFile):
+            calvals = import_calibration_values(calFile)
+        elif str(file).endswith('.agdc') and UseCalValues:
+            calvals = log.calibration
+        if calvals is not None:
+            FS = int(sizes[firstActivity[0]] / 4.5)
+            stream.calibration = calibration_matrices(calvals, FS)
+            stream.calibrated = True
+
+    for k, (record_type, unixTime, payload) in enumerate(zip(types[activityRows].tolist(),
+                                                              times[activityRows].tolist(),
+                                                              log._payloads(activityRows))):
+        if stream.needs_flush(record_type):
+            stream.flush()
+        stream.add(record_type, None, unixTime, payload, k == 0)
+    stream.flush()
+    nonWear = nonwear_periods(stream)
+
+    row = summary_row(file, firmware_version, firstTimestampUnix, lastTimestampUnix, activity_count,
+                      unexpected_reset_count, expected_reset_count, stream.pegs, stream.flats, timestampGap, nonWear)
+    report = 'Filename: %s\n' % str(file)
+    if zipped:
+        report += 'Firmware Version: %s\n' % firmware_version
+    if Temperature_Drift_File is not None:
+        report += drift_report(stream.drift)
+    report += ('%-45s %5s\n' % ('Total number of Activity records: ', str(activity_count))
+               + '%-45s %5s\n' % ('Total number of Unexpected Resets: ', str(unexpected_reset_count))
+               + '%-45s %5s\n' % ('Total number of Expected Resets: ', str(expected_reset_count))
+               + '%-45s %5s\n' % ('Total number of Pegs: ', str(stream.pegs))
+               + '%-45s %5s\n' % ('Total flat areas: ', str(stream.flats))
+               + '%-45s %5s\n' % ('Timestamp Gaps: ', str(timestampGap))
+               + '%-45s %5s\n' % ('Non-wear periods: ', str(len(nonWear)))
+               + '%-45s %5s\n' % ('Non-wear hours: ', str(nonwear_hours(nonWear)))
+               + '%-45s %5s\n\n' % ('Corrupt byte ranges: ', str(len(log.corrupt_ranges))))
+    return row, report
+
+
+def triage_process(zipfiles, basePath, UseCalValues=False, workers=None, memory_budget_mb=MEMORY_BUDGET_MB,
+                   files=None, job=None, persist_index=False):
+    # Triages the logs of basePath (or files) into summary_file.csv and a
+    # triage report. Returns (report path, files triaged) like main_process.
+    outPutPath = basePath + output_dir
+    Path(outPutPath).mkdir(parents=True, exist_ok=True)
+    if files is None:
+        files, _ = log_files(basePath, zipfiles)
+    files = [Path(f) for f in files]
+    reportPath = outPutPath + TRIAGE_REPORT % datetime.now().strftime('%Y_%m_%d-%H_%M_%S')
+    print('\nAPP_VERSION: %s\nTriaging %d file(s)\n' % (VERSION, len(files)))
+
+    results = [None] * len(files)
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(triage_file, str(f), UseCalValues, memory_budget_mb, persist_index): k
+                   for k, f in enumerate(files)}
+        done = 0
+        for future in concurrent.futures.as_completed(futures):
+            k = futures[future]
+            try:
+                results[k] = future.result()
+            except Exception as e:
+                results[k] = (None, 'Filename: %s\nTRIAGE FAILED: %r\n\n' % (str(files[k]), e))
+            done += 1
+            print(results[k][1], end='')
+            if job is not None:
+                job.start_part(done, len(files))
+                if job.cancelled:
+                    for pending in futures:
+                        pending.cancel()
+                    break
+
+    # Rows in file order, whatever order the workers finished in #
+    with open(outPutPath + 'summary_file.csv', 'w') as fout_summary, open(reportPath, 'w') as report:
+        fout_summary.write(SUMMARY_HEADER)
+        report.write('APP_VERSION: %s\nTRIAGE\n\n' % VERSION)
+        for result in results:
+            if result is None:
+                continue
+            row, text = result
+            if row is not None:
+                fout_summary.write(row)
+            report.write(text)
+    print('FINISHED\n')
+    return reportPath, sum(1 for r in results if r is not None and r[0] is not None)
 
-                    # Create and open Temperature Log CSV File #
-                    fout3 = open(outPutPath + temperature_dir + filename
-                                 + 'temperature_log.csv', "w")
-                    fout3.write("Time Stamp,ADXL_Temp,STM32_Temp, STM32_CAL1, STM32CAL2\n")
 
-                    # Create and open Epoch File Log CSV File #
-                    fout4 = open(outPutPath + epoch_dir + filename
-                                 + 'epoch.csv', "w")
-                    fout4.write("Time Stamp,X, Y, Z\n")
+#####################################################################
+# Watch folder mode: new logs are parsed as they arrive, each in a
+# worker process. A worker writes its report and summary row to a
+# private folder and returns them; the watcher appends them to the
+# shared files so rows never interleave.
+#####################################################################
+WATCH_REPORT = 'Parse_Summary_watch.txt'
+WATCH_SUMMARY = 'summary_file.csv'
+
+
+def watch_job(outputs, UseCalValues, durability, memory_budget_mb, compression, event_db, path, folder, job=None):
+    file = Path(path)
+    zipfiles = file.suffix.lower() in ZIP_EXTENSIONS
+    create_output_folders(folder + output_dir)
+
+    jobPath = tempfile.mkdtemp(prefix='nebula_job_')
+    try:
+        writer = BackgroundWriter(durability, compression=compression)
+        sumFile = writer.open(jobPath + '/report.txt', compress=False)
+        fout_summary = writer.open(jobPath + '/summary.csv', compress=False)
+        process_file(file, zipfiles, folder, writer, sumFile, fout_summary, outputs, 1, UseCalValues, '', '',
+                     memory_budget_mb, job=job, event_db=event_db)
+        sumFile.close()
+        fout_summary.close()
+        writer.close()
+        with open(jobPath + '/report.txt', 'r') as report, open(jobPath + '/summary.csv', 'r') as row:
+            return report.read(), row.read()
+    finally:
+        shutil.rmtree(jobPath, ignore_errors=True)
+
+
+def watch_folders(folders, Log_Activity_Data=0, UseCalValues=0, workers=None, interval=WATCH_INTERVAL,
+                  durability=FSYNC_PER_FILE, memory_budget_mb=MEMORY_BUDGET_MB, compression=NO_COMPRESSION,
+                  outputs=ALL_OUTPUTS, event_db=None):
+    print('\nAPP_VERSION: %s\n' % VERSION)
+    outputs = resolve_outputs(Log_Activity_Data, outputs)
+    job = functools.partial(watch_job, outputs, UseCalValues, durability, memory_budget_mb, compression, event_db)
+    watcher = FolderWatcher(folders, job, lambda folder: folder + output_dir, WATCH_REPORT, WATCH_SUMMARY,
+                            SUMMARY_HEADER, workers, interval)
+    print('Watching %s (Ctrl+C to stop)' % ', '.join(watcher.folders))
+    watcher.run()
+    print('Stopped watching')
 
-                    # Create and open calibration Log CSV File #
-                    fout_cal = open(outPutPath + calibration_dir + filename
-                                 + 'calibration_log.csv', "w")
-                    fout_cal.write('ts,x,y,z\n')
 
-                    # Print File to console and Summary.txt file #
-                    print('############  ' + file.name + '  ############')
-                    if zipfiles:
-                        print('firmware version: %s' % firmware_version)
-                    sumFile.write('Filename: %s\n' % str(file))
-                    if zipfiles:
-                        sumFile.write('Firmware Version: %s\n' % firmware_version)
-                    parse_start_date = datetime.now()
-                    sumFile.flush()
-                    os.fsync(sumFile)
-
-                    # Initialize Variables at beginning of each file #
-                    i = 0
-                    activity_count = 0
-                    expected_reset_count = 0
-                    unexpected_reset_count = 0
-                    peggedState = False
-                    pegs = 0
-                    flatRegionState = False
-                    flats = 0
-                    firstFile = True
-                    lasttimestamp = datetime.fromtimestamp(94694400, tz=timezone.utc)  #January 1, 1973 12:00:00 AM
-                    timestampGap = 0
-                    isCalVals = False
-                    isCalibrated = False
-                    record_type = 255
-                    isIMUdata = 0
-                    timedelta = 0.0
-                    timedelta_accel = 0.0
-                    timedelta_temp = 0.0
-                    incrementsize = 1
-                    totallogsize = os.path.getsize(filetoopen)
-                    cal_orienatation = False
-                    numberRows = 0
-                    invalidRecordCount = 0
-                    firstTimestampFound = False
-                    getInvalidRecordBytes = False
-
-                    # Create Raw Activity CSV file if Logging is enabled #
-                    if Log_Activity_Data:
-                        fout1.write("Current Time Stamp,Previous Time Stamp, Delta\n")
-
-                    ##########################
-                    # Start Parsing Log file #
-                    ##########################
-                    if not(zipfiles):
-                        downloadDate_unix = int((datetime.now(tz=timezone.utc)- datetime.fromtimestamp(0, timezone.utc)).total_seconds())
-
-                    for record in parse(fin, min_dateTime_unix, downloadDate_unix):
-                        timestamp = record.timestamp.strftime(FMT)
-                        unixTime = (record.timestamp - datetime.fromtimestamp(0, timezone.utc)).total_seconds()
-
-                        #progress += total / (update * 10)
-                        if not (NoFilter) and record.timestamp > end_timestamp:
-                            break
-
-                        if NoFilter or (begin_timestamp < record.timestamp < end_timestamp):
-                            ############################
-                            # Invalid Record with      #
-                            # Valid Timestamp          #
-                            ############################
-                            error_list = [253, 254]
-                            if record.type in error_list or getInvalidRecordBytes is True:
-
-                                if getInvalidRecordBytes is True:
-                                    sumFile.write('%-35s %-10s\n' % ('Invalid Record Size: ', str(record.bad_size)))
-                                    getInvalidRecordBytes = False
-                                else:
-                                    invalidRecordCount = invalidRecordCount + 1
-                                    address = hex(record.payload)
-                                    if record.type == 253:
-                                        sumFile.write(
-                                            '%-35s %-10s %10s\n' % ('Checksum Collision: ', timestamp,
-                                                                    str(unixTime)))
-                                        sumFile.write(
-                                            '%-35s %-10s\n' % ('Checksum Collision @ Position: ', str(address)))
-                                    else:
-                                        sumFile.write(
-                                            '%-35s %-10s %10s\n' % ('Invalid Record @ Timestamp: ', timestamp,
-                                                                    str(unixTime)))
-                                        sumFile.write(
-                                            '%-35s %-10s\n' % ('Invalid Record @ Position: ', str(address)))
-                                    getInvalidRecordBytes = True
-
-                            eventList = [0, 26, 27, 37, 36, 35, 33, 32, 31, 100]
-
-                            if record.type in eventList and firstTimestampFound is False:
-                                firstTimestamp = record.timestamp
-                                firstTimestampUnix = unixTime
-                                print('%-35s %-10s %10s' % (
-                                    'First Record Timestamp: ', timestamp, str(unixTime)))
-                                sumFile.write(
-                                    '%-35s %-10s %10s\n' % ('First Record Timestamp: ', timestamp,
-                                                            str(unixTime)))
-                                firstTimestampFound = True
-
-                            ############################
-                            # Parse if Activity Record #
-                            ############################
-                            if (record.type == 27 or record.type == 26 or record.type == 0):
-                                record_type = record.type
-                                activityRecordLen = len(record.payload) / 2
-
-                                # Locate and log first Activity Timestamp #
-                                if i < 1:
-                                    if record.type == 27:
-                                        base_file = os.path.splitext(file)[0]
-                                        if os.path.isfile(base_file + '.cal') or os.path.isfile(basePath + '/calibration.json') and UseCalValues:
-                                            FS = int(len(record.payload) / 2 / 4.5)
-                                            isCalVals = True
-                                            isCalibrated = True
-                                            if os.path.isfile(base_file + '.cal'):
-                                                calvals = import_calibration_values(base_file + '.cal')
-                                            else:
-                                                calvals = import_calibration_values(basePath + '/calibration.json')
-                                            txt032 = calvals[0:18]
-                                            txt064 = calvals[18:36]
-                                            txt128 = calvals[36:54]
-                                            txt256 = calvals[54:72]
-
-                                            if FS == 32:
-                                                txt = txt032
-                                                O = txt[9:12]
-                                                G = txt[12:15]
-                                                X = txt[15:18]
-                                            elif FS == 64:
-                                                txt = txt064
-                                                O = txt[9:12]
-                                                G = txt[12:15]
-                                                X = txt[15:18]
-                                            elif FS == 128:
-                                                txt = txt128
-                                                O = txt[9:12]
-                                                G = txt[12:15]
-                                                X = txt[15:18]
-                                            elif FS == 256:
-                                                txt = txt256
-                                                O = txt[9:12]
-                                                G = txt[12:15]
-                                                X = txt[15:18]
-
-                                            O = np.reshape(O, (3, 1))
-
-                                            S = np.array([[np.power((G[0] * 0.01), -1),
-                                                           ((np.power((X[0] * 0.01 + 250), -1)) - 0.004),
-                                                           (np.power((X[1] * 0.01 + 250), -1) - 0.004)],
-                                                          [((np.power((X[0] * 0.01 + 250), -1)) - 0.004),
-                                                           (np.power(G[1] * 0.01, -1)),
-                                                           (np.power((X[2] * 0.01 + 250), -1) - 0.004)],
-                                                          [(np.power((X[1] * 0.01 + 250), -1) - 0.004),
-                                                           (np.power((X[2] * 0.01 + 250), -1) - 0.004),
-                                                           (np.power(G[2] * 0.01, -1))]])
-
-                                # Check for 0 length Record (i.e. USB connect) #
-                                if 1 < len(record.payload) / 2:
-
-                                # Check to see if date/time filter is enabled and within range #
-                                #if NoFilter or (begin_timestamp < record.timestamp < end_timestamp):
-
-                                    activity_count = activity_count + 1
-                                    adxl.write('%s,%d,%s\n' % (timestamp, activityRecordLen, str(unixTime)))
-
-                                    ##############################
-                                    # Check for Timestamp issues #
-                                    ##############################
-                                    currenttimestamp = record.timestamp
-                                    difference = currenttimestamp - lasttimestamp
-                                    diff_in_s = difference.total_seconds()
-                                    if (abs(diff_in_s) > 1 or diff_in_s < 0) and activity_count > 2:
-                                        sumFile.write('%-35s %-15s %10s\n' % ('Timestamp Gap @ : ',
-                                                                              str(record.timestamp.strftime(FMT)),
-                                                                              str(unixTime)))
-                                        timestampGap = timestampGap + 1
-                                        fout1.write("%s,%s,%s\n" % (currenttimestamp, lasttimestamp, diff_in_s))
-                                    lasttimestamp = currenttimestamp
-                                    #################################################################################
-
-                                    ##########################
-                                    # Parse activity records #
-                                    ##########################
-                                    h = BitStream(hex=record.payload)
-                                    lengthBytes = int(len(h.bytes))
-                                    if record.type == 27 or record.type == 0:  # Nebula or Moses
-                                        incrementsize += lengthBytes
-                                        accelFS = lengthBytes / 4.5
-                                    else:  # Taso
-                                        incrementsize += lengthBytes
-                                        accelFS = lengthBytes / 6
-                                        isCalibrated = True
-
-                                    if Log_Activity_Data:
-                                        current_timedelta_accel = float(1 / accelFS)
-                                        for j in range(0, int(accelFS)):
-                                            timestamp = record.timestamp.strftime(FMT)
-                                            if Log_Activity_Data:
-                                                fout.write("%s," % timestamp)
-                                                timedelta_accel += current_timedelta_accel
-                                                fout.write("%.3f," % timedelta_accel)
-                                            if record.type == 27:  # Nebula
-                                                r = h.readlist("int:n, int:n, int:n", n=12)
-                                                x, y, z = map(lambda f: f / 1, r)
-                                                if isCalVals:
-                                                    V = np.array([[x], [y], [z]])
-                                                    accel = np.dot(S, (V - O))
-                                                    x = float(accel[0][0])
-                                                    y = float(accel[1][0])
-                                                    z = float(accel[2][0])
-                                            elif record.type == 0: # Moses
-                                                r = h.readlist("int:n, int:n, int:n", n=12)
-                                                x, y, z = map(lambda t: t / 256.0, r)
-                                            else:  # Taso
-                                                r = h.readlist("intle:n, intle:n, intle:n", n=16)
-                                                x, y, z = map(lambda t: t / 256.0, r)
-
-                                            numberRows = numberRows + 1
-                                            vm = math.sqrt(x ** 2 + y ** 2 + z ** 2)
-                                            fout.write("%.6f,%.6f,%.6f,%.6f\n" % (x, y, z, vm))
-                                            ####################################################################################
-
-                                            #########################
-                                            # CHECK FOR PEGGED DATA #
-                                            #########################
-                                            if check_for_peg(x, y, z, activity_count, isCalibrated):
-                                                if peggedState is False:
-                                                    print('%-35s %-15s %10s' % ('peg @ : ', timestamp, str(unixTime)))
-                                                    sumFile.write('%-35s %-15s %10s\n' % ('peg @ : ', timestamp,
-                                                                                          str(unixTime)))
-                                                    pegs = pegs + 1
-                                                    peggedState = True
-                                            else:
-                                                if peggedState is True:
-                                                    print('%-35s %-15s %10s' % (
-                                                        'peg cleared @ : ', timestamp, str(unixTime)))
-                                                    sumFile.write('%-35s %-15s %10s\n' % ('peg cleared @ : ', timestamp,
-                                                                                          str(unixTime)))
-                                                peggedState = False
-                                            ####################################################################################
-
-                                            ########################
-                                            # Check For Flat Areas #
-                                            ########################
-                                            if check_for_flat(x, y, z, activity_count, isCalVals, accelFS):
-                                                if flatRegionState is False and peggedState is False:
-                                                    print('%-35s %-15s %10s' % ('Flat Region @ : ', timestamp,
-                                                                                str(unixTime)))
-                                                    sumFile.write('%-35s %-15s %10s\n' % ('Flat Region @ : ',
-                                                                                          timestamp, str(unixTime)))
-                                                    flatRegionState = True
-                                                    flats = flats + 1
-                                            else:
-                                                if flatRegionState is True:
-                                                    print('%-35s %-15s %10s' % ('Flat region cleared @ : ', timestamp,
-                                                                                str(unixTime)))
-                                                    sumFile.write(
-                                                        '%-35s %-15s %10s\n' % ('Flat region cleared @ : ', timestamp,
-                                                                                str(unixTime)))
-                                                    flatRegionState = False
-                                            ####################################################################################
-
-                                else:
-                                    timestamp = record.timestamp.strftime(FMT)
-                                    print('%-35s %-15s %10s' % ('USB DOCK @ : ', timestamp, str(unixTime)))
-                                    sumFile.write('%-35s %-15s %10s\n' % ('USB DOCK @ : ', timestamp, str(unixTime)))
-                                i = i + 1
-
-                            if LOG_IMU:
-                                ###########################
-                                # Parse STM32 IMU Schema  #
-                                ###########################
-                                #if record.type == 30 or record.type == 24:
-                                if record.type == 24:
-                                    # timestamp = record.timestamp.strftime(FMT)
-                                    imuHeader = []
-                                    isIMUdata = 1
-                                    fout_imu = open(str(file) + '_imu.csv', "w")
-                                    fout_imu.write("Timestamp,t,")
-                                    h = BitStream(hex=record.payload)
-
-                                    h.readlist("uintle:n", n=16)
-                                    IMU_COLUMN = h.readlist("uintle:n", n=16)
-                                    h.readlist("uintle:n", n=16)
-
-                                    n = 0
-                                    payload_length = 0
-                                    while n < IMU_COLUMN[0]:
-                                        IMU_COLUMN_FLAGS = h.readlist("uint:n", n=8)
-                                        IMU_COLUMN_OFFSET = h.readlist("uint:n", n=8)
-                                        IMU_COLUMN_SIZE = h.readlist("uint:n", n=8)
-                                        IMU_SCALE_FACTOR = h.readlist("uint:n", n=32)
-                                        IMU_COLUMN_HEADER = h.readlist("bytes:n", n=16)
-                                        imuHeader.append(IMU_COLUMN_HEADER[0].decode('utf-8'))
-                                        fout_imu.write("%s," % (IMU_COLUMN_HEADER[0].decode('utf-8')))
-                                        print(IMU_COLUMN_FLAGS)
-                                        print(IMU_COLUMN_OFFSET)
-                                        print(IMU_COLUMN_SIZE)
-                                        payload_length += (IMU_COLUMN_SIZE[0]/8)
-                                        print(IMU_SCALE_FACTOR)
-                                        print(IMU_COLUMN_HEADER[0].decode('utf-8'))
-                                        n += 1
-                                    fout_imu.write("\n")
-
-                                # ###########################
-                                # # Parse STM32 IMU Records #
-                                # ###########################
-                                # if record.type == 31:
-                                #     #timestamp = record.timestamp.strftime(FMT)
-                                #     h = BitStream(hex=record.payload)
-                                #     FS2 = int(len(h.bytes) / payload_length)
-                                #     current_timedelta = float(1/FS2)
-                                #     for z in range(0, FS2):
-                                #         #timestamp = record.timestamp.strftime(FMT)
-                                #         timedelta += current_timedelta
-                                #         fout_imu.write("%s," % timedelta)
-                                #         imu = h.readlist("int:n, int:n, int:n, int:n, int:n, int:n", n=16)
-                                #         temp = h.readlist("int:n", n=8)
-                                #         ts = h.readlist("uint:n", n=16)
-                                #         xa, ya, za, xg, yg, zg = map(lambda gy: gy / 1, imu)
-                                #         temp1 = temp[0]
-                                #         ts1 = ts[0]
-                                #         fout_imu.write("%f,%f,%f,%f,%f,%f,%f,%f\n" % (xa, ya, za, xg, yg, zg, temp1, ts1))
-
-                                ###########################
-                                # Parse Taso IMU Records #
-                                ###########################
-                                if record.type == 25:
-                                    # timestamp = record.timestamp.strftime(FMT)
-                                    h = BitStream(hex=record.payload)
-                                    FS2 = int(len(h.bytes) / payload_length)
-                                    current_timedelta = float(1 / FS2)
-                                    h.readlist("int:n", n=16)
-                                    for p in range(0, FS2):
-                                        timestamp = record.timestamp.strftime(FMT)
-                                        timedelta += current_timedelta
-                                        fout_imu.write("%s," % timestamp)
-                                        fout_imu.write("%s," % timedelta)
-                                        imu_acc = h.readlist("int:n, int:n, int:n", n=16)
-                                        imu_temp = h.readlist("int:n", n=16)
-                                        imu_gyr = h.readlist("int:n, int:n, int:n", n=16)
-                                        imu_mag = h.readlist("int:n, int:n, int:n", n=16)
-                                        h.readlist("int:n", n=8)
-                                        xa, ya, za = map(lambda gy: float(gy) / 1, imu_acc)
-                                        temperature = (float(imu_temp[0]) / 1) + 21
-                                        xg, yg, zg = map(lambda gy: float(gy) / 1, imu_gyr)
-                                        xm, ym, zm = map(lambda gy: float(gy) / 1, imu_mag)
-                                        fout_imu.write(
-                                            "%f,%f,%f,%f,%f,%f,%f,%f,%f,%f\n" % (xa, ya, za, temperature, xg, yg, zg, xm, ym, zm))
-
-                            ########################
-                            # Parse Battery Record #
-                            ########################
-                            if record.type == 2:
-                                batt = bytearray.fromhex(record.payload)
-                                batt.reverse()
-                                batt = ''.join(format(x, '02x') for x in batt)
-                                timestamp = record.timestamp.strftime(FMT)
-                                try:
-                                    batt = int(batt, 16) * 0.001
-                                except:
-                                    print('issue with battery record')
-                                fout2.write("%s,%f\n" % (timestamp, batt))
-                                incrementsize += len(record.payload)/2
-
-                            ########################
-                            # Parse Temp Records #
-                            ########################
-                            if record.type == 30:
-                                timedelta_temp += 4 # TODO Make adjustable
-                                t = bytearray.fromhex(record.payload)
-                                temp_sensor_type1 = t[:1]
-                                stm32_temp = t[1:3]
-                                stm32_temp.reverse()
-                                stm32_temp = ''.join(format(x, '02x') for x in stm32_temp)
-                                stm32_temp = struct.unpack('>H', bytes.fromhex(stm32_temp))
-
-                                temp_sensor_type2 = t[3:4]
-                                adxl_temp = t[4:6]
-                                adxl_temp.reverse()
-                                adxl_temp = ''.join(format(x, '02x') for x in adxl_temp)
-                                adxl_temp = struct.unpack('>h', bytes.fromhex(adxl_temp))
-
-                                timestamp = record.timestamp.strftime(FMT)
-
-                                if temperatureCalibration:
-                                    stm32_temp_cal = (gainMcu * stm32_temp[0]) + offsetMcu
-                                    adxl_temp_cal = (gainAdxl * adxl_temp[0]) + offsetAdxl
-                                    fout3.write("%s,%d,%d,%d,%d,%d,%0.2f,%0.2f\n" % (timestamp, timedelta_temp,
-                                                                               temp_sensor_type1[0], stm32_temp[0],
-                                                                               temp_sensor_type2[0], adxl_temp[0],
-                                                                               stm32_temp_cal, adxl_temp_cal))
-                                else:
-                                    fout3.write("%s,%d,%d,%d,%d,%d\n" % (timestamp, timedelta_temp,
-                                                                               temp_sensor_type1[0], stm32_temp[0],
-                                                                               temp_sensor_type2[0], adxl_temp[0]))
-                                incrementsize += len(record.payload) / 2
-
-                            if record.type == 31:
-                                timedelta_temp += 4  # TODO Make adjustable
-                                t = bytearray.fromhex(record.payload)
-                                temp_sensor_type1 = t[:1]
-                                tmp117_temp = t[1:3]
-                                tmp117_temp.reverse()
-                                tmp117_temp = ''.join(format(x, '02x') for x in tmp117_temp)
-                                tmp117_temp = struct.unpack('>H', bytes.fromhex(tmp117_temp))
-
-                                timestamp = record.timestamp.strftime(FMT)
-
-                                fout3.write("%s,%d,%d,%d\n" % (timestamp, timedelta_temp,
-                                                                     temp_sensor_type1[0], tmp117_temp[0]))
-
-                                incrementsize += len(record.payload) / 2
-
-
-                            ###########################
-                            # Parse Event Type Record #
-                            ###########################
-                            if record.type == 3:
-                                incrementsize += (len(record.payload)/2)
-                                timestamp = record.timestamp.strftime(FMT)
-                                if record.payload == '0d':
-                                    expected_reset_count = expected_reset_count + 1
-                                    print('%-35s %-15s %10s' % ('Expected Reset @ :', timestamp, str(unixTime)))
-                                    sumFile.write(
-                                        '%-35s %-15s %10s\n' % ('Expected Reset @ :', timestamp, str(unixTime)))
-                                elif record.payload == '01':
-                                    unexpected_reset_count = unexpected_reset_count + 1
-                                    print('%-35s %-15s %10s' % ('Unexpected Reset @ :', timestamp, str(unixTime)))
-                                    sumFile.write(
-                                        '%-35s %-15s %10s\n' % ('Unexpected Reset @ :', timestamp, str(unixTime)))
-                                elif record.payload == '08':
-                                    #print('%-35s %-15s %10s' % ('ENTER IDLE SLEEP @ ', timestamp, str(unixTime)))
-                                    sumFile.write(
-                                        '%-35s %-15s %10s\n' % ('ENTER IDLE SLEEP @ ', timestamp, str(unixTime)))
-                                elif record.payload == '09':
-                                    #print('%-35s %-15s %10s' % ('EXIT IDLE SLEEP @ ', timestamp, str(unixTime)))
-                                    sumFile.write(
-                                        '%-35s %-15s %10s\n' % ('EXIT IDLE SLEEP @ ', timestamp, str(unixTime)))
-                                else:
-                                    print('%-35s %-15s %10s' % (('Event Type %s @ ' % record.payload),
-                                                                timestamp, str(unixTime)))
-                                    sumFile.write('%-35s %-15s %10s\n' % (('Event Type %s @ ' % record.payload),
-                                                                          timestamp, str(unixTime)))
-
-                            ###########################
-                            # Parse FIFO_ERROR Record #
-                            ###########################
-                            if record.type == 19:
-                                incrementsize += (len(record.payload)/2)
-                                timestamp = record.timestamp.strftime(FMT)
-                                print('%-35s %-15s %10s' % ('FIFO ERROR @ : ', timestamp, str(unixTime)))
-                                sumFile.write('%-35s %-15s %10s\n' % ('FIFO ERROR @ : ', timestamp, str(unixTime)))
-
-                            ############################
-                            # Parse DEBUG_ERROR Record #
-                            ############################
-                            if record.type == 23:
-                                incrementsize += (len(record.payload)/2)
-                                timestamp = record.timestamp.strftime(FMT)
-                                print('%-35s %-15s %10s' % ('DEBUG_ERROR @ : ', timestamp, str(unixTime)))
-                                sumFile.write('%-35s %-15s %10s\n' % ('DEBUG_ERROR @ : ', timestamp, str(unixTime)))
-
-                            #########################
-                            # Parse RAM_DUMP Record #
-                            #########################
-                            if record.type == 24:
-                                incrementsize += (len(record.payload)/2)
-                                timestamp = record.timestamp.strftime(FMT)
-                                print('%-35s %-15s %10s' % ('RAM_DUMP @ : ', timestamp, str(unixTime)))
-                                sumFile.write('%-35s %-15s %10s\n' % ('RAM_DUMP @ : ', timestamp, str(unixTime)))
-
-                            #############################
-                            # Parse EVENT_MARKER Record #
-                            #############################
-                            if record.type == 28:
-                                incrementsize += (len(record.payload)/2)
-                                timestamp = record.timestamp.strftime(FMT)
-                                print('%-35s %-15s %10s' % ('EVENT MARKER @ : ', timestamp, str(unixTime)))
-                                sumFile.write('%-35s %-15s %10s\n' % ('EVENT MARKER @ : ', timestamp, str(unixTime)))
-
-                            ############################################
-                            # Parse BUTTON_PRESS/BUTTON_RELEASE Record #
-                            ############################################
-                            if record.type == 29:
-                                incrementsize += (len(record.payload)/2)
-                                timestamp = record.timestamp.strftime(FMT)
-                                if record.payload == '00':
-                                    print('%-35s %-15s %10s' % ('BUTTON PRESS @ : ', timestamp, str(unixTime)))
-                                    sumFile.write(
-                                        '%-35s %-15s %10s\n' % ('BUTTON PRESS @ : ', timestamp, str(unixTime)))
-
-                                if record.payload == '01':
-                                    print('%-35s %-15s %10s' % ('BUTTON RELEASE @ : ', timestamp, str(unixTime)))
-                                    sumFile.write(
-                                        '%-35s %-15s %10s\n' % ('BUTTON RELEASE @ : ', timestamp, str(unixTime)))
-
-                            ############################
-                            # Parse ADXL_REGISTER_DUMP #
-                            ############################
-                            if record.type == 40:
-                                incrementsize += (len(record.payload)/2)
-                                timestamp = record.timestamp.strftime(FMT)
-                                print(timestamp)
-                                h = BitStream(hex=record.payload)
-                                # s = Bits(h)
-                                for j in range(0, 36):
-                                    r = h.readlist("hex:n, hex:n", n=8)
-                                    reg, value = map(lambda t: t, r)
-                                    print(reg + ' ' + value)
-
-                            ####################
-                            # Parse Taso Epoch #
-                            ####################
-                            if record.type == 99: ###TODO
-                                incrementsize += (len(record.payload) / 2)
-                                timestamp = record.timestamp.strftime(FMT)
-                                print(timestamp)
-                                h = BitStream(hex=record.payload)
-                                # s = Bits(h)
-                                for j in range(0, 36):
-                                    r = h.readlist("hex:n, hex:n", n=8)
-                                    reg, value = map(lambda t: t, r)
-                                    print(reg + ' ' + value)
-
-                            ##########################
-                            # Parse Calibration Data #
-                            ##########################
-
-                            if record.type in range(100, 114):
-                                fout_cal.write("LOG_CAL_ORIENTATION_%s\n" % str(record.type - 100))
-                                cal_orienatation = True
-
-                            if record.type == 200 or record.type == 201 or record.type == 202 or record.type == 203:
-                                if record.type == 200 and cal_orienatation is True:
-                                    fout_cal.write("32HZ_CAL_DATA\n")
-                                    cal_orienatation = False
-                                if record.type == 201 and cal_orienatation is False:
-                                    fout_cal.write("64HZ_CAL_DATA\n")
-                                    cal_orienatation = True
-                                if record.type == 202 and cal_orienatation is True:
-                                    fout_cal.write("128HZ_CAL_DATA\n")
-                                    cal_orienatation = False
-                                if record.type == 203 and cal_orienatation is False:
-                                    fout_cal.write("256HZ_CAL_DATA\n")
-                                    cal_orienatation = True
-                                h = BitStream(hex=record.payload)
-                                #timestamp = record.timestamp.strftime(FMT)
-                                #fout_cal.write("%s," % timestamp)
-                                #timedelta_accel += current_timedelta_accel
-                                #fout_cal.write("%.3f," % timedelta_accel)
-                                cal = h.readlist("intle:n, intle:n, intle:n", n=16)
-                                x, y, z = map(lambda t: t / 1.0, cal)
-                                fout_cal.write("%.6f,%.6f,%.6f\n" % (x, y, z))
-
-                            ##################################################
-                            # Write Activity Data to file is option selected #
-                            ##################################################
-                            if Log_Activity_Data:
-                                if activity_count > 1 and numberRows >= 1048320:
-                                    numberRows = 0
-                                    fout.close()
-                                    if firstFile:
-                                        unixTimeFileFirst = (firstTimestamp - datetime.fromtimestamp(0,timezone.utc)).total_seconds()
-                                        try:
-                                            os.rename(outPutPath + adxl_dir + filename + '.csv',
-                                                      outPutPath + adxl_dir + filename + '-'
-                                                      + str(int(unixTimeFileFirst)) + '.csv')
-                                        except:
-                                            os.remove(outPutPath + adxl_dir + filename + '-'
-                                                      + str(int(unixTimeFileFirst)) + '.csv')
-                                            os.rename(outPutPath + adxl_dir + filename + '.csv',
-                                                      outPutPath + adxl_dir + filename + '-'
-                                                      + str(int(unixTimeFileFirst)) + '.csv')
-                                        firstFile = False
-                                    unixTimeFileNext = (record.timestamp - datetime.fromtimestamp(0,
-                                                                                                  timezone.utc)).total_seconds()
-                                    fout = open(outPutPath + adxl_dir + filename
-                                                + '-' + str(int(unixTimeFileNext)) + '.csv', "w")
-
-                                    fout.write('ts,t,x,y,z,vm\n')
-
-
-                        progress += (incrementsize + 9)
-                        incrementsize = 0
-
-                    unixTime = (lasttimestamp - datetime.fromtimestamp(0, timezone.utc)).total_seconds()
-                    print('%-35s %-15s %10s' % ('Last Timestamp: ', lasttimestamp.strftime(FMT), str(unixTime)))
-                    print('%-35s %-15s ' % ('Total Time: ', (str(unixTime - firstTimestampUnix))))
-                    print(' ')
-                    print('%-45s %5s' % (('Total number of Activity (%s) records: ' %
-                                          hex(record_type)), str(activity_count)))
-                    print('%-45s %5s' % ('Total number of Unexpected Resets: ', str(unexpected_reset_count)))
-                    print('%-45s %5s' % ('Total number of Expected Resets: ', str(expected_reset_count)))
-                    print('%-45s %5s' % ('Total number of Pegs: ', str(pegs)))
-                    print('%-45s %5s' % ('Total flat areas: ', str(flats)))
-                    print('%-45s %5s' % ('Timestamp Gaps: ', str(timestampGap)))
-                    print(' ')
-                    print('%-35s %-15s' % ('Parsing Start Date/Time: ', str(parse_start_date.strftime(FMT))))
-                    print('%-35s %-15s' % ('Parsing Complete Date/Time: ', str(datetime.now().strftime(FMT))))
-                    print(
-                        '%-35s %-15s' % ('Total Time to Parse: ', str(datetime.now() - parse_start_date)))
-                    print(' ')
-
-                    sumFile.write('%-35s %-15s %10s\n\n' % ('Last Timestamp: ', lasttimestamp.strftime(FMT), str(unixTime)))
-                    sumFile.write('%-45s %5s\n' % (('Total number of Activity (%s) records: ' %
-                                                    hex(record_type)), str(activity_count)))
-                    sumFile.write(
-                        '%-45s %5s\n' % ('Total number of Unexpected Resets: ', str(unexpected_reset_count)))
-                    sumFile.write('%-45s %5s\n' % ('Total number of Expected Resets: ', str(expected_reset_count)))
-                    sumFile.write('%-45s %5s\n' % ('Total number of Pegs: ', str(pegs)))
-                    sumFile.write('%-45s %5s\n' % ('Total flat areas: ', str(flats)))
-                    sumFile.write('%-45s %5s\n' % ('Timestamp Gaps: ', str(timestampGap)))
-                    sumFile.write('\n')
-                    sumFile.write('%-35s %-15s\n' % ('Parsing Start Date/Time: ', str(parse_start_date.strftime(FMT))))
-                    sumFile.write('%-35s %-15s\n' % ('Parsing Complete Date/Time: ', str(datetime.now().strftime(FMT))))
-                    sumFile.write('%-35s %-15s\n' % ('Total Time to Parse: ',
-                                                     str(datetime.now() - parse_start_date)))
-                    sumFile.write('\n')
-                    sumFile.flush()
-                    os.fsync(sumFile)
-
-                    fout_summary.write('%s,%s,%s,%s,%s,%s,%s,%s,%s,%s\n' % (str(file),firmware_version.rstrip(),
-                                                                            str(firstTimestampUnix),str(unixTime),
-                                                                            str(activity_count),str(unexpected_reset_count),
-                                                                            str(expected_reset_count),str(pegs),str(flats),
-                                                                            str(timestampGap)))
-
-                    fout_summary.flush()
-                    os.fsync(fout_summary)
-
-
-                    if Log_Activity_Data:
-                        fout.close()
-                        # read in data
-                        if createHtmlPlot:
-                            df = pd.read_csv(str(file) + '.csv')
-                            fig = px.line(df, x="t", y=['x', 'y', 'z', 'vm'], title='Acceleration',
-                                          labels={"value": "acceleration in G",
-                                                  "t": "Seconds"
-                                                  }
-                                          )
-                            fig.write_html(str(file) + '.html')
-                    if isIMUdata:
-                        fout_imu.close()
-                        df_imu = pd.read_csv(str(file) + '_imu.csv')
-                        fig = px.line(df_imu, x="t", y=imuHeader[0:3], title='Acceleration',
-                                      labels={"value": "acceleration in G",
-                                              "Timestamp": "Seconds"
-                                              }
-                                      )
-                        fig2 = px.line(df_imu, x="t", y=imuHeader[4:7], title='Gyro',
-                                      labels={"value": "degrees/sec",
-                                              "Timestamp": "Seconds"
-                                              }
-                                      )
-                        fig3 = px.line(df_imu, x="t", y=imuHeader[3], title='Temperature',
-                                       labels={imuHeader[6]: "Celsius",
-                                               "Timestamp": "Seconds"
-                                               }
-                                       )
-                        fig.write_html(str(file) + '_imu_accel.html')
-                        fig2.write_html(str(file) + '_imu_gyro.html')
-                        fig3.write_html(str(file) + '_imu_temp.html')
-                    fout1.close()
-                    fout2.close()
-                    fout3.close()
-                    fout_cal.close()
-                    progress = 0
-                if zipfiles:
-                    try:
-                        os.remove(basePath + "/log.bin")
-                    except:
-                        pass
-                    try:
-                        os.remove(basePath + "/calibration.json")
-                    except:
-                        pass
-                    try:
-                        os.remove(basePath + "/info.json")
-                    except:
-                        pass
-                    try:
-                        os.remove(basePath + "/temperature_calibration.json")
-                    except:
-                        pass
-    sumFile.close()
-    fout_summary.close()
-    print('FINISHED\n')
+#####################################################################
+# Distributed mode: every machine runs --distributed on the same shared
+# folder. Workers claim the logs one at a time through lock files in
+# output_files/queue (work_queue.py), parse them like the watch folder
+# workers and keep their summary rows, reports and events to
+# themselves. The machine that finishes last merges them into the usual
+# summary_file.csv, report and event database.
+#####################################################################
+DISTRIBUTED_REPORT = 'Parse_Summary_distributed.txt'
+
+
+def distributed_worker(folder, outputs, UseCalValues, durability, memory_budget_mb, compression, event_db):
+    queue = SharedQueue(folder, folder + output_dir + QUEUE_DIR)
+    if OUTPUT_EVENTS in outputs and event_db is None:
+        os.makedirs(os.path.join(queue.queue_dir, 'events'), exist_ok=True)
+        event_db = os.path.join(queue.queue_dir, 'events', queue.worker + '.sqlite')
+    job = functools.partial(watch_job, outputs, UseCalValues, durability, memory_budget_mb, compression, event_db)
+    return run_worker(queue, lambda path, claim: job(path, folder, job=claim))
+
+
+def distributed_process(folder, Log_Activity_Data=0, UseCalValues=0, workers=None, durability=FSYNC_PER_FILE,
+                        memory_budget_mb=MEMORY_BUDGET_MB, compression=NO_COMPRESSION, outputs=ALL_OUTPUTS,
+                        event_db=None):
+    # Parses the logs of folder together with the other machines doing the
+    # same. Returns (report path, logs merged so far).
+    print('\nAPP_VERSION: %s\n' % VERSION)
+    outputs = resolve_outputs(Log_Activity_Data, outputs)
+    outPutPath = folder + output_dir
+    create_output_folders(outPutPath)
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(distributed_worker, folder, outputs, UseCalValues, durability, memory_budget_mb,
+                               compression, event_db) for _ in range(workers)]
+        parsed = sum(future.result() for future in futures)
+    print('%d file(s) parsed on this machine' % parsed)
+
+    queueDir = outPutPath + QUEUE_DIR
+    reportPath = outPutPath + DISTRIBUTED_REPORT
+    merged = merge_fragments(queueDir, outPutPath + 'summary_file.csv', reportPath, SUMMARY_HEADER,
+                             'APP_VERSION: %s\nDISTRIBUTED\n\n' % VERSION)
+    if OUTPUT_EVENTS in outputs and event_db is None:
+        eventDbs = sorted(glob.glob(os.path.join(queueDir, 'events', '*.sqlite')))
+        merge_event_databases(outPutPath + EVENT_DB_NAME, eventDbs)
+    print('%d file(s) merged into %s\nFINISHED\n' % (merged, outPutPath + 'summary_file.csv'))
+    return reportPath, merged
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Parse Nebula device logs. Opens the GUI unless --watch, '
+                                                 '--distributed or --triage is given.')
+    parser.add_argument('--watch', nargs='+', metavar='FOLDER',
+                        help='parse new .agdc/.gt3x/.bin/.dat files in these folders as they arrive')
+    parser.add_argument('--distributed', metavar='FOLDER',
+                        help='parse FOLDER together with other machines running --distributed on it')
+    parser.add_argument('--triage', nargs='+', metavar='FOLDER',
+                        help='only write summary_file.csv for the logs in these folders, no data outputs')
+    parser.add_argument('--bin', action='store_true', help='triage .bin/.dat files instead of .agdc/.gt3x')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='parallel parse/triage processes (default: CPU count)')
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, help='seconds between folder scans')
+    parser.add_argument('--log-activity', action='store_true', help='write activity csv files')
+    parser.add_argument('--use-cal', action='store_true', help='apply calibration values')
+    parser.add_argument('--durability', choices=DURABILITY_POLICIES, default=FSYNC_PER_FILE)
+    parser.add_argument('--memory-budget', type=int, default=MEMORY_BUDGET_MB, metavar='MB')
+    parser.add_argument('--compression', choices=COMPRESSIONS, default=NO_COMPRESSION,
+                        help='compress the data outputs (gz, or zst with the zstandard package)')
+    parser.add_argument('--store', action='store_true',
+                        help='also write a chunked HDF5 store per log (needs h5py)')
+    parser.add_argument('--npy', action='store_true',
+                        help='also write the activity of each log as .npy arrays with a JSON sidecar')
+    parser.add_argument('--counts', action='store_true',
+                        help='also write ActiGraph activity counts of 1, 10 and 60 s epochs (needs scipy)')
+    parser.add_argument('--index', action='store_true',
+                        help='keep the record index of each log in a .nidx file next to it and reuse it')
+    parser.add_argument('--event-db', metavar='PATH',
+                        help='event database shared by all folders (default: %s in each output folder)'
+                             % EVENT_DB_NAME)
+    return parser.parse_args()
+
+
+JOB_HEADINGS = ['Job', 'Name', 'Priority', 'Status', 'Progress', 'Time', 'Result']
+
+
+def job_rows(jobs):
+    rows = []
+    for job in jobs:
+        if job.error:
+            result = job.error.strip().splitlines()[-1]
+        elif job.result:
+            summaryPath, parsedFiles = job.result
+            result = '%d file(s) parsed, %s' % (parsedFiles, os.path.basename(summaryPath))
+        else:
+            result = ''
+        rows.append([job.id, job.name, job.priority, job.status, '%3d%%' % (job.progress * 100),
+                     str(timedelta(seconds=int(job.elapsed))), result])
+    return rows
 
 
 def the_gui():
 
-    global message, progress
+    # Parses run as jobs on a worker pool so the window stays responsive #
+    jobQueue = JobQueue(JOB_WORKERS)
 
     file_list_column = [
         [
@@ -1181,12 +1337,34 @@ def the_gui():
             sg.In(size=(25, 1), enable_events=True, key="-FOLDER-"),
             sg.FolderBrowse(),
         ],
-        [sg.Listbox(values=[], enable_events=True, size=(40, 10), key="-FILE LIST-")],
+        [sg.Listbox(values=[], enable_events=True, size=(40, 10), key="-FILE LIST-",
+                    select_mode=sg.LISTBOX_SELECT_MODE_EXTENDED)],
         [
             sg.Button("PARSE FILE(S)", size=(20, 4)),
             sg.Checkbox("agdc/gt3x files", default=True, key="ZIPFILES"),
         ],
+        [
+            sg.Button("PARSE SELECTED FILE(S)", size=(20, 2)),
+            sg.Text("Job Priority"),
+            sg.InputText("0", key="PRIORITY", size=(5, 1)),
+        ],
+        [sg.Checkbox("Merge Logs Of The Same Device", default=False, key="MERGE")],
+        [sg.Checkbox("Triage Only (summary_file.csv)", default=False, key="TRIAGE")],
         [sg.Checkbox("Log Activity Data", default=False, key="LOGDATA")],
+        [
+            sg.Checkbox("Battery Log", default=True, key="BATTERY"),
+            sg.Checkbox("Temperature Log", default=True, key="TEMPERATURE"),
+            sg.Checkbox("Calibration Log", default=True, key="CALIBRATION"),
+            sg.Checkbox("HDF5 Store", default=False, key="STORE"),
+            sg.Checkbox("NumPy Arrays", default=False, key="NPY"),
+            sg.Checkbox("Activity Counts", default=False, key="COUNTS"),
+            sg.Checkbox("Record Index", default=False, key="INDEX"),
+        ],
+        [
+            sg.Checkbox("Event Database", default=True, key="EVENTS"),
+            sg.InputText(key="EVENT_DB", size=(25, 1)),
+            sg.FileSaveAs("Shared DB", file_types=(("SQLite", "*.sqlite"),)),
+        ],
         [sg.Checkbox("Time/Date Filter", default=False, key="TIMEDATE")],
         [
             sg.Text("Beginning Unix Timestamp", size=(20, 1)),
@@ -1197,6 +1375,22 @@ def the_gui():
             sg.InputText(key="last_timestamp", size=(15, 1)),
         ],
         [sg.Checkbox("Apply Calibration if Possible", default=False, key="APPLYCAL")],
+        [
+            sg.Text("Sync Outputs To Disk Per", size=(20, 1)),
+            sg.Combo(list(DURABILITY_POLICIES), default_value=FSYNC_PER_FILE, key="DURABILITY", readonly=True),
+        ],
+        [
+            sg.Text("Memory Budget (MB)", size=(20, 1)),
+            sg.InputText(str(MEMORY_BUDGET_MB), key="MEMORY_BUDGET", size=(15, 1)),
+        ],
+        [
+            sg.Text("Split Activity Files (s)", size=(20, 1)),
+            sg.InputText(str(File_Split_Level), key="SPLIT_SECONDS", size=(15, 1)),
+        ],
+        [
+            sg.Text("Compress Outputs", size=(20, 1)),
+            sg.Combo(list(COMPRESSIONS), default_value=NO_COMPRESSION, key="COMPRESSION", readonly=True),
+        ],
         [sg.Button("Exit")],
     ]
 
@@ -1211,13 +1405,19 @@ def the_gui():
             sg.Column(image_viewer_column),
         ],
         [
-            sg.Text('Work progress'),
-            sg.ProgressBar(totallogsize, size=(20, 20), orientation='h', key='-PROG-')
+            sg.Table(values=[], headings=JOB_HEADINGS, key='-JOBS-', num_rows=6, auto_size_columns=False,
+                     col_widths=[4, 30, 7, 9, 8, 8, 40], justification='left',
+                     select_mode=sg.TABLE_SELECT_MODE_EXTENDED),
+        ],
+        [
+            sg.Button("CANCEL JOB(S)"),
+            sg.Button("RAISE PRIORITY"),
+            sg.Button("LOWER PRIORITY"),
         ]
     ]
 
     window = sg.Window("Nebula-Moses-Taso Parser: %s" % VERSION, layout)
-    t = None
+    shownRows = None
 
     while True:
         event, values = window.read(timeout=500)
@@ -1239,14 +1439,7 @@ def the_gui():
                 if os.path.isfile(os.path.join(folder, f)) and f.lower().endswith((".agdc", ".gt3x", ".bin", ".dat"))
             ]
             window["-FILE LIST-"].update(fnames)
-        elif event == "-FILE LIST-":  # A file was chosen from the listbox
-            try:
-                filename = os.path.join(values["-FOLDER-"], values["-FILE LIST-"][0])
-                window["-TOUT-"].update(filename)
-                window["-IMAGE-"].update(filename=filename)
-            except:
-                pass
-        if event == "PARSE FILE(S)":
+        if event in ("PARSE FILE(S)", "PARSE SELECTED FILE(S)"):
             if values["LOGDATA"]:
                 LOG_ACTIVITY_DATA = True
             else:
@@ -1263,27 +1456,100 @@ def the_gui():
                 USE_ZIP_FILES = True
             else:
                 USE_ZIP_FILES = False
+            OUTPUTS = {OUTPUT_ACTIVITY, OUTPUT_REGISTER_DUMP, OUTPUT_IMU, OUTPUT_NONWEAR}
+            if values["BATTERY"]:
+                OUTPUTS.add(OUTPUT_BATTERY)
+            if values["TEMPERATURE"]:
+                OUTPUTS.add(OUTPUT_TEMPERATURE)
+            if values["CALIBRATION"]:
+                OUTPUTS.add(OUTPUT_CALIBRATION)
+            if values["STORE"]:
+                OUTPUTS.add(OUTPUT_STORE)
+            if values["NPY"]:
+                OUTPUTS.add(OUTPUT_NPY)
+            if values["COUNTS"]:
+                OUTPUTS.add(OUTPUT_COUNTS)
+            if values["EVENTS"]:
+                OUTPUTS.add(OUTPUT_EVENTS)
+            if values["INDEX"]:
+                OUTPUTS.add(OUTPUT_INDEX)
 
-            t = Thread(target=main_process, args=(LOG_ACTIVITY_DATA, NO_FILTER, USE_CAL_VALUES, USE_ZIP_FILES,
-                                                  values['-FOLDER-'],
-                                                  values['first_timestamp'],
-                                                  values['last_timestamp'], ), daemon=True)
-            t.start()
-
-        if t:
-            window['-PROG-'].update_bar(progress, totallogsize)
-            t.join(timeout=0)
-            if not t.is_alive():                       # the thread finished
-                # print(f'message = {message}')
-                sg.popup_animated(None)                     # stop animination in case one is running
-                t, message, progress = None, '', 0          # reset variables for next run
-                window['-PROG-'].update_bar(0, 0)            # clear the progress bar
-
-
+            try:
+                priority = int(values['PRIORITY'] or 0)
+            except ValueError:
+                priority = 0
+            folder = values['-FOLDER-']
+            options = dict(durability=values['DURABILITY'],
+                           memory_budget_mb=int(values['MEMORY_BUDGET'] or MEMORY_BUDGET_MB),
+                           outputs=OUTPUTS, compression=values['COMPRESSION'],
+                           split_seconds=int(values['SPLIT_SECONDS'] or 0), merge=values['MERGE'],
+                           event_db=values['EVENT_DB'] or None)
+
+            # One job for the folder, or one job per selected file #
+            if values["TRIAGE"]:
+                files = None
+                if event == "PARSE SELECTED FILE(S)":
+                    files = [Path(folder) / name for name in values["-FILE LIST-"]]
+                jobQueue.submit(folder + ' (triage)', triage_process, USE_ZIP_FILES, folder, USE_CAL_VALUES,
+                                memory_budget_mb=options['memory_budget_mb'], files=files,
+                                persist_index=values["INDEX"], key=folder, priority=priority)
+            elif event == "PARSE FILE(S)":
+                jobQueue.submit(folder, main_process, LOG_ACTIVITY_DATA, NO_FILTER, USE_CAL_VALUES, USE_ZIP_FILES,
+                                folder, values['first_timestamp'], values['last_timestamp'],
+                                key=folder, priority=priority, **options)
+            else:
+                for name in values["-FILE LIST-"]:
+                    path = Path(folder) / name
+                    jobQueue.submit(str(path), main_process, LOG_ACTIVITY_DATA, NO_FILTER, USE_CAL_VALUES,
+                                    path.suffix.lower() in ZIP_EXTENSIONS, folder, values['first_timestamp'],
+                                    values['last_timestamp'], key=folder, priority=priority,
+                                    files=[path], **options)
+
+        selectedJobs = [jobQueue.jobs[i] for i in values['-JOBS-']] if values and values.get('-JOBS-') else []
+        if event == "CANCEL JOB(S)":
+            for job in selectedJobs:
+                jobQueue.cancel(job)
+        elif event in ("RAISE PRIORITY", "LOWER PRIORITY"):
+            for job in selectedJobs:
+                if job.status == QUEUED:
+                    jobQueue.set_priority(job, job.priority + (-1 if event == "RAISE PRIORITY" else 1))
+
+        # Only redraw the job list when it changed, keeping the selected rows #
+        rows = job_rows(jobQueue.jobs)
+        if rows != shownRows:
+            window['-JOBS-'].update(values=rows, select_rows=values.get('-JOBS-', []) if values else [])
+            shownRows = rows
+
+    # Running jobs stop after their current record batch and close their outputs #
+    if any(job.status == RUNNING for job in jobQueue.jobs):
+        print('Cancelling running jobs...')
+    jobQueue.close(cancel=True)
     window.close()
 
 
 # Press the green button in the gutter to run the script.
 if __name__ == "__main__":
-    the_gui()
+    multiprocessing.freeze_support()
+    args = parse_arguments()
+    if args.triage:
+        for folder in args.triage:
+            triage_process(not args.bin, folder, int(args.use_cal), args.workers, args.memory_budget,
+                           persist_index=args.index)
+    elif args.distributed:
+        distributed_process(args.distributed, int(args.log_activity), int(args.use_cal), args.workers,
+                            args.durability, args.memory_budget, args.compression,
+                            ALL_OUTPUTS | {output for output, wanted in ((OUTPUT_STORE, args.store),
+                                                                         (OUTPUT_NPY, args.npy),
+                                                                         (OUTPUT_COUNTS, args.counts),
+                                                                         (OUTPUT_INDEX, args.index)) if wanted},
+                            args.event_db)
+    elif args.watch:
+        watch_folders(args.watch, int(args.log_activity), int(args.use_cal), args.workers, args.interval,
+                      args.durability, args.memory_budget, args.compression,
+                      ALL_OUTPUTS | {output for output, wanted in ((OUTPUT_STORE, args.store), (OUTPUT_NPY, args.npy),
+                                                                   (OUTPUT_COUNTS, args.counts),
+                                                                   (OUTPUT_INDEX, args.index)) if wanted},
+                      args.event_db)
+    else:
+        the_gui()
     print('Exiting Program')
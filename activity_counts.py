@@ -0,0 +1,298 @@
+import numpy as np
+
+from detectors import RAW_VM_SCALE
+from streaming import NS
+
+try:
+    from scipy.signal import lfilter, lfilter_zi, upfirdn
+except ImportError:
+    lfilter = None
+
+
+#####################################################################
+# ActiGraph activity counts (Brond et al. 2017) of the raw samples,
+# computed as ActiLife and the agcounts package do:
+#
+#     samples -> 30 Hz -> band-pass filter -> x gain, |.|, dead band,
+#     saturation -> 10 Hz (mean of 3) -> sum over each epoch
+#
+# Every stage keeps its filter state between ActivityStream chunks, so
+# the counts are those of the whole recording processed at once.
+# Epochs are counted from the first sample and stamped with the time of
+# their first sample. A change of sample rate (or record type) starts
+# over, like a new file. Supported rates are 30 to 100 Hz in steps of
+# 10 Hz and 32, 64, 128 and 256 Hz; samples at other rates get no
+# counts. Needs scipy (lfilter).
+#####################################################################
+COUNT_EPOCHS = (1, 10, 60)  # Seconds, multiples of the first
+COUNTS_HEADER = 'Time Stamp,Unix Timestamp,X,Y,Z,VM\n'
+
+# Band-pass filter at 30 Hz and the gain of its output to counts #
+BPF_B = np.array([-0.009341062898525, -0.025470289659360, -0.004235264826105, 0.044152415456420,
+                  0.036493718347760, -0.011893961934740, -0.022917390623150, -0.006788163862310, 0.0])
+BPF_A = np.array([1.0, -3.63367395910957, 5.03689812757486, -3.09612247819666, 0.50620507633883,
+                  0.32421701566682, -0.15685485875559, 0.01949130205890, 0.0])
+BPF_GAIN = (3.0 / 4096.0) / (2.6 / 256.0) * 237.5
+DEAD_BAND = 4
+SATURATION = 128
+
+# (upsample, downsample) factors of the rates that are multiples of 10 Hz #
+RESAMPLE_FACTORS = {30: (1, 1), 40: (3, 4), 50: (3, 5), 60: (1, 2), 70: (3, 7), 80: (3, 8), 90: (1, 3),
+                    100: (3, 10)}
+
+# Rates that are powers of 2 are brought to 256 Hz with this low-pass
+# kernel (symmetric, the first half and the centre tap), then smoothed
+# by a one pole filter and linearly interpolated down to 30 Hz
+POW2_RATES = (32, 64, 128, 256)
+POW2_KERNEL_HALF = np.array([
+    -0.000001, -0.000002, -0.000004, -0.000005, -0.000006, -0.000006, -0.000004, 0.000000,
+    0.000005, 0.000011, 0.000017, 0.000022, 0.000023, 0.000020, 0.000013, 0.000000,
+    -0.000016, -0.000033, -0.000049, -0.000059, -0.000061, -0.000052, -0.000031, 0.000000,
+    0.000038, 0.000077, 0.000111, 0.000132, 0.000133, 0.000112, 0.000066, 0.000000,
+    -0.000078, -0.000156, -0.000222, -0.000260, -0.000259, -0.000214, -0.000125, 0.000000,
+    0.000145, 0.000288, 0.000404, 0.000469, 0.000464, 0.000380, 0.000220, 0.000000,
+    -0.000250, -0.000493, -0.000687, -0.000791, -0.000777, -0.000632, -0.000363, 0.000000,
+    0.000409, 0.000801, 0.001108, 0.001269, 0.001240, 0.001003, 0.000574, 0.000000,
+    -0.000639, -0.001246, -0.001715, -0.001956, -0.001903, -0.001534, -0.000873, 0.000000,
+    0.000966, 0.001875, 0.002574, 0.002926, 0.002839, 0.002280, 0.001295, 0.000000,
+    -0.001425, -0.002762, -0.003783, -0.004293, -0.004158, -0.003335, -0.001892, 0.000000,
+    0.002078, 0.004025, 0.005513, 0.006257, 0.006061, 0.004866, 0.002763, 0.000000,
+    -0.003045, -0.005909, -0.008115, -0.009237, -0.008981, -0.007240, -0.004131, 0.000000,
+    0.004606, 0.009005, 0.012468, 0.014325, 0.014075, 0.011483, 0.006641, 0.000000,
+    -0.007655, -0.015271, -0.021640, -0.025543, -0.025900, -0.021926, -0.013250, 0.000000,
+    0.017180, 0.037161, 0.058432, 0.079245, 0.097796, 0.112422, 0.121780, 0.125000,
+])
+POW2_KERNEL = np.concatenate((POW2_KERNEL_HALF, POW2_KERNEL_HALF[-2::-1]))
+POW2_LPF = 0.307990357416655
+POW2_STEP = 256 / 30
+
+# Times of the last raw samples kept for the 30 Hz samples that lag behind them #
+TIME_TAIL = 1024
+
+
+def _require_scipy():
+    if lfilter is None:
+        raise ImportError('activity counts need the scipy package')
+
+
+def supported_rate(rate):
+    return rate in RESAMPLE_FACTORS or rate in POW2_RATES
+
+
+class _Decimator:
+    # 30 to 100 Hz: upsample by L (zeros), a two tap low-pass filter
+    # unless L is 1, keep every Mth sample. Returns the 30 Hz samples and
+    # the index of the raw sample each one starts from.
+
+    def __init__(self, rate):
+        self.up, self.down = RESAMPLE_FACTORS[rate]
+        a = np.pi / (np.pi + 2 * self.up)
+        b = (np.pi - 2 * self.up) / (np.pi + 2 * self.up)
+        self.b = np.array([a * self.up, a * self.up])
+        self.a = np.array([1.0, b])
+        self.zi = np.zeros((1, 3))
+        self.seen = 0     # Upsampled samples so far
+        self.phase = 0    # Upsampled index of the next kept sample, from the chunk start
+
+    def feed(self, xyz):
+        n = len(xyz) * self.up
+        if self.up == 1:
+            up = xyz
+        else:
+            up = np.zeros((n, 3))
+            up[::self.up] = xyz
+            up, self.zi = lfilter(self.b, self.a, up, axis=0, zi=self.zi)
+        kept = np.arange(self.phase, n, self.down)
+        out = up[kept]
+        raw = (self.seen + kept) // self.up
+        self.phase = (self.phase - n) % self.down
+        self.seen += n
+        return out, raw
+
+    def flush(self):
+        return np.zeros((0, 3)), np.zeros(0, np.int64)
+
+
+class _Pow2Resampler:
+    # 32 to 256 Hz: upsample to 256 Hz through POW2_KERNEL, one pole
+    # low-pass, linear interpolation at 30 Hz
+
+    def __init__(self, rate):
+        self.factor = 256 // rate
+        self.history = np.zeros((0, 3))   # Raw samples (x factor) the next 256 Hz samples still need
+        self.first = 0                    # Raw index of history[0]
+        self.emitted = 0                  # 256 Hz samples out of the kernel so far
+        self.zi = None
+        self.seen = 0                     # 256 Hz samples interpolated so far
+        self.previous = np.zeros((1, 3))
+        self.j = 0                        # Next 30 Hz sample
+
+    def feed(self, xyz):
+        if self.factor > 1:
+            xyz = self._upsample(xyz)
+        return self._interpolate(self._smooth(xyz))
+
+    def flush(self):
+        out, raw = np.zeros((0, 3)), np.zeros(0, np.int64)
+        if self.factor > 1:
+            out, raw = self._interpolate(self._smooth(self._upsample(np.zeros((0, 3)), last=True)))
+        # The reference ends with 30 / 256 samples per 256 Hz sample, the last ones 0 #
+        missing = max(0, self.seen * 30 // 256 - self.j)
+        self.j += missing
+        return (np.concatenate((out, np.zeros((missing, 3)))),
+                np.concatenate((raw, np.full(missing, max(0, self.seen - 1) // self.factor))))
+
+    def _upsample(self, xyz, last=False):
+        # "Same" convolution of the zero stuffed samples with the kernel,
+        # polyphase (upfirdn). 256 Hz sample n needs the input up to
+        # n + half, the last half samples wait for more input or the end.
+        half = (len(POW2_KERNEL) - 1) // 2
+        f = self.factor
+        history = np.concatenate((self.history, xyz * f))
+        known = (self.first + len(history)) * f
+        end = known if last else known - half
+        out = np.zeros((0, 3))
+        if end > self.emitted:
+            full = upfirdn(POW2_KERNEL, history, up=f, axis=0)
+            offset = half - self.first * f
+            out = full[self.emitted + offset:end + offset]
+            self.emitted = end
+        first = max(self.first, (self.emitted - half) // f)
+        self.history = history[first - self.first:]
+        self.first = first
+        return out
+
+    def _smooth(self, data):
+        a = 1 - POW2_LPF
+        x = POW2_LPF * data / a
+        if not len(x):
+            return x
+        if self.zi is None:
+            self.zi = lfilter_zi([a], [1, -a])[:, None] * x[0]
+        y, self.zi = lfilter([a], [1, -a], x, axis=0, zi=self.zi)
+        return y
+
+    def _interpolate(self, data):
+        # Sample j is at 256 Hz position (j + 1) * POW2_STEP - 1 #
+        end = self.seen + len(data)
+        data = np.concatenate((self.previous, data))   # data[k] is 256 Hz sample seen - 1 + k
+        j = np.arange(self.j, self.j + int(len(data) / POW2_STEP) + 2, dtype=np.float64)
+        i = j + 1
+        index = (np.floor(POW2_STEP * i) - 1).astype(np.int64)
+        i, index = i[index + 1 < end], index[index + 1 < end]
+        k = index - self.seen + 1
+        diffs = data[k + 1] - data[k]
+        out = (POW2_STEP * i)[:, None] * diffs + (data[k] - diffs * (index + 1)[:, None])
+        self.j += len(i)
+        self.seen = end
+        self.previous = data[-1:]
+        return out, index // self.factor
+
+
+class _Groups:
+    # Sums of consecutive groups of  rows, rows left over wait for
+    # the next call. Each sum gets the time of its group's first row.
+
+    def __init__(self, size):
+        self.size = size
+        self.values = np.zeros((0, 3))
+        self.times = np.zeros(0, np.int64)
+
+    def add(self, values, times):
+        values = np.concatenate((self.values, values))
+        times = np.concatenate((self.times, times))
+        full = len(values) - len(values) % self.size
+        self.values, self.times = values[full:], times[full:]
+        sums = values[:full].reshape(-1, self.size, 3).sum(axis=1)
+        return sums, times[:full:self.size]
+
+
+class ActivityCounts:
+    # ActivityStream sink writing <prefix>_counts_<epoch>s.csv for every
+    # epoch of COUNT_EPOCHS
+
+    def __init__(self, writer, prefix, epochs=COUNT_EPOCHS):
+        _require_scipy()
+        self.epochs = epochs
+        self.files = []
+        for epoch in epochs:
+            fout = writer.open('%s_counts_%ds.csv' % (prefix, epoch))
+            fout.write(COUNTS_HEADER)
+            self.files.append(fout)
+        self.skipped = 0   # Samples at an unsupported rate
+        self._segment = None
+        self._start()
+
+    def _start(self, rate=None):
+        self.rate = rate
+        self.resampler = None
+        if rate in RESAMPLE_FACTORS:
+            self.resampler = _Decimator(rate)
+        elif rate in POW2_RATES:
+            self.resampler = _Pow2Resampler(rate)
+        self.zi = None
+        self.raw_seen = 0
+        self.tail_ns = np.zeros(0, np.int64)
+        self.tenths = _Groups(3)
+        self.seconds = _Groups(10 * self.epochs[0])
+        self.longer = [_Groups(epoch // self.epochs[0]) for epoch in self.epochs[1:]]
+
+    def write_chunk(self, chunk):
+        rates = np.repeat(chunk.sample_rates, chunk.counts)
+        xyz = chunk.xyz if chunk.in_g else chunk.xyz / RAW_VM_SCALE
+        segment = chunk.record_type
+        changes = np.flatnonzero(np.diff(rates)) + 1
+        for a, b in zip([0] + changes.tolist(), changes.tolist() + [len(rates)]):
+            rate = int(rates[a]) if rates[a] == int(rates[a]) else None
+            if (segment, rate) != (self._segment, self.rate):
+                self._finish()
+                self._segment = segment
+                self._start(rate)
+            if self.resampler is None:
+                self.skipped += b - a
+                continue
+            self._feed(*self.resampler.feed(xyz[a:b]), chunk.time_ns[a:b])
+
+    def _feed(self, samples, raw, time_ns):
+        # raw indexes count the samples of the segment, time_ns holds the
+        # times of the samples added since the last call
+        first = self.raw_seen - len(self.tail_ns)
+        times = np.concatenate((self.tail_ns, time_ns))
+        self.raw_seen += len(time_ns)
+        self.tail_ns = times[-TIME_TAIL:]
+        if not len(samples):
+            return
+        samples = np.round(samples, decimals=3)
+        if self.zi is None:
+            self.zi = lfilter_zi(BPF_B, BPF_A)[:, None] * samples[0]
+        filtered, self.zi = lfilter(BPF_B, BPF_A, samples, axis=0, zi=self.zi)
+
+        trimmed = np.abs(filtered * BPF_GAIN)
+        trimmed[trimmed < DEAD_BAND] = 0
+        trimmed[trimmed > SATURATION] = SATURATION
+        tenths, tenth_ns = self.tenths.add(np.floor(trimmed), times[np.minimum(raw, self.raw_seen - 1) - first])
+        counts, count_ns = self.seconds.add(np.floor(tenths / 3), tenth_ns)
+        self._write(0, counts, count_ns)
+        for k, groups in enumerate(self.longer, 1):
+            self._write(k, *groups.add(counts, count_ns))
+
+    def _write(self, k, counts, time_ns):
+        if not len(counts):
+            return
+        stamps = np.datetime_as_string(time_ns.astype('datetime64[ns]').astype('datetime64[s]'))
+        stamps = np.char.replace(np.char.replace(stamps, '-', '/'), 'T', ' ')
+        vm = np.sqrt((counts ** 2).sum(axis=1))
+        self.files[k].write(''.join('%s,%.3f,%d,%d,%d,%.2f\n' % row for row in zip(
+            stamps.tolist(), (time_ns / NS).tolist(), *counts.astype(np.int64).T.tolist(), vm.tolist())))
+
+    def _finish(self):
+        # End of a segment: the resampler's last samples, partial epochs are dropped #
+        if self.resampler is not None:
+            self._feed(*self.resampler.flush(), np.zeros(0, np.int64))
+
+    def close(self):
+        self._finish()
+        for fout in self.files:
+            fout.close()
+        if self.skipped:
+            print('No activity counts for %d samples at an unsupported sample rate' % self.skipped)
@@ -0,0 +1,181 @@
+import numpy as np
+import pandas as pd
+
+from nebula_log import _unix, _to_datetime
+from record_decoders import decode_battery, decode_fixed_records, MCU_ADXL_TEMPERATURE_DTYPE, \
+    TMP117_TEMPERATURE_DTYPE, LOW_RATE_CHUNK_RECORDS
+from streaming import NS
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+#####################################################################
+# Chunked HDF5 store of a log's activity, battery and temperature.
+#
+# Every series is a group holding
+#     time    unix seconds (float64), one per row
+#     values  rows x columns (float32), column names in attrs['columns']
+#     index   first/last time of every CHUNK_ROWS rows
+# Rows are written a whole HDF5 chunk at a time, so a time window is
+# read by loading the small index and then only the chunks it overlaps.
+# The index holds the min/max time of each chunk, so windows stay
+# correct when the device clock jumps backwards.
+#####################################################################
+CHUNK_ROWS = 1 << 16
+STORE_COMPRESSION = 'gzip'
+STORE_COMPRESSION_LEVEL = 4
+
+ACTIVITY = 'activity'
+BATTERY = 'battery'
+TEMPERATURE = 'temperature'
+SERIES_COLUMNS = {ACTIVITY: ('x', 'y', 'z', 'vm'),
+                  BATTERY: ('voltage',),
+                  TEMPERATURE: ('mcu', 'adxl', 'tmp117')}
+
+
+def _require_h5py():
+    if h5py is None:
+        raise ImportError('the chunked store needs the h5py package')
+
+
+class ChunkStore:
+    # Writes one log's series to path. Also an ActivityStream sink
+    # (write_chunk/close). Battery and temperature records are passed to
+    # add_low_rate() and decoded in bulk.
+
+    def __init__(self, path, chunk_rows=CHUNK_ROWS):
+        _require_h5py()
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self._file = h5py.File(path, 'w')
+        self._buffers = {name: ([], [], 0) for name in SERIES_COLUMNS}
+        self._battery = []
+        self._temperature = []
+        for name, columns in SERIES_COLUMNS.items():
+            group = self._file.create_group(name)
+            group.create_dataset('time', (0,), np.float64, maxshape=(None,), chunks=(chunk_rows,),
+                                 compression=STORE_COMPRESSION, compression_opts=STORE_COMPRESSION_LEVEL,
+                                 shuffle=True)
+            group.create_dataset('values', (0, len(columns)), np.float32, maxshape=(None, len(columns)),
+                                 chunks=(chunk_rows, len(columns)), compression=STORE_COMPRESSION,
+                                 compression_opts=STORE_COMPRESSION_LEVEL, shuffle=True)
+            group.create_dataset('index', (0, 2), np.float64, maxshape=(None, 2))
+            group.attrs['columns'] = list(columns)
+
+    def write_chunk(self, chunk):
+        # Sample times continue from each record's timestamp at its sample rate #
+        self.append(ACTIVITY, chunk.time_ns / NS, np.column_stack((chunk.xyz, chunk.vm)))
+
+    def add_low_rate(self, record_type, unix_time, payload):
+        if record_type == 2:
+            if payload:
+                self._battery.append((unix_time, payload))
+        elif record_type == 30 or record_type == 31:
+            self._temperature.append((record_type, unix_time, payload))
+        if len(self._battery) + len(self._temperature) >= LOW_RATE_CHUNK_RECORDS:
+            self._decode_low_rate()
+
+    def append(self, name, times, values):
+        times_list, values_list, rows = self._buffers[name]
+        times_list.append(np.asarray(times, np.float64))
+        values_list.append(np.asarray(values, np.float32))
+        rows += len(times)
+        self._buffers[name] = (times_list, values_list, rows)
+        if rows >= self.chunk_rows:
+            self._write(name, whole_chunks=True)
+
+    def close(self):
+        if self._file is None:
+            return
+        self._decode_low_rate()
+        for name in SERIES_COLUMNS:
+            self._write(name, whole_chunks=False)
+        self._file.close()
+        self._file = None
+
+    def _decode_low_rate(self):
+        if self._battery:
+            self.append(BATTERY, [t for t, _ in self._battery],
+                        decode_battery([p for _, p in self._battery])[:, None])
+            self._battery = []
+        if self._temperature:
+            types = np.array([t for t, _, _ in self._temperature], dtype=np.uint8)
+            values = np.full((len(types), 3), np.nan)
+            k = np.flatnonzero(types == 30)
+            if len(k):
+                raw = decode_fixed_records([self._temperature[i][2] for i in k], MCU_ADXL_TEMPERATURE_DTYPE)
+                values[k, 0] = raw['mcu']
+                values[k, 1] = raw['adxl']
+            k = np.flatnonzero(types == 31)
+            if len(k):
+                values[k, 2] = decode_fixed_records([self._temperature[i][2] for i in k],
+                                                    TMP117_TEMPERATURE_DTYPE)['tmp117']
+            self.append(TEMPERATURE, [t for _, t, _ in self._temperature], values)
+            self._temperature = []
+
+    def _write(self, name, whole_chunks):
+        times_list, values_list, rows = self._buffers[name]
+        if not rows:
+            return
+        times = np.concatenate(times_list)
+        values = np.concatenate(values_list)
+        n = rows - rows % self.chunk_rows if whole_chunks else rows
+        self._buffers[name] = ([times[n:]], [values[n:]], rows - n)
+        if not n:
+            return
+
+        group = self._file[name]
+        start = group['time'].shape[0]
+        group['time'].resize((start + n,))
+        group['time'][start:] = times[:n]
+        group['values'].resize((start + n, values.shape[1]))
+        group['values'][start:] = values[:n]
+
+        bounds = [(t.min(), t.max()) for t in np.array_split(times[:n], range(self.chunk_rows, n, self.chunk_rows))]
+        index = group['index']
+        index.resize((index.shape[0] + len(bounds), 2))
+        index[-len(bounds):] = bounds
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_window(path, series=ACTIVITY, start=None, end=None):
+    # Rows of series with start <= time < end as a DataFrame (time as UTC
+    # datetimes). start/end are unix seconds, datetimes or anything
+    # pandas.Timestamp accepts; None leaves that side open.
+    _require_h5py()
+    start = -np.inf if start is None else float(_unix(start))
+    end = np.inf if end is None else float(_unix(end))
+
+    with h5py.File(path, 'r') as store:
+        group = store[series]
+        columns = list(group.attrs['columns'])
+        index = group['index'][:]
+        rows = group['time'].shape[0]
+        chunk_rows = group['time'].chunks[0]
+        chunks = np.flatnonzero((index[:, 1] >= start) & (index[:, 0] < end))
+
+        times, values = [], []
+        # Consecutive chunks are read with one slice #
+        for run in np.split(chunks, np.flatnonzero(np.diff(chunks) != 1) + 1):
+            if not len(run):
+                continue
+            a, b = run[0] * chunk_rows, min((run[-1] + 1) * chunk_rows, rows)
+            t = group['time'][a:b]
+            keep = (t >= start) & (t < end)
+            times.append(t[keep])
+            values.append(group['values'][a:b][keep])
+
+    times = np.concatenate(times) if times else np.zeros(0)
+    values = np.concatenate(values) if values else np.zeros((0, len(columns)), np.float32)
+    df = pd.DataFrame(values, columns=columns)
+    df.insert(0, 'time', _to_datetime(times))
+    return df
+
@@ -0,0 +1,382 @@
+import collections
+
+import numpy as np
+
+
+################################
+# TIMESTAMP GAP CLASSIFICATION #
+################################
+GAP = 'Gap'
+BACKWARDS = 'Backwards'
+DUPLICATE = 'Duplicate'
+
+# Events further than this from a gap are not considered its cause #
+GAP_EVENT_WINDOW = 60  # Seconds
+
+# Activity timestamps buffered before they are checked #
+GAP_CHUNK_RECORDS = 16384
+
+TimestampGaps = collections.namedtuple('TimestampGaps', 'index current previous delta kind event event_time')
+
+
+def find_timestamp_gaps(timestamps, event_times=(), event_names=(), skip=1, event_window=GAP_EVENT_WINDOW):
+    # timestamps are the unix seconds of consecutive activity records. The
+    # first `skip` deltas are ignored (the first record pair is not checked).
+    # Every gap is paired with the nearest event (reset, USB dock, idle
+    # sleep...) inside or around it, or '' when there is none in range.
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    delta = np.diff(timestamps)
+    delta[:skip] = 1
+
+    index = np.flatnonzero((delta > 1) | (delta <= 0))
+    previous = timestamps[index]
+    current = timestamps[index + 1]
+    delta = delta[index]
+
+    kind = np.where(delta > 0, GAP, np.where(delta < 0, BACKWARDS, DUPLICATE))
+    event, event_time = nearest_events(previous, current, event_times, event_names, event_window)
+
+    return TimestampGaps(index + 1, current, previous, delta, kind, event, event_time)
+
+
+def nearest_events(start, end, event_times, event_names, event_window=GAP_EVENT_WINDOW):
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    lo = np.minimum(start, end)
+    hi = np.maximum(start, end)
+
+    event_times = np.asarray(event_times, dtype=np.int64)
+    event_names = np.asarray(event_names, dtype=object)
+    names = np.full(len(lo), '', dtype=object)
+    times = np.full(len(lo), -1, dtype=np.int64)
+    if len(event_times) == 0 or len(lo) == 0:
+        return names, times
+
+    order = np.argsort(event_times, kind='stable')
+    event_times = event_times[order]
+    event_names = event_names[order]
+
+    # First event at or after the window start, and the one before it #
+    after = np.searchsorted(event_times, lo, side='left')
+    has_after = after < len(event_times)
+    has_before = after > 0
+    after_time = event_times[np.minimum(after, len(event_times) - 1)]
+    before_time = event_times[np.maximum(after - 1, 0)]
+
+    # Events inside [lo, hi] are at distance 0 #
+    after_distance = np.where(has_after, np.maximum(after_time - hi, 0), np.iinfo(np.int64).max)
+    before_distance = np.where(has_before, lo - before_time, np.iinfo(np.int64).max)
+
+    use_after = after_distance <= before_distance
+    pick = np.where(use_after, after, after - 1)
+    distance = np.where(use_after, after_distance, before_distance)
+
+    found = distance <= event_window
+    names[found] = event_names[pick[found]]
+    times[found] = event_times[pick[found]]
+    return names, times
+
+
+def _forward_fill(values, mask, carry):
+    # values[k] where mask[k] is the last True at or before each position,
+    # carry where there is none yet
+    last = np.maximum.accumulate(np.where(mask, np.arange(len(mask)), -1))
+    return np.where(last >= 0, values[np.maximum(last, 0)], carry)
+
+
+def _run_length(increment, reset, carry):
+    # Running count of `increment` that restarts at every `reset` sample
+    # (the reset applies before the sample's own increment)
+    total = np.concatenate(([0], np.cumsum(increment)))
+    last = np.maximum.accumulate(np.where(reset, np.arange(len(reset)), -1))
+    return np.where(last >= 0, total[1:] - total[np.maximum(last, 0)], carry + total[1:])
+
+
+##########################
+# PEGGED DATA DETECTION  #
+##########################
+CONSECUTIVE_SAMPLES = 8
+PEG_LIMIT_CALIBRATED = 7.0
+PEG_LIMIT_RAW = 2000
+
+
+class PegDetector:
+    # Vectorized check_for_peg: an axis is pegged once more than
+    # CONSECUTIVE_SAMPLES samples exceed the limit before a sample where no
+    # axis does. State is carried from one chunk to the next.
+
+    def __init__(self, consecutive=CONSECUTIVE_SAMPLES):
+        self.consecutive = consecutive
+        self.counts = np.zeros(3, dtype=np.int64)
+        self.status = False
+
+    def update(self, xyz, first, calibrated):
+        # first marks samples of the first activity record of a file, which
+        # restart the detector. Returns the pegged state after each sample.
+        limit = PEG_LIMIT_CALIBRATED if calibrated else PEG_LIMIT_RAW
+        over = np.abs(xyz) > limit
+        x = over[:, 0]
+        y = over[:, 1] & ~x
+        z = over[:, 2] & ~x & ~y
+        clear = ~(x | y | z)
+
+        reset = first | clear
+        counts = [_run_length(p, reset, c) for p, c in zip((x, y, z), self.counts.tolist())]
+        pegged = (counts[0] > self.consecutive) | (counts[1] > self.consecutive) | (counts[2] > self.consecutive)
+
+        status = _forward_fill(pegged, pegged | reset, self.status)
+        if len(status):
+            self.counts = np.array([c[-1] for c in counts])
+            self.status = bool(status[-1])
+        return status
+
+
+##########################
+# FLAT REGION DETECTION  #
+##########################
+FLAT_ALPHA = 0.8
+FLAT_LIMIT_CALIBRATED = 0.05
+FLAT_LIMIT_RAW = 5
+FLAT_VM_LIMIT = 1.5
+RAW_VM_SCALE = 250
+
+
+class FlatDetector:
+    # Vectorized check_for_flat: each axis is compared with a two tap
+    # smoothed copy of itself, and a region is flat once two axes stayed
+    # within the limit, and the smoothed vector magnitude above 1.5, for
+    # more than one second of samples.
+
+    def __init__(self, alpha=FLAT_ALPHA):
+        self.alpha = alpha
+        self.previous_x = np.zeros(3)
+        self.previous_y = np.zeros(3)
+        self.previous_vm = 0.0
+        self.counts = np.zeros(3, dtype=np.int64)
+        self.vm_count = 0
+        self.status = False
+
+    def update(self, xyz, first, calibrated, sample_rate):
+        # sample_rate is the per sample record rate (samples are flat after
+        # more than that many consecutive flat samples)
+        a = self.alpha
+        n = len(xyz)
+        if n == 0:
+            return np.zeros(0, dtype=bool)
+
+        # Smoothed samples, restarted from 0 on the first record #
+        previous_x = np.vstack((self.previous_x, xyz[:-1]))
+        previous_x[first] = 0
+        y = a * xyz + (1 - a) * previous_x
+
+        # The magnitude lags one sample behind the smoothed samples #
+        previous_y = np.vstack((self.previous_y, y[:-1]))
+        previous_y[first] = 0
+        vm = np.sqrt((previous_y ** 2).sum(axis=1))
+        if not calibrated:
+            vm /= RAW_VM_SCALE
+        y_vm = a * vm + (1 - a) * np.concatenate(([self.previous_vm], vm[:-1]))
+
+        flat_limit = FLAT_LIMIT_CALIBRATED if calibrated else FLAT_LIMIT_RAW
+        flat = np.abs(y - xyz) < flat_limit
+        counts = [_run_length(flat[:, k] & ~first, ~flat[:, k] | first, c)
+                  for k, c in enumerate(self.counts.tolist())]
+        vm_count = _run_length((y_vm > FLAT_VM_LIMIT) & ~first, (y_vm <= FLAT_VM_LIMIT) | first, self.vm_count)
+
+        cx, cy, cz = (c > sample_rate for c in counts)
+        is_flat = ((cx & cy) | (cz & cy) | (cx & cz)) & (vm_count > sample_rate)
+        cleared = first | ((counts[0] == 0) & (counts[1] == 0) & (counts[2] == 0))
+        status = _forward_fill(is_flat, is_flat | cleared, self.status)
+
+        self.previous_x = xyz[-1].copy()
+        self.previous_y = y[-1].copy()
+        self.previous_vm = vm[-1]
+        self.counts = np.array([c[-1] for c in counts])
+        self.vm_count = int(vm_count[-1])
+        self.status = bool(status[-1])
+        return status
+
+
+def region_transitions(status, suppress, state):
+    # Region state (flat region) that follows `status` but only starts on a
+    # sample where `suppress` (pegged) is False. Returns the state after
+    # each sample given the state before the first one.
+    n = len(status)
+    if n == 0:
+        return status
+    start = status & ~suppress
+    run_start = status & ~np.concatenate(([state], status[:-1]))
+
+    # Within each run of status, the region is on from the first sample it may start #
+    started = _run_length(start, run_start, 0) > 0
+    if state:
+        breaks = np.flatnonzero(~status)
+        started[:breaks[0] if len(breaks) else n] = True
+    return status & started
+
+
+class TimestampGapDetector:
+    # Chunked find_timestamp_gaps. Activity timestamps and events are added
+    # as records are framed; update() checks everything added since the
+    # last call, carrying the last timestamp over so gaps across chunk
+    # boundaries are still found. The returned indexes count the records
+    # added since the last call. Events too old to explain a later gap are
+    # dropped.
+
+    def __init__(self, skip=1, event_window=GAP_EVENT_WINDOW, max_pending=GAP_CHUNK_RECORDS):
+        self.skip = skip
+        self.max_pending = max_pending
+        self.event_window = event_window
+        self.timestamps = []
+        self.event_times = []
+        self.event_names = []
+        self.seen = 0
+        self.last = None
+        self.count = 0
+
+    def add(self, timestamp):
+        self.timestamps.append(timestamp)
+
+    def full(self):
+        return len(self.timestamps) >= self.max_pending
+
+    def add_event(self, timestamp, name):
+        self.event_times.append(timestamp)
+        self.event_names.append(name)
+
+    def update(self):
+        timestamps = np.asarray(self.timestamps, dtype=np.int64)
+        self.timestamps = []
+        if len(timestamps) == 0:
+            return find_timestamp_gaps(timestamps)
+        if self.last is None:
+            full, offset = timestamps, 0
+        else:
+            full, offset = np.concatenate(([self.last], timestamps)), self.seen - 1
+
+        gaps = find_timestamp_gaps(full, self.event_times, self.event_names, skip=max(0, self.skip - offset),
+                                   event_window=self.event_window)
+        if self.last is not None:
+            gaps = gaps._replace(index=gaps.index - 1)
+        self.seen += len(timestamps)
+        self.last = timestamps[-1]
+        self.count += int(np.count_nonzero(gaps.kind != DUPLICATE))
+
+        oldest = self.last - self.event_window
+        keep = [k for k, t in enumerate(self.event_times) if t >= oldest]
+        self.event_times = [self.event_times[k] for k in keep]
+        self.event_names = [self.event_names[k] for k in keep]
+        return gaps
+
+
+##########################
+# NON-WEAR DETECTION     #
+##########################
+NONWEAR_WINDOW = 3600   # Seconds, a multiple of NONWEAR_STEP
+NONWEAR_STEP = 900
+NONWEAR_STD_LIMIT = 0.013    # g
+NONWEAR_RANGE_LIMIT = 0.050  # g
+NONWEAR_AXES = 2
+NONWEAR_COVERAGE = 0.5  # Part of a step its samples must span for the step to count
+NONWEAR_PIECE = 16384   # Samples reduced at a time
+
+# Statistics columns of a step: count, sum, sum of squares, min and max of x/y/z #
+_COUNT, _SUM, _SQUARES, _MIN, _MAX = 0, slice(1, 4), slice(4, 7), slice(7, 10), slice(10, 13)
+
+
+class NonWearDetector:
+    # Non-wear in the style of van Hees et al. (2013): a window of
+    # NONWEAR_WINDOW seconds, moved by NONWEAR_STEP, is non-wear when at
+    # least NONWEAR_AXES axes have a standard deviation and a value range
+    # below the limits. update() only reduces each chunk to count, sum,
+    # sum of squares, min and max per step (np.*.reduceat, O(N)); the
+    # windows are built from cumulative sums of the steps in intervals().
+    # About 13 KB per day of data are kept, whatever the chunking.
+
+    def __init__(self, window=NONWEAR_WINDOW, step=NONWEAR_STEP, std_limit=NONWEAR_STD_LIMIT,
+                 range_limit=NONWEAR_RANGE_LIMIT, axes=NONWEAR_AXES):
+        if window % step:
+            raise ValueError('the non-wear window must be a multiple of its step')
+        self.steps = window // step
+        self.step_ns = int(step * 1000000000)
+        self.std_limit = std_limit
+        self.range_limit = range_limit
+        self.axes = axes
+        self._keys = []    # int64 (id, count, first ns, last ns) of every step
+        self._stats = []   # float64 statistics of every step, see _COUNT...
+        self._open = None  # Last step of the last chunk, it may go on in the next one
+
+    def update(self, time_ns, xyz, in_g):
+        # xyz is in g, or in raw counts when in_g is False. The chunk is
+        # reduced NONWEAR_PIECE samples at a time, transposed so every axis
+        # is contiguous and the piece stays in the CPU cache.
+        for a in range(0, len(time_ns), NONWEAR_PIECE):
+            self._reduce(time_ns[a:a + NONWEAR_PIECE], xyz[a:a + NONWEAR_PIECE], in_g)
+
+    def _reduce(self, time_ns, xyz, in_g):
+        n = len(time_ns)
+        axes = np.array(xyz.T, dtype=np.float64, order='C')
+        if not in_g:
+            axes /= RAW_VM_SCALE
+        ids = time_ns // self.step_ns
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1))
+        ends = np.concatenate((starts[1:], [n]))
+        keys = np.column_stack((ids[starts], ends - starts, time_ns[starts], time_ns[ends - 1]))
+        stats = np.column_stack(((ends - starts).astype(np.float64), np.add.reduceat(axes, starts, axis=1).T,
+                                 np.add.reduceat(axes * axes, starts, axis=1).T,
+                                 np.minimum.reduceat(axes, starts, axis=1).T,
+                                 np.maximum.reduceat(axes, starts, axis=1).T))
+
+        if self._open is not None:
+            open_keys, open_stats = self._open
+            if open_keys[0] == keys[0, 0]:
+                keys[0, 1] += open_keys[1]
+                keys[0, 2] = open_keys[2]
+                stats[0, :_MIN.start] += open_stats[:_MIN.start]
+                stats[0, _MIN] = np.minimum(stats[0, _MIN], open_stats[_MIN])
+                stats[0, _MAX] = np.maximum(stats[0, _MAX], open_stats[_MAX])
+            else:
+                self._keys.append(open_keys[None])
+                self._stats.append(open_stats[None])
+        if len(keys) > 1:
+            self._keys.append(keys[:-1])
+            self._stats.append(stats[:-1])
+        self._open = (keys[-1], stats[-1])
+
+    def intervals(self):
+        # (start ns, end ns) of the non-wear intervals: the first and last
+        # sample of each run of steps covered by non-wear windows. A window
+        # is only judged when its steps are consecutive and covered.
+        keys, stats = self._keys, self._stats
+        if self._open is not None:
+            keys = keys + [self._open[0][None]]
+            stats = stats + [self._open[1][None]]
+        if not keys:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+        keys = np.concatenate(keys)
+        stats = np.concatenate(stats)
+        k = self.steps
+        if len(keys) < k:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+
+        # Sums over the windows from cumulative sums, min/max over k steps #
+        total = np.concatenate((np.zeros((1, _MIN.start)), np.cumsum(stats[:, :_MIN.start], axis=0)))
+        window = total[k:] - total[:-k]
+        count = window[:, _COUNT, None]
+        mean = window[:, _SUM] / count
+        std = np.sqrt(np.maximum(window[:, _SQUARES] / count - mean * mean, 0))
+        value_range = (np.lib.stride_tricks.sliding_window_view(stats[:, _MAX], k, axis=0).max(axis=-1)
+                       - np.lib.stride_tricks.sliding_window_view(stats[:, _MIN], k, axis=0).min(axis=-1))
+        still = ((std < self.std_limit) & (value_range < self.range_limit)).sum(axis=1) >= self.axes
+
+        consecutive = np.concatenate(([False], np.diff(keys[:, 0]) == 1))
+        covered = keys[:, 3] - keys[:, 2] >= NONWEAR_COVERAGE * self.step_ns
+        runs = np.concatenate(([0], np.cumsum(consecutive)))
+        full = np.concatenate(([0], np.cumsum(covered)))
+        judged = (runs[k:] - runs[1:-k + 1 or None] == k - 1) & (full[k:] - full[:-k] == k)
+
+        # A step is non-wear when any non-wear window covers it #
+        flagged = np.convolve((still & judged).astype(np.int64), np.ones(k, np.int64))[:len(keys)] > 0
+        run_start = flagged & ~(np.concatenate(([False], flagged[:-1])) & consecutive)
+        run_end = flagged & ~(np.concatenate((flagged[1:], [False])) & np.concatenate((consecutive[1:], [False])))
+        return keys[run_start, 2], keys[run_end, 3]
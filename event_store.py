@@ -0,0 +1,199 @@
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from nebula_log import _unix, _to_datetime
+
+#####################################################################
+# SQLite database of the summary events of every parsed log, so fleet
+# wide questions are a query instead of a grep through Parse_Summary
+# files:
+#
+#     events = query_events('output_files/nebula_events.sqlite',
+#                           event='Unexpected Reset', firmware='1.7.2',
+#                           start='2023-05-01', end='2023-06-01')
+#
+# Every row carries its device and firmware, indexed with the event
+# name and time. Events are inserted in batched transactions. The
+# database is in WAL mode and writers wait for each other, so parallel
+# parses (GUI jobs, watch folder workers) can share one database.
+# Parsing a log again replaces its events.
+#####################################################################
+EVENT_DB_NAME = 'nebula_events.sqlite'
+EVENT_BATCH_ROWS = 5000
+BUSY_TIMEOUT = 60  # Seconds a writer waits for another writer's transaction
+
+# Event names besides the record events of nebula_log.EVENT_NAMES etc. #
+PEG = 'Peg'
+PEG_CLEARED = 'Peg Cleared'
+FLAT_REGION = 'Flat Region'
+FLAT_REGION_CLEARED = 'Flat Region Cleared'
+TIMESTAMP_GAP = 'Timestamp Gap'
+DUPLICATE_TIMESTAMP = 'Duplicate Timestamp'
+INVALID_RECORD = 'Invalid Record'
+CHECKSUM_COLLISION = 'Checksum Collision'
+CORRUPT_BYTES = 'Corrupt Bytes'
+NON_WEAR = 'Non-wear'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    device TEXT,
+    firmware TEXT,
+    parsed REAL,
+    complete INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS events (
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    device TEXT,
+    firmware TEXT,
+    event TEXT NOT NULL,
+    time REAL NOT NULL,
+    value REAL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+CREATE INDEX IF NOT EXISTS events_file ON events (file_id);
+CREATE INDEX IF NOT EXISTS events_device ON events (device, event, time);
+CREATE INDEX IF NOT EXISTS events_firmware ON events (firmware, event, time);
+CREATE INDEX IF NOT EXISTS events_event ON events (event, time);
+'''
+
+
+def connect(path):
+    db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    return db
+
+
+class EventStore:
+    # Events of one log: add() buffers rows, whole batches are inserted in
+    # one transaction. close(complete=False) keeps the events of a parse
+    # that stopped early but leaves the file marked incomplete.
+
+    def __init__(self, path, file, device, firmware, batch_rows=EVENT_BATCH_ROWS):
+        self.device = device
+        self.firmware = firmware
+        self.batch_rows = batch_rows
+        self._rows = []
+        self._db = connect(path)
+        self._db.executescript(SCHEMA)
+        file = os.path.abspath(str(file))
+        with self._transaction():
+            stale = [row[0] for row in self._db.execute('SELECT id FROM files WHERE path = ?', (file,))]
+            for file_id in stale:
+                self._db.execute('DELETE FROM events WHERE file_id = ?', (file_id,))
+                self._db.execute('DELETE FROM files WHERE id = ?', (file_id,))
+            self.file_id = self._db.execute('INSERT INTO files (path, device, firmware, parsed) VALUES (?, ?, ?, ?)',
+                                            (file, device, firmware, time.time())).lastrowid
+
+    def add(self, event, unix_time, value=None, detail=None):
+        self._rows.append((self.file_id, self.device, self.firmware, event, float(unix_time), value, detail))
+        if len(self._rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        with self._transaction():
+            self._db.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?)', self._rows)
+        self._rows = []
+
+    def close(self, complete=True):
+        if self._db is None:
+            return
+        self.flush()
+        if complete:
+            with self._transaction():
+                self._db.execute('UPDATE files SET complete = 1 WHERE id = ?', (self.file_id,))
+        self._db.close()
+        self._db = None
+
+    def _transaction(self):
+        return _Transaction(self._db)
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock up front, so a writer waits for
+    # the others (up to BUSY_TIMEOUT) instead of failing part way through
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, *exc):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+def merge_event_databases(path, sources):
+    # Writes the events of the completely parsed logs of the sources into
+    # a new database at path, replacing it. A log in several sources (by
+    # file name) keeps its latest parse. Returns the number of logs.
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    db = connect(tmp)
+    try:
+        db.executescript(SCHEMA)
+        latest = {}
+        for source in sources:
+            db.execute('ATTACH DATABASE ? AS source', (source,))
+            try:
+                for row in db.execute('SELECT id, path, device, firmware, parsed FROM source.files '
+                                      'WHERE complete = 1'):
+                    name = os.path.basename(row[1].replace('\\', '/'))
+                    if name not in latest or row[4] > latest[name][1][4]:
+                        latest[name] = (source, row)
+            finally:
+                db.execute('DETACH DATABASE source')
+
+        for source, (file_id, file, device, firmware, parsed) in sorted(latest.values(), key=lambda item: item[1][1]):
+            db.execute('ATTACH DATABASE ? AS source', (source,))
+            try:
+                with _Transaction(db):
+                    new_id = db.execute('INSERT INTO files (path, device, firmware, parsed, complete) '
+                                        'VALUES (?, ?, ?, ?, 1)', (file, device, firmware, parsed)).lastrowid
+                    db.execute('INSERT INTO events SELECT ?, device, firmware, event, time, value, detail '
+                               'FROM source.events WHERE file_id = ?', (new_id, file_id))
+            finally:
+                db.execute('DETACH DATABASE source')
+    finally:
+        db.close()
+    os.replace(tmp, path)
+    return len(latest)
+
+
+def query_events(path, event=None, device=None, firmware=None, start=None, end=None):
+    # Events as a DataFrame (time as UTC datetimes, with the log's path).
+    # Every argument left None matches everything; start/end are unix
+    # seconds, datetimes or anything pandas.Timestamp accepts.
+    where, params = [], []
+    for column, value in (('e.event', event), ('e.device', device), ('e.firmware', firmware)):
+        if value is not None:
+            where.append('%s = ?' % column)
+            params.append(value)
+    if start is not None:
+        where.append('e.time >= ?')
+        params.append(float(_unix(start)))
+    if end is not None:
+        where.append('e.time < ?')
+        params.append(float(_unix(end)))
+
+    sql = ('SELECT e.time, e.device, e.firmware, e.event, e.value, e.detail, f.path '
+           'FROM events e JOIN files f ON f.id = e.file_id')
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY e.time'
+    db = connect(path)
+    try:
+        df = pd.read_sql_query(sql, db, params=params)
+    finally:
+        db.close()
+    df['time'] = _to_datetime(df['time'].to_numpy())
+    return df
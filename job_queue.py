@@ -0,0 +1,153 @@
+import itertools
+import threading
+import time
+import traceback
+
+#####################################################################
+# Parse jobs run by a pool of worker threads. A job is a folder or a
+# file to parse. Queued jobs start in priority order (lower numbers
+# first, then in submission order) as workers become free; jobs with
+# the same key (output folder) run one at a time as they share its
+# summary files. Each job has its own progress and cancel flag, the
+# job's target checks job.cancelled between record batches and stops
+# cleanly with its outputs closed.
+#####################################################################
+JOB_WORKERS = 2
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+
+
+class Job:
+
+    def __init__(self, job_id, name, key, target, args, kwargs, priority):
+        self.id = job_id
+        self.name = name
+        self.key = key
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.status = QUEUED
+        self.progress = 0.0
+        self.result = None
+        self.error = ''
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._part = 0
+        self._parts = 1
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def start_part(self, index, parts):
+        # The job's progress is split evenly among its parts (files) #
+        self._part, self._parts = index, max(parts, 1)
+        self.progress = min(index / self._parts, 1.0)
+
+    def set_part_progress(self, fraction):
+        self.progress = min((self._part + min(fraction, 1.0)) / self._parts, 1.0)
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+class JobQueue:
+    # submit() returns the Job; target is called as
+    # target(*args, job=job, **kwargs) on a worker thread and its return
+    # value becomes job.result.
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.jobs = []   # Every job in submission order
+        self._queued = []
+        self._running = set()
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work, name='parse-job-%d' % i, daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, name, target, *args, key=None, priority=0, **kwargs):
+        with self._condition:
+            job = Job(next(self._ids), name, key, target, args, kwargs, priority)
+            self.jobs.append(job)
+            self._queued.append(job)
+            self._condition.notify()
+        return job
+
+    def set_priority(self, job, priority):
+        # Only changes the order of jobs that have not started #
+        with self._condition:
+            job.priority = priority
+
+    def cancel(self, job):
+        with self._condition:
+            job.cancel()
+            if job.status == QUEUED:
+                self._queued.remove(job)
+                job.status = CANCELLED
+                job.finished = time.time()
+
+    def close(self, cancel=True, timeout=None):
+        # Stops the workers once their running jobs return #
+        with self._condition:
+            self._closed = True
+            if cancel:
+                for job in list(self._queued) + [j for j in self.jobs if j.status == RUNNING]:
+                    job.cancel()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _next_job(self):
+        runnable = [j for j in self._queued if j.key is None or j.key not in self._running]
+        if not runnable:
+            return None
+        job = min(runnable, key=lambda j: (j.priority, j.id))
+        self._queued.remove(job)
+        return job
+
+    def _work(self):
+        while True:
+            with self._condition:
+                job = None
+                while not self._closed:
+                    job = self._next_job()
+                    if job is not None:
+                        break
+                    self._condition.wait()
+                if job is None:
+                    return
+                job.status = RUNNING
+                job.started = time.time()
+                if job.key is not None:
+                    self._running.add(job.key)
+
+            try:
+                job.result = job.target(*job.args, job=job, **job.kwargs)
+                status = CANCELLED if job.cancelled else DONE
+            except Exception:
+                job.error = traceback.format_exc()
+                print(job.error)
+                status = FAILED
+
+            with self._condition:
+                job.status = status
+                job.finished = time.time()
+                if status == DONE:
+                    job.progress = 1.0
+                self._running.discard(job.key)
+                self._condition.notify_all()
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+#####################################################################
+# Record index of a log persisted next to it (or in a cache folder), so
+# later runs, time window extractions and record type queries skip
+# framing the log again:
+#
+#     log = NebulaLog.open('MOS2C12345678.agdc', persist_index=True)
+#     log.index   # read from MOS2C12345678.agdc.nidx, or framed and saved
+#
+# The .nidx file is an uncompressed .npz holding the valid records'
+# types, timestamps, payload offsets and sizes, the corrupt byte ranges
+# and a per-minute lookup table. It is keyed by the source's size,
+# mtime and a hash of its first and last HASH_BYTES, and by the
+# timestamp limits it was framed with (see load_index). A stale or
+# unreadable index is ignored and rebuilt.
+#####################################################################
+INDEX_SUFFIX = '.nidx'
+INDEX_VERSION = 1
+HASH_BYTES = 1 << 20
+MINUTE = 60
+FUTURE_MARGIN = 86400   # Seconds, see _settled
+
+
+def index_path(source, index_dir=None):
+    # <source>.nidx next to the source, or in index_dir with a hash of the
+    # source's full path so logs of the same name do not share an index
+    source = os.path.abspath(str(source))
+    if index_dir is None:
+        return source + INDEX_SUFFIX
+    tag = hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(str(index_dir), '%s-%s%s' % (os.path.basename(source), tag, INDEX_SUFFIX))
+
+
+def source_key(source):
+    # [size, mtime (ns)] and the hash of the first and last HASH_BYTES #
+    st = os.stat(str(source))
+    digest = hashlib.blake2b(digest_size=16)
+    with open(str(source), 'rb') as fin:
+        digest.update(fin.read(HASH_BYTES))
+        if st.st_size > HASH_BYTES:
+            fin.seek(max(HASH_BYTES, st.st_size - HASH_BYTES))
+            digest.update(fin.read(HASH_BYTES))
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64), digest.hexdigest()
+
+
+def minute_runs(times):
+    # (minute, first row, end row) of every run of consecutive records in
+    # the same minute, sorted by minute. Logs are mostly in time order, so
+    # there are about as many runs as minutes; a clock that jumps back
+    # just adds runs.
+    minutes = np.floor_divide(times, MINUTE)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(minutes)) + 1)) if len(times) else np.zeros(0, np.int64)
+    ends = np.concatenate((starts[1:], [len(times)])) if len(times) else starts
+    runs = np.column_stack((minutes[starts], starts, ends)).astype(np.int64)
+    return runs[np.argsort(runs[:, 0], kind='stable')]
+
+
+def rows_in_window(runs, start=None, end=None):
+    # Rows of the runs overlapping [start, end), in file order. A superset
+    # of the records in the window, the caller still checks timestamps.
+    lo = 0 if start is None else np.searchsorted(runs[:, 0], np.floor_divide(start, MINUTE), 'left')
+    hi = len(runs) if end is None else np.searchsorted(runs[:, 0], np.floor_divide(end, MINUTE), 'right')
+    selected = runs[lo:hi]
+    if not len(selected):
+        return np.zeros(0, np.int64)
+    selected = selected[np.argsort(selected[:, 1])]
+    counts = selected[:, 2] - selected[:, 1]
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(selected[:, 1], counts) + offsets
+
+
+def save_index(path, source, index, runs, min_time, max_time):
+    # Written to a temporary file and renamed, so parallel runs never read
+    # a partial index
+    key, digest = source_key(source)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.nidx_', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as fout:
+            np.savez(fout, version=np.int64(INDEX_VERSION), key=key, digest=np.array(digest),
+                     limits=np.array([min_time, max_time], dtype=np.float64),
+                     types=index.types, times=index.times, offsets=index.offsets, sizes=index.sizes,
+                     corrupt=index.corrupt, minutes=runs)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def load_index(path, source, min_time, max_time):
+    # (types, times, offsets, sizes, corrupt, minute runs) of a current
+    # index of source, None when there is none.
+    if not os.path.isfile(path):
+        return None
+    try:
+        with np.load(path) as npz:
+            if int(npz['version']) != INDEX_VERSION:
+                return None
+            key, digest = source_key(source)
+            if not np.array_equal(npz['key'], key) or str(npz['digest']) != digest:
+                return None
+            arrays = [npz[name] for name in ('types', 'times', 'offsets', 'sizes', 'corrupt', 'minutes')]
+            limits = npz['limits']
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+
+    # Framing only depends on the timestamp limits through the records
+    # they reject. Other limits give the same index when the index holds
+    # no rejected bytes and all its records are within them.
+    times, corrupt = arrays[1], arrays[4]
+    if (limits[0], limits[1]) != (min_time, max_time):
+        inside = not len(times) or (times.min() > min_time and times.max() < max_time)
+        if not (inside and (not len(corrupt) or _settled(limits, key, min_time, max_time))):
+            return None
+    return arrays
+
+
+def _settled(limits, key, min_time, max_time):
+    # .bin logs are framed up to the current time, a limit that changes
+    # every run. Their index is kept once it was framed FUTURE_MARGIN
+    # after the log was last written, as if the log's limit were its
+    # mtime + FUTURE_MARGIN like a container's (last sample + a day).
+    return limits[0] == min_time and limits[1] <= max_time and limits[1] >= key[1] / 1e9 + FUTURE_MARGIN
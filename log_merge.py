@@ -0,0 +1,297 @@
+import argparse
+import collections
+import heapq
+import json
+import os
+import re
+import zipfile
+from datetime import datetime, timezone
+
+from logparser3_9 import parse, pack, CORRUPT_BYTES
+from nebula_log import read_container_info, ZIP_EXTENSIONS, MIN_TIMESTAMP, MIN_TIMESTAMP_CPW
+
+
+#####################################################################
+# Merges overlapping downloads of one device into a single log. A log's
+# timestamps go back when the device clock is reset, so each record
+# stream is cut into segments at every backward jump. The inputs are
+# aligned segment by segment on their overlap: the first record with a
+# payload of each input (its signature) is looked up in the others,
+# which gives the segment offset between the two. The record streams
+# are then parsed side by side and merged by (segment, timestamp) with
+# a heap, so memory depends on the number of inputs (and the dedupe
+# window), not their size. Each record is compared with the records of
+# the same segment, type and timestamp already written by the other
+# inputs:
+#   - a record another input has already written is a duplicate and
+#     is dropped;
+#   - a different record where another input already has one is a
+#     conflict, the record written first (the earlier input on equal
+#     timestamps) is kept and the conflict is reported.
+# Counting per input keeps records an input legitimately repeats and
+# records only one input has. Inputs that do not overlap are ordered by
+# their first timestamp. Corrupt bytes are not carried over, the merged
+# log only holds valid records.
+#####################################################################
+DEDUPE_RECORDS = 1 << 16   # Records remembered for duplicate/conflict checks
+SIGNATURE_BYTES = 16       # Payload bytes of the record that locates an input in the others
+
+Conflict = collections.namedtuple('Conflict', 'timestamp record_type inputs')
+
+
+class MergeReport:
+    def __init__(self, inputs):
+        self.inputs = list(inputs)
+        self.records = 0
+        self.duplicates = 0
+        self.corrupt_bytes = 0
+        self.conflicts = []
+
+
+class _Deduplicator:
+
+    def __init__(self, report, window=DEDUPE_RECORDS):
+        self.report = report
+        self.window = window
+        self.sources = len(report.inputs)
+        self.counts = {}   # (segment, type, timestamp, payload) or (segment, type, timestamp) -> records per input
+        self.refs = collections.Counter()
+        self.history = collections.deque()
+
+    def keep(self, source, segment, record):
+        key = (segment, record.type, record.timestamp, record.payload)
+        slot = key[:3]
+        seen = self._counts(key)
+        slots = self._counts(slot)
+        duplicate = seen[source] < max(seen)
+        seen[source] += 1
+        slots[source] += 1
+        if duplicate:
+            self.report.duplicates += 1
+            return False
+
+        others = [s for s in range(self.sources) if s != source and slots[s] >= slots[source]]
+        if others:
+            self.report.conflicts.append(Conflict(record.timestamp, record.type,
+                                                  [self.report.inputs[s] for s in others + [source]]))
+            return False
+        return True
+
+    def _counts(self, key):
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * self.sources
+        self.refs[key] += 1
+        self.history.append(key)
+        if len(self.history) > 2 * self.window:
+            old = self.history.popleft()
+            self.refs[old] -= 1
+            if not self.refs[old]:
+                del self.refs[old]
+                del self.counts[old]
+        return counts
+
+
+def _open_stream(path):
+    # (binary stream of log.bin, zip file or None, latest valid timestamp) #
+    if os.path.splitext(path)[1].lower() in ZIP_EXTENSIONS:
+        zf = zipfile.ZipFile(path, 'r')
+        _, max_time = read_container_info(zf)
+        return zf.open('log.bin'), zf, max_time
+    return open(path, 'rb'), None, datetime.now(tz=timezone.utc).timestamp()
+
+
+def _records(path, report):
+    # (segment, record) of the valid records of a log, segment counting
+    # the backward timestamp jumps before the record
+    fin, zf, max_time = _open_stream(path)
+    min_time = MIN_TIMESTAMP_CPW if os.path.basename(path).startswith('CPW') else MIN_TIMESTAMP
+    segment, last = 0, None
+    try:
+        for record in parse(fin, min_time, max_time):
+            if record.type < CORRUPT_BYTES:
+                if last is not None and record.timestamp < last:
+                    segment += 1
+                last = record.timestamp
+                yield segment, record
+            elif record.type == CORRUPT_BYTES:
+                report.corrupt_bytes += record.size
+    finally:
+        fin.close()
+        if zf is not None:
+            zf.close()
+
+
+def _signature(path):
+    # ((type, timestamp, payload), segment) of the first record of a log
+    # with a payload long enough to only appear once, None without one
+    for segment, record in _records(path, MergeReport([path])):
+        if len(record.payload) >= 2 * SIGNATURE_BYTES:
+            return (record.type, record.timestamp, record.payload), segment
+    return None
+
+
+def _segment_offsets(paths):
+    # Segment of the merged log that the first segment of every input
+    # belongs to. An extra pass over the inputs finds their signatures in
+    # each other, linking inputs i and j with j's offset relative to i.
+    signatures = collections.defaultdict(list)
+    for j, path in enumerate(paths):
+        signature = _signature(path)
+        if signature is not None:
+            signatures[signature[0]].append((j, signature[1]))
+
+    links = collections.defaultdict(dict)
+    firsts, segments = [], []
+    for i, path in enumerate(paths):
+        first, segment = None, 0
+        for segment, record in _records(path, MergeReport([path])):
+            if first is None:
+                first = record.timestamp
+            for j, own in signatures.get((record.type, record.timestamp, record.payload), ()):
+                if j != i and j not in links[i]:
+                    links[i][j] = segment - own
+                    links[j].setdefault(i, own - segment)
+        firsts.append(first)
+        segments.append(segment + 1)
+
+    # Overlapping inputs form groups with relative offsets, the groups
+    # follow each other in order of their first timestamp
+    relative = [None] * len(paths)
+    groups = []
+    for root in range(len(paths)):
+        if relative[root] is not None:
+            continue
+        relative[root] = 0
+        group, todo = [root], [root]
+        while todo:
+            i = todo.pop()
+            for j, offset in links[i].items():
+                if relative[j] is None:
+                    relative[j] = relative[i] + offset
+                    group.append(j)
+                    todo.append(j)
+        groups.append(group)
+
+    def start(group):
+        times = [firsts[i] for i in group if firsts[i] is not None]
+        return (bool(times), min(times) if times else None)
+
+    offsets = [0] * len(paths)
+    base = 0
+    for group in sorted(groups, key=start):
+        low = min(relative[i] for i in group)
+        for i in group:
+            offsets[i] = base + relative[i] - low
+        base = max(offsets[i] + segments[i] for i in group)
+    return offsets
+
+
+def merge_records(paths, report=None):
+    # Merged, deduplicated Records of the logs in paths #
+    paths = [str(p) for p in paths]
+    report = report if report is not None else MergeReport(paths)
+    deduplicator = _Deduplicator(report)
+    offsets = _segment_offsets(paths)
+
+    def stream(source):
+        for segment, record in _records(paths[source], report):
+            yield (offsets[source] + segment, record.timestamp, source), record
+
+    for (segment, _, source), record in heapq.merge(*map(stream, range(len(paths))), key=lambda item: item[0]):
+        if deduplicator.keep(source, segment, record):
+            yield record
+
+
+def _merged_members(paths):
+    # Non log members of the first container, its info updated with the
+    # latest last sample time of all inputs so no merged record is out of range
+    containers = [p for p in map(str, paths) if os.path.splitext(p)[1].lower() in ZIP_EXTENSIONS]
+    if not containers:
+        return None
+    infos = []
+    for path in containers:
+        with zipfile.ZipFile(path, 'r') as zf:
+            infos.append(read_container_info(zf))
+    latest = max(infos, key=lambda item: item[1])[0]
+
+    members = []
+    with zipfile.ZipFile(containers[0], 'r') as zf:
+        for member in zf.infolist():
+            if member.filename == 'log.bin':
+                continue
+            data = zf.read(member)
+            if member.filename == 'info.json':
+                info = json.loads(data)
+                info['lastSampleTime'] = latest['lastSampleTime']
+                data = json.dumps(info).encode('utf-8')
+            elif member.filename == 'info.txt':
+                text = data.decode('utf-8', 'replace')
+                lines = [line if not line.startswith('Last Sample Time') else
+                         'Last Sample Time: %s' % latest['Last Sample Time'] for line in text.split('\n')]
+                data = '\n'.join(lines).encode('utf-8')
+            members.append((member, data))
+    return members
+
+
+def device_serial(path):
+    # Serial number from a container's info, otherwise the leading
+    # letters/digits of the file name (MOS2C12345678 (2).agdc)
+    path = str(path)
+    if os.path.splitext(path)[1].lower() in ZIP_EXTENSIONS and zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path, 'r') as zf:
+            info, _ = read_container_info(zf)
+        serial = info.get('serialNumber') or info.get('Serial Number')
+        if serial:
+            return str(serial)
+    match = re.match(r'[A-Za-z0-9]+', os.path.basename(path))
+    return match.group(0) if match else os.path.basename(path)
+
+
+def group_by_device(paths):
+    # {serial: [paths]} in the order the paths were given #
+    groups = collections.OrderedDict()
+    for path in paths:
+        groups.setdefault(device_serial(path), []).append(path)
+    return groups
+
+
+def merge_logs(paths, dst):
+    # Writes the merged log to dst: a container (with the first input
+    # container's other members) when any input is an .agdc/.gt3x, a
+    # plain log.bin otherwise. Returns the MergeReport.
+    report = MergeReport([str(p) for p in paths])
+    members = _merged_members(paths)
+
+    def write(fout):
+        for record in merge_records(paths, report):
+            fout.write(pack(record))
+            report.records += 1
+
+    if members is None:
+        with open(dst, 'wb') as fout:
+            write(fout)
+    else:
+        with zipfile.ZipFile(dst, 'w', zipfile.ZIP_DEFLATED) as zout:
+            with zout.open('log.bin', 'w', force_zip64=True) as fout:
+                write(fout)
+            for member, data in members:
+                zout.writestr(member, data)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge overlapping logs of one device into a single log.')
+    parser.add_argument('dst', help='merged log (.agdc/.gt3x when an input is one, otherwise .bin)')
+    parser.add_argument('src', nargs='+', help='logs to merge, earlier ones win conflicts')
+    args = parser.parse_args()
+
+    report = merge_logs(args.src, args.dst)
+    print('%d records written, %d duplicates dropped, %d corrupt bytes skipped'
+          % (report.records, report.duplicates, report.corrupt_bytes))
+    for conflict in report.conflicts:
+        print('Conflict @ %s type %d in %s' % (conflict.timestamp, conflict.record_type, ', '.join(conflict.inputs)))
+
+
+if __name__ == "__main__":
+    main()
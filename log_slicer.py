@@ -0,0 +1,120 @@
+import argparse
+import mmap
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+
+from logparser3_9 import HEADER_SIZE
+from nebula_log import NebulaLog, read_container_info, ZIP_EXTENSIONS, MIN_TIMESTAMP, MIN_TIMESTAMP_CPW
+
+COPY_SIZE = 1 << 24   # Largest slice copied in one write
+
+
+#####################################################################
+# Cuts a time window out of a log without decoding it. Records are
+# framed once to find their byte ranges; the selected records are then
+# copied verbatim, adjacent records as one contiguous slice. A
+# container (.agdc/.gt3x) is repacked with every other member (info,
+# calibration) unchanged.
+#
+#     python log_slicer.py MOS2C12345678.agdc reset.agdc \
+#         --start "2023-05-12 13:00" --end "2023-05-12 15:00"
+#####################################################################
+def record_ranges(log, start=None, end=None, types=None):
+    # (start, end) byte ranges of the records of log with start <= timestamp
+    # < end, optionally only of the given record types, adjacent records
+    # merged into one range
+    index = log.index
+    rows = log.between(start, end)._select(types)
+    if not len(rows):
+        return []
+
+    starts = index.offsets[rows] - HEADER_SIZE
+    ends = index.offsets[rows] + index.sizes[rows] + 1
+    breaks = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+    first = np.concatenate(([0], breaks))
+    last = np.concatenate((breaks - 1, [len(rows) - 1]))
+    return list(zip(starts[first].tolist(), ends[last].tolist()))
+
+
+def write_ranges(data, ranges, fout):
+    view = memoryview(data)
+    written = 0
+    for a, b in ranges:
+        for o in range(a, b, COPY_SIZE):
+            fout.write(view[o:min(b, o + COPY_SIZE)])
+        written += b - a
+    return written
+
+
+def slice_log(src, dst, start=None, end=None, types=None, persist_index=False, index_dir=None):
+    # Writes the records of src in [start, end) to dst: a log.bin for a
+    # .bin/.dat source, or a container with the same members for an
+    # .agdc/.gt3x. Returns the number of log bytes written. persist_index
+    # reuses (or saves) the record index of src, see log_index.py.
+    src = str(src)
+    name = os.path.basename(src)
+    min_time = MIN_TIMESTAMP_CPW if name.startswith('CPW') else MIN_TIMESTAMP
+    if os.path.splitext(src)[1].lower() not in ZIP_EXTENSIONS:
+        log = NebulaLog.open(src, use_calibration=False, persist_index=persist_index, index_dir=index_dir)
+        with open(dst, 'wb') as fout:
+            return write_ranges(log.data, record_ranges(log, start, end, types), fout)
+
+    # log.bin is extracted and memory mapped instead of read into memory #
+    workdir = tempfile.mkdtemp(prefix='nebula_slice_')
+    try:
+        with zipfile.ZipFile(src, 'r') as zin, zipfile.ZipFile(dst, 'w', zipfile.ZIP_DEFLATED) as zout:
+            info, max_time = read_container_info(zin)
+            with open(zin.extract('log.bin', workdir), 'rb') as fin:
+                data = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(fin.fileno()).st_size \
+                    else b''
+                log = NebulaLog(data, name, info, min_time=min_time, max_time=max_time)
+                if persist_index:
+                    log.persist_index(src, index_dir)
+                with zout.open(zin.getinfo('log.bin'), 'w', force_zip64=True) as fout:
+                    written = write_ranges(data, record_ranges(log, start, end, types), fout)
+                del log
+                if isinstance(data, mmap.mmap):
+                    data.close()
+            for member in zin.infolist():
+                if member.filename != 'log.bin':
+                    zout.writestr(member, zin.read(member))
+        return written
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _time_arg(text):
+    # Unix seconds or a date/time string #
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy the records of a time window of a Nebula log to a new '
+                                                 'log without decoding them.')
+    parser.add_argument('src', help='.agdc, .gt3x, .bin or .dat log')
+    parser.add_argument('dst', help='output log, same kind as src')
+    parser.add_argument('--start', help='first timestamp kept (unix seconds or date/time, UTC)')
+    parser.add_argument('--end', help='timestamps before this are kept (unix seconds or date/time, UTC)')
+    parser.add_argument('--types', help='comma separated record types to keep (default: all)')
+    parser.add_argument('--index', action='store_true',
+                        help='reuse the record index of src from an earlier run, or save it for the next one')
+    parser.add_argument('--index-dir', metavar='DIR', help='keep the index in DIR instead of next to src')
+    args = parser.parse_args()
+
+    types = [int(t, 0) for t in args.types.split(',')] if args.types else None
+    written = slice_log(args.src, args.dst, _time_arg(args.start), _time_arg(args.end), types,
+                        args.index or args.index_dir is not None, args.index_dir)
+    print('Wrote %d log bytes to %s' % (written, args.dst))
+
+
+if __name__ == "__main__":
+    main()
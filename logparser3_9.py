@@ -1,68 +1,242 @@
 from datetime import datetime, timezone
-import collections, operator, struct
-import functools
+import collections, io, struct
 
+import numpy as np
 
-Record = collections.namedtuple('Record', 'type timestamp payload size bad_size')
 
-def parse(fin, min_time, max_time):
+# offset is the position of the payload in the stream #
+Record = collections.namedtuple('Record', 'type timestamp payload size bad_size offset')
+
+SYNC = 0x1E
+HEADER = struct.Struct('<BIH')  # type, timestamp, size after the sync byte
+HEADER_SIZE = 1 + HEADER.size
+READ_SIZE = 1 << 20
+RESYNC_SIZE = 1 << 12  # First block scanned for the next record, doubled up to READ_SIZE
+
+# Error records, payload is a stream position #
+CORRUPT_BYTES = 252       # size bytes from payload were skipped to find the next record
+CHECKSUM_COLLISION = 253  # valid checksum but the timestamp is out of range
+INVALID_RECORD = 254      # timestamp in range but the checksum failed
+
+# A header found while resynchronizing must have a known type and a sane size #
+KNOWN_RECORD_TYPES = frozenset((0, 2, 3, 19, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 35, 36, 37, 40, 99)
+                               + tuple(range(100, 114)) + (200, 201, 202, 203))
+MAX_RECORD_SIZE = 8192
+
+
+class _Window:
+    # Bytes of the stream read in large blocks, addressed by stream
+    # position. Reads start at RESYNC_SIZE and double up to READ_SIZE, so
+    # frame() resuming parse() for one record does not read a whole block.
+
+    def __init__(self, fin):
+        self.fin = fin
+        self.base = fin.tell()
+        self.buf = bytearray()
+        self.eof = False
+        self.read_size = RESYNC_SIZE
+
+    @property
+    def end(self):
+        return self.base + len(self.buf)
+
+    def fill(self, end):
+        # True once the window holds everything before end #
+        while self.end < end and not self.eof:
+            block = self.fin.read(max(self.read_size, end - self.end))
+            self.read_size = min(2 * self.read_size, READ_SIZE)
+            if block:
+                self.buf += block
+            else:
+                self.eof = True
+        return self.end >= end
+
+    def discard(self, pos):
+        if pos - self.base >= READ_SIZE:
+            del self.buf[:pos - self.base]
+            self.base = pos
+
+    def checksum_ok(self, pos, size):
+        # The checksum byte is 255 - XOR of the sync byte, header and payload #
+        o = pos - self.base
+        xor = int(np.bitwise_xor.reduce(np.frombuffer(self.buf, np.uint8, HEADER_SIZE + size, o)))
+        return self.buf[o + HEADER_SIZE + size] == 255 - xor
+
+
+def _resync(window, pos, min_time, max_time, known_types, max_size):
+    # Position of the first plausible record at or after pos (sync byte,
+    # known type, sane size, timestamp in range and a valid checksum), or
+    # None when the stream ends first. Candidates are found a block at a
+    # time with numpy instead of reading every sync byte's record. Blocks
+    # start small as the next record is usually close.
+    known = np.array(sorted(known_types))
+    span = RESYNC_SIZE
+    while True:
+        window.discard(pos)
+        window.fill(pos + span)
+        o = pos - window.base
+        n = min(len(window.buf) - o, span) - HEADER_SIZE + 1
+        if n <= 0:
+            return None
+
+        b = np.frombuffer(window.buf, np.uint8, n + HEADER_SIZE - 1, o)
+        c = np.flatnonzero(b[:n] == SYNC)
+        types = b[c + 1]
+        timestamps = (b[c + 2].astype(np.int64) | b[c + 3].astype(np.int64) << 8
+                      | b[c + 4].astype(np.int64) << 16 | b[c + 5].astype(np.int64) << 24)
+        sizes = b[c + 6].astype(np.int64) | b[c + 7].astype(np.int64) << 8
+        plausible = (np.isin(types, known) & (sizes <= max_size)
+                     & (timestamps > min_time) & (timestamps < max_time))
+        candidates = zip((c[plausible] + pos).tolist(), sizes[plausible].tolist())
+        del b
+
+        for q, size in candidates:
+            if window.fill(q + HEADER_SIZE + size + 1) and window.checksum_ok(q, size):
+                return q
+        pos += n
+        span = min(2 * span, READ_SIZE)
+
+
+def parse(fin, min_time, max_time, types=None, known_types=KNOWN_RECORD_TYPES, max_size=MAX_RECORD_SIZE,
+          payloads=True, last_timestamp=None):
+    # types limits the records yielded to those record types. Other records
+    # are still checksummed to stay in sync but their payload is never
+    # converted, unless invalid bytes were skipped ahead of them (so the
+    # invalid size is still reported). With payloads=False records are only
+    # framed: payload is None and offset/size locate it in the stream.
+    #
+    # When the bytes at a record boundary do not hold a valid record, a
+    # CHECKSUM_COLLISION/INVALID_RECORD record reports the header (if its
+    # timestamp is in/out of range as before), the stream is scanned in
+    # bulk for the next plausible record and a CORRUPT_BYTES record reports
+    # the skipped byte range. last_timestamp is the timestamp of the
+    # record before fin's position when parsing resumes mid stream.
+    window = _Window(fin)
+    pos = window.base
     bad_size = 0
-    try:
-        while True:
-            sync = ord(fin.read(1))
-            while sync != 0x1E:
-                sync = ord(fin.read(1))
-                bad_size = bad_size + 1
-            pos = fin.tell()
-            buf = fin.read(7)
-            chksum = functools.reduce(operator.xor, [(x) for x in buf], 0x1E)
-            #chksum = 0x1E
-            #for x in buf:
-            #    chksum ^= x
-            dtype, timestamp, size = struct.unpack('<BIH', buf)
-            buf = fin.read(size)
-
-            chksum = functools.reduce(operator.xor, [(x) for x in buf], chksum)
-            checksum = (fin.read(1)).hex()
-            if checksum == "":
-                checksum = 0
-            if chksum == 255 - int(checksum, 16):
-                if (datetime.fromtimestamp(min_time, tz=timezone.utc)
-                        < datetime.fromtimestamp(timestamp, tz=timezone.utc)
-                        < datetime.fromtimestamp(max_time, tz=timezone.utc)):
-                    yield Record(dtype, datetime.fromtimestamp(timestamp, tz=timezone.utc), buf.hex(), size, bad_size)
-                else:
-                    fin.seek(pos)
-                    yield Record(253, datetime.fromtimestamp(timestamp, tz=timezone.utc), pos, size, bad_size)
+    while True:
+        window.discard(pos)
+        if not window.fill(pos + HEADER_SIZE):
+            return
+        o = pos - window.base
+        complete = True
+        if window.buf[o] == SYNC:
+            dtype, timestamp, size = HEADER.unpack_from(window.buf, o + 1)
+            complete = window.fill(pos + HEADER_SIZE + size + 1)
+            valid = complete and window.checksum_ok(pos, size)
+            in_range = min_time < timestamp < max_time
+            if valid and in_range:
+                if types is None or dtype in types or bad_size:
+                    yield Record(dtype, datetime.fromtimestamp(timestamp, tz=timezone.utc),
+                                 window.buf[o + HEADER_SIZE:o + HEADER_SIZE + size].hex() if payloads else None,
+                                 size, bad_size, pos + HEADER_SIZE)
+                last_timestamp = timestamp
                 bad_size = 0
-            else:
-                # buf = pos
-                fin.seek(pos)
-                if (datetime.fromtimestamp(min_time, tz=timezone.utc)
-                        < datetime.fromtimestamp(timestamp, tz=timezone.utc)
-                        < datetime.fromtimestamp(max_time, tz=timezone.utc)):
-                    yield Record(254, datetime.fromtimestamp(timestamp, tz=timezone.utc), pos, size, bad_size)
-    except struct.error as e:
-        return
-    except TypeError as e:
-        return
+                pos += HEADER_SIZE + size + 1
+                continue
+            if valid:
+                yield Record(CHECKSUM_COLLISION, datetime.fromtimestamp(timestamp, tz=timezone.utc), pos + 1, size,
+                             bad_size, pos + HEADER_SIZE)
+            elif in_range and complete:
+                yield Record(INVALID_RECORD, datetime.fromtimestamp(timestamp, tz=timezone.utc), pos + 1, size,
+                             bad_size, pos + HEADER_SIZE)
+
+        # Skip to the next plausible record. A record running past the end
+        # of the stream is a truncated last record unless one follows it.
+        resync = _resync(window, pos + 1, min_time, max_time, known_types, max_size)
+        if resync is None and not complete:
+            return
+        end = resync if resync is not None else window.end
+        bad_size = end - pos
+        # Skipped bytes keep the timestamp of the record before them, or of
+        # the record after them at the start of the stream
+        if resync is not None and last_timestamp is None:
+            last_timestamp = HEADER.unpack_from(window.buf, resync - window.base + 1)[1]
+        if last_timestamp is not None:
+            yield Record(CORRUPT_BYTES, datetime.fromtimestamp(last_timestamp, tz=timezone.utc), pos, bad_size,
+                         bad_size, pos)
+        if resync is None:
+            return
+        pos = resync
+
+
+def frame(data, min_time, max_time, known_types=KNOWN_RECORD_TYPES, max_size=MAX_RECORD_SIZE):
+    # Record headers of a whole in-memory stream (bytes or mmap) without
+    # touching payloads: (types, timestamps, payload offsets, sizes,
+    # corrupt (start, end) ranges) arrays holding the same valid records
+    # and CORRUPT_BYTES ranges parse() would yield. Headers are walked in
+    # Python, checksums and timestamp ranges are checked in bulk; parse()
+    # is only used to resynchronize after a record fails.
+    buf = np.frombuffer(data, np.uint8) if len(data) else np.zeros(0, np.uint8)
+    end = len(data)
+    types, times, offsets, sizes, corrupt = [], [], [], [], []
+    pos = 0
+    while pos < end:
+        # Walk the headers as long as they chain #
+        starts = []
+        headers = []
+        p = pos
+        while p + HEADER_SIZE <= end and data[p] == SYNC:
+            header = HEADER.unpack_from(data, p + 1)
+            if p + HEADER_SIZE + header[2] + 1 > end:
+                break
+            starts.append(p)
+            headers.append(header)
+            p += HEADER_SIZE + header[2] + 1
+
+        ok = 0
+        if starts:
+            s = np.array(starts, dtype=np.int64)
+            h = np.array(headers, dtype=np.int64).reshape(-1, 3)
+            # The XOR of a whole record, checksum included, is always 0xFF #
+            xor = np.bitwise_xor.reduceat(buf[s[0]:p], s - s[0])
+            good = (xor == 0xFF) & (h[:, 1] > min_time) & (h[:, 1] < max_time)
+            ok = len(s) if good.all() else int(np.argmin(good))
+            types.append(h[:ok, 0])
+            times.append(h[:ok, 1])
+            offsets.append(s[:ok] + HEADER_SIZE)
+            sizes.append(h[:ok, 2])
+            pos = int(s[ok]) if ok < len(s) else p
+        if pos >= end:
+            break
+
+        # pos does not hold a valid record (failed checks, no sync byte or
+        # truncated): let parse() find the next one
+        stream = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+        stream.seek(pos)
+        resync = end
+        last = next((int(t[-1]) for t in reversed(times) if len(t)), None)
+        for record in parse(stream, min_time, max_time, (), known_types, max_size, payloads=False,
+                            last_timestamp=last):
+            if record.type == CORRUPT_BYTES:
+                corrupt.append((record.payload, record.payload + record.size))
+                resync = record.payload + record.size
+                break
+            if record.type < CORRUPT_BYTES:
+                resync = record.offset - HEADER_SIZE
+                break
+        pos = resync
+
+    def column(parts, dtype):
+        return np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype)
+    return (column(types, np.uint8), column(times, np.int64), column(offsets, np.int64), column(sizes, np.int64),
+            np.array(corrupt, dtype=np.int64).reshape(-1, 2))
 
 
 def datetime2timestamp(d):
+    if d.tzinfo is not None:
+        return int(d.timestamp())
     return int((d - datetime(1970, 1, 1)).total_seconds())
 
 
 def pack(record):
-    size = len(record.payload)
-    fmt = '<BBIH{0}s'.format(size)
-    t = datetime2timestamp(record.timestamp)
-    buf = struct.pack(fmt, 0x1E, record.type, t, size, record.payload)
-    chksum = 0
-    for x in buf:
-        chksum ^= ord(x)
-    chksum = 255 - chksum
-    buf += chr(chksum)
-    return buf
+    # Framed bytes of a record as parse() reads them back. payload is the
+    # hex string parse() yields, or bytes.
+    payload = bytes.fromhex(record.payload) if isinstance(record.payload, str) else bytes(record.payload)
+    buf = struct.pack('<B', SYNC) + HEADER.pack(record.type, datetime2timestamp(record.timestamp), len(payload)) \
+        + payload
+    chksum = int(np.bitwise_xor.reduce(np.frombuffer(buf, np.uint8)))
+    return buf + bytes((255 - chksum,))
 
 
 def unpack(data):
@@ -0,0 +1,457 @@
+import collections
+import csv
+import io
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from logparser3_9 import frame
+from record_decoders import decode_activity, activity_sample_rate, apply_calibration, calibration_matrices, \
+    decode_battery, decode_fixed_records, imu_schema_from_payload, decode_imu_samples, ACTIVITY_TYPES, NEBULA, \
+    CALIBRATION_RATES, CALIBRATION_ORDER, TEMPERATURE_CALIBRATION_ORDER, MCU_ADXL_TEMPERATURE_DTYPE, \
+    TMP117_TEMPERATURE_DTYPE
+from streaming import sample_times_ns
+from log_index import index_path, load_index, save_index, minute_runs, rows_in_window
+
+
+###################
+# LOG CONTAINERS  #
+###################
+ZIP_EXTENSIONS = ('.agdc', '.gt3x')
+RAW_EXTENSIONS = ('.bin', '.dat')
+
+# Records before these dates are treated as invalid #
+MIN_TIMESTAMP = 1262304000      # January 1, 2010
+MIN_TIMESTAMP_CPW = 1514764800  # January 1, 2018
+
+# Records are accepted up to a day after the last sample of the download #
+DOWNLOAD_MARGIN = 86400  # Seconds
+
+COPY_SIZE = 1 << 24   # Largest block of log.bin copied out of a container at once
+
+# corrupt holds the (start, end) stream positions of every skipped byte range #
+RecordIndex = collections.namedtuple('RecordIndex', 'types times offsets sizes corrupt')
+
+EVENT_NAMES = {0x0d: 'Expected Reset',
+               0x01: 'Unexpected Reset',
+               0x08: 'ENTER IDLE SLEEP',
+               0x09: 'EXIT IDLE SLEEP'}
+RECORD_EVENT_NAMES = {19: 'FIFO ERROR',
+                      23: 'DEBUG_ERROR',
+                      24: 'RAM_DUMP',
+                      28: 'EVENT MARKER'}
+BUTTON_EVENT_NAMES = {0x00: 'BUTTON PRESS',
+                      0x01: 'BUTTON RELEASE'}
+
+
+def ticks_to_unix(ticks):
+    # .NET ticks (100 ns since 0001-01-01) to unix seconds
+    epoch_diff = datetime(1970, 1, 1) - datetime(1, 1, 1)
+    return (ticks - epoch_diff.total_seconds() * 10 ** 7) / 10 ** 7
+
+
+def read_calibration_values(name, text):
+    # calibration.json or .cal file contents in CALIBRATION_ORDER
+    if name.lower().endswith('cal'):
+        values = [row[1] for row in csv.reader(io.StringIO(text)) if row]
+    else:
+        reader = json.loads(text)
+        values = [reader[key] for key in CALIBRATION_ORDER]
+    return np.asarray(values[:len(CALIBRATION_ORDER)], dtype=np.float64).astype(int)
+
+
+def read_temperature_calibration(text):
+    # (gains, offsets) for the (MCU, ADXL) temperature sensors, None when
+    # the file still holds the default values
+    reader = json.loads(text)
+    v = [int(reader[key]) for key in TEMPERATURE_CALIBRATION_ORDER[:6]]
+    if v[0] == 0:
+        return None
+    gains = np.array([(v[4] - v[5]) / (v[0] - v[1]), (v[4] - v[5]) / (v[2] - v[3])])
+    offsets = np.array([v[4] - gains[0] * v[0], v[4] - gains[1] * v[2]])
+    return gains, offsets
+
+
+def read_info_txt(text):
+    info = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition(':')
+        if sep:
+            info[key.strip()] = value.strip()
+    return info
+
+
+def read_container_info(zf):
+    # (info, latest valid timestamp) of an .agdc (info.json) or .gt3x (info.txt) #
+    if 'info.json' in zf.namelist():
+        info = json.loads(zf.read('info.json'))
+        return info, info['lastSampleTime'] + DOWNLOAD_MARGIN
+    info = read_info_txt(zf.read('info.txt').decode('utf-8', 'replace'))
+    return info, ticks_to_unix(int(info['Last Sample Time']))
+
+
+def map_file(fin):
+    # Read only memory map of an open file, b'' for an empty one (which
+    # cannot be mapped)
+    if os.fstat(fin.fileno()).st_size:
+        return mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    return b''
+
+
+def extract_log(zf):
+    # log.bin of an open container copied to an anonymous temporary file,
+    # a block at a time, so it can be memory mapped instead of held in
+    # memory. The file is deleted when it is closed.
+    fout = tempfile.TemporaryFile(prefix='nebula_log_')
+    try:
+        with zf.open('log.bin') as fin:
+            shutil.copyfileobj(fin, fout, COPY_SIZE)
+        fout.flush()
+    except BaseException:
+        fout.close()
+        raise
+    return fout
+
+
+def _unix(value):
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return value
+    value = pd.Timestamp(value)
+    if value.tzinfo is None:
+        value = value.tz_localize('UTC')
+    return value.timestamp()
+
+
+def _to_datetime(unix_times):
+    return pd.to_datetime(np.asarray(unix_times, dtype=np.float64), unit='s', utc=True)
+
+
+class NebulaLog:
+    # A device log opened for analysis without writing any output:
+    #
+    #     log = NebulaLog.open('MOS2C12345678.agdc')
+    #     day = log.between('2023-05-01', '2023-05-02')
+    #     df = day.activity()
+    #
+    # The log is only framed (record headers and offsets) the first time
+    # data is asked for; each accessor then decodes just the records of its
+    # own types from a memory map of the log: the .bin/.dat itself, or the
+    # log.bin of a container extracted to a temporary file (or the one
+    # passed as extracted=). open(persist_index=True) keeps the index in a
+    # .nidx file for the next run (log_index.py). close() (or a with
+    # block) releases the memory map and deletes the temporary file.
+
+    def __init__(self, data, name, info=None, calibration=None, temperature_calibration=None,
+                 min_time=MIN_TIMESTAMP, max_time=None):
+        self.data = data
+        self.name = name
+        self.info = info or {}
+        self.calibration = calibration                          # 72 values in CALIBRATION_ORDER
+        self.temperature_calibration = temperature_calibration  # (gains, offsets), see temperature()
+        self.min_time = min_time
+        self.max_time = max_time if max_time is not None else datetime.now(tz=timezone.utc).timestamp()
+        self.start = None
+        self.end = None
+        self._parent = None
+        self._index = None
+        self._minutes = None
+        self._cache = {}
+        self.source = None
+        self.index_file = None    # Persistent index (log_index.py), None: framed every time
+        self._file = None         # File behind the memory map of data, closed by close()
+
+    @classmethod
+    def open(cls, path, use_calibration=True, persist_index=False, index_dir=None, extracted=None):
+        # persist_index: keep the record index in <path>.nidx (or in
+        # index_dir) and reuse it while the log is unchanged. extracted:
+        # the container's log.bin, when the caller already extracted it.
+        log = cls._open(path, use_calibration, extracted)
+        if persist_index:
+            log.persist_index(path, index_dir)
+        return log
+
+    def close(self):
+        # Views of the log share its memory map, they cannot be used after.
+        # While payloads are still referenced the map stays open, it is
+        # released with the last of them.
+        if isinstance(self.data, mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:
+                pass
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def persist_index(self, source, index_dir=None):
+        # Reads/saves the index of this log as the index of the file source #
+        self.source = str(source)
+        self.index_file = index_path(source, index_dir)
+
+    @classmethod
+    def _open(cls, path, use_calibration, extracted=None):
+        path = str(path)
+        name = os.path.basename(path)
+        min_time = MIN_TIMESTAMP_CPW if name.startswith('CPW') else MIN_TIMESTAMP
+        extension = os.path.splitext(path)[1].lower()
+
+        if extension in ZIP_EXTENSIONS:
+            with zipfile.ZipFile(path, 'r') as zf:
+                names = set(zf.namelist())
+                calibration = temperature_calibration = None
+                info, max_time = read_container_info(zf)
+                if use_calibration and 'calibration.json' in names:
+                    calibration = read_calibration_values('calibration.json',
+                                                          zf.read('calibration.json').decode('utf-8'))
+                if 'temperature_calibration.json' in names:
+                    temperature_calibration = read_temperature_calibration(
+                        zf.read('temperature_calibration.json').decode('utf-8'))
+                fin = extract_log(zf) if extracted is None else open(str(extracted), 'rb')
+            try:
+                log = cls(map_file(fin), name, info, calibration, temperature_calibration, min_time, max_time)
+            except BaseException:
+                fin.close()
+                raise
+            log._file = fin
+            return log
+
+        if extension not in RAW_EXTENSIONS:
+            raise ValueError('unsupported log file: %s' % path)
+        calibration = None
+        cal_file = os.path.splitext(path)[0] + '.cal'
+        if use_calibration and os.path.isfile(cal_file):
+            with open(cal_file, 'r') as cfile:
+                calibration = read_calibration_values(cal_file, cfile.read())
+        with open(path, 'rb') as fin:
+            data = map_file(fin)
+        return cls(data, name, {'firmware': 'dat or bin file only'}, calibration, None, min_time)
+
+    @property
+    def firmware_version(self):
+        return str(self.info.get('firmware', self.info.get('Firmware', ''))).rstrip()
+
+    def between(self, start=None, end=None):
+        # View of the records with start <= timestamp < end (datetimes,
+        # strings pandas understands or unix seconds). Shares the data and
+        # the record index with this log.
+        view = NebulaLog(self.data, self.name, self.info, self.calibration, self.temperature_calibration,
+                         self.min_time, self.max_time)
+        view.start = _unix(start) if start is not None else self.start
+        view.end = _unix(end) if end is not None else self.end
+        view._index = self._index
+        view._parent = self
+        return view
+
+    ##################
+    # Record framing #
+    ##################
+    @property
+    def index(self):
+        # Record headers of the whole log, built once and shared by views #
+        if self._parent is not None:
+            self._index = self._parent.index
+        if self._index is None:
+            self._index = self._build_index()
+        return self._index
+
+    @property
+    def minutes(self):
+        # Per-minute lookup table of the index, see log_index.minute_runs #
+        if self._parent is not None:
+            self._minutes = self._parent.minutes
+        if self._minutes is None:
+            self._minutes = minute_runs(self.index.times)
+        return self._minutes
+
+    def _build_index(self):
+        if self.index_file is not None:
+            arrays = load_index(self.index_file, self.source, self.min_time, self.max_time)
+            if arrays is not None:
+                self._minutes = arrays[5]
+                return RecordIndex(*arrays[:5])
+        index = RecordIndex(*frame(self.data, self.min_time, self.max_time))
+        if self.index_file is not None:
+            self._minutes = minute_runs(index.times)
+            try:
+                save_index(self.index_file, self.source, index, self._minutes, self.min_time, self.max_time)
+            except OSError:
+                pass   # The index is only a cache, e.g. the log's folder may be read only
+        return index
+
+    @property
+    def corrupt_ranges(self):
+        # (start, end) byte positions of the log that held no valid records #
+        return self.index.corrupt
+
+    def _select(self, types=None):
+        # Rows of the records of types (None: all) in the view's window.
+        # A window only checks the records of its minutes.
+        index = self.index
+        if self.start is None and self.end is None:
+            if types is None:
+                return np.arange(len(index.types))
+            return np.flatnonzero(np.isin(index.types, list(types)))
+        rows = rows_in_window(self.minutes, self.start, self.end)
+        times = index.times[rows]
+        mask = np.ones(len(rows), dtype=bool) if types is None else np.isin(index.types[rows], list(types))
+        if self.start is not None:
+            mask &= times >= self.start
+        if self.end is not None:
+            mask &= times < self.end
+        return rows[mask]
+
+    def _payloads(self, rows):
+        view = memoryview(self.data)
+        offsets = self.index.offsets[rows].tolist()
+        sizes = self.index.sizes[rows].tolist()
+        return [view[o:o + s] for o, s in zip(offsets, sizes)]
+
+    def _cached(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    #############
+    # Accessors #
+    #############
+    def activity(self, calibrated=True):
+        # One row per x/y/z sample, timed from its record timestamp. Nebula
+        # samples are calibrated with the block of their sample rate.
+        return self._cached(('activity', calibrated), lambda: self._activity(calibrated))
+
+    def _activity(self, calibrated):
+        rows = self._select(ACTIVITY_TYPES)
+        rows = rows[self.index.sizes[rows] > 1]  # 0/1 byte records are USB dock events
+        types = self.index.types[rows]
+        payloads = self._payloads(rows)
+
+        times, xyz = [], []
+        # Decode runs of records of the same type and sample rate together #
+        rates = np.array([activity_sample_rate(t, len(p)) for t, p in zip(types.tolist(), payloads)])
+        breaks = np.flatnonzero((np.diff(types) != 0) | (np.diff(rates) != 0)) + 1
+        for start, end in zip(np.concatenate(([0], breaks)), np.concatenate((breaks, [len(rows)]))):
+            if start == end:
+                continue
+            record_type = int(types[start])
+            values, counts = decode_activity(record_type, payloads[start:end])
+            rate = rates[start]
+            if (calibrated and record_type == NEBULA and self.calibration is not None
+                    and int(rate) in CALIBRATION_RATES):
+                values = apply_calibration(values, *calibration_matrices(self.calibration, int(rate)))
+            times.append(sample_times_ns(self.index.times[rows[start:end]], counts, np.full(len(counts), rate)))
+            xyz.append(values)
+
+        xyz = np.concatenate(xyz) if xyz else np.empty((0, 3))
+        times = np.concatenate(times) if times else np.zeros(0, np.int64)
+        df = pd.DataFrame({'time': pd.to_datetime(times, unit='ns', utc=True),
+                           'x': xyz[:, 0], 'y': xyz[:, 1], 'z': xyz[:, 2]})
+        df['vm'] = np.sqrt((xyz ** 2).sum(axis=1))
+        return df
+
+    def battery(self):
+        return self._cached('battery', self._battery)
+
+    def _battery(self):
+        rows = self._select((2,))
+        rows = rows[self.index.sizes[rows] > 0]
+        volts = decode_battery(self._payloads(rows)) if len(rows) else np.zeros(0)
+        return pd.DataFrame({'time': _to_datetime(self.index.times[rows]), 'voltage': volts})
+
+    def temperature(self):
+        # MCU/ADXL (type 30) and TMP117 (type 31) readings. Calibrated
+        # mcu_c/adxl_c columns are added when the log has a temperature
+        # calibration.
+        return self._cached('temperature', self._temperature)
+
+    def _temperature(self):
+        rows = self._select((30, 31))
+        types = self.index.types[rows]
+        mcu = np.full(len(rows), np.nan)
+        adxl = np.full(len(rows), np.nan)
+        tmp117 = np.full(len(rows), np.nan)
+
+        k = np.flatnonzero(types == 30)
+        if len(k):
+            raw = decode_fixed_records(self._payloads(rows[k]), MCU_ADXL_TEMPERATURE_DTYPE)
+            mcu[k] = raw['mcu']
+            adxl[k] = raw['adxl']
+        k = np.flatnonzero(types == 31)
+        if len(k):
+            tmp117[k] = decode_fixed_records(self._payloads(rows[k]), TMP117_TEMPERATURE_DTYPE)['tmp117']
+
+        df = pd.DataFrame({'time': _to_datetime(self.index.times[rows]), 'record_type': types,
+                           'mcu': mcu, 'adxl': adxl, 'tmp117': tmp117})
+        if self.temperature_calibration is not None:
+            gains, offsets = self.temperature_calibration
+            df['mcu_c'] = mcu * gains[0] + offsets[0]
+            df['adxl_c'] = adxl * gains[1] + offsets[1]
+        return df
+
+    def events(self):
+        # Resets, idle sleep, USB dock, errors, markers and button presses #
+        return self._cached('events', self._events)
+
+    def _events(self):
+        index = self.index
+        rows = self._select((3, 19, 23, 24, 28, 29) + ACTIVITY_TYPES)
+        types = index.types[rows].tolist()
+        sizes = index.sizes[rows].tolist()
+        payloads = self._payloads(rows)
+
+        keep, names = [], []
+        for k, (record_type, size, payload) in enumerate(zip(types, sizes, payloads)):
+            code = payload[0] if size else None
+            if record_type in ACTIVITY_TYPES:
+                name = 'USB DOCK' if size <= 1 else None
+            elif record_type == 3:
+                name = EVENT_NAMES.get(code, 'Event Type %s' % bytes(payload).hex())
+            elif record_type == 29:
+                name = BUTTON_EVENT_NAMES.get(code)
+            else:
+                name = RECORD_EVENT_NAMES[record_type]
+            if name is not None:
+                keep.append(k)
+                names.append(name)
+
+        keep = np.array(keep, dtype=np.int64)
+        return pd.DataFrame({'time': _to_datetime(index.times[rows[keep]]),
+                             'record_type': index.types[rows[keep]], 'event': names})
+
+    def imu(self):
+        # Type 25 samples decoded with the type 24 schema preceding them #
+        return self._cached('imu', self._imu)
+
+    def _imu(self):
+        # Schemas ahead of the time window still apply to the samples in it #
+        rows = np.flatnonzero(self.index.types == 24)
+        if self.end is not None:
+            rows = rows[self.index.times[rows] < self.end]
+        schemas = [(int(r), imu_schema_from_payload(p)) for r, p in zip(rows, self._payloads(rows))]
+
+        frames = []
+        samples = self._select((25,))
+        positions = [r for r, _ in schemas]
+        for r, payload in zip(samples.tolist(), self._payloads(samples)):
+            s = np.searchsorted(positions, r) - 1
+            if s < 0:
+                continue
+            schema = schemas[s][1]
+            values = decode_imu_samples(payload, schema)
+            if len(values):
+                frame = pd.DataFrame(values, columns=schema.names)
+                frame.insert(0, 'time', _to_datetime(self.index.times[r] + np.arange(len(values)) / len(values)))
+                frames.append(frame)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame({'time': _to_datetime([])})
@@ -0,0 +1,125 @@
+import json
+import os
+
+import numpy as np
+
+from streaming import NS
+
+#####################################################################
+# Activity as raw .npy arrays that downstream code can memory map
+# instead of re-reading the CSVs:
+#
+#     time, xyz, info = load_activity('output_files/NumPy Files/', 'MOS2C12345678')
+#
+# <filename>_time.npy     int64 sample times, ns since the unix epoch
+# <filename>_xyz.npy      float32 (N, 3) x/y/z
+# <filename>_records.npy  int64 (R, 2) first sample and timestamp (ns)
+#                         of every activity record
+# <filename>.json         sample rates and units (g or raw Nebula
+#                         counts) of each run of records, calibration
+#                         state, file names
+#
+# Arrays are written a chunk at a time. Their headers only get the final
+# shape when the sink is closed, until then they read as empty arrays.
+#####################################################################
+
+
+class NpyArrayWriter:
+    # A .npy file appended to one block of rows at a time #
+
+    def __init__(self, path, dtype, columns=None):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.columns = columns
+        self.rows = 0
+        self._fout = open(path, 'wb')
+        self._write_header()
+        self._data_start = self._fout.tell()
+
+    def _write_header(self):
+        shape = (self.rows,) if self.columns is None else (self.rows, self.columns)
+        np.lib.format.write_array_header_1_0(self._fout, {'descr': np.lib.format.dtype_to_descr(self.dtype),
+                                                          'fortran_order': False, 'shape': shape})
+
+    def append(self, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        self._fout.write(values.tobytes())
+        self.rows += len(values)
+
+    def close(self):
+        if self._fout is None:
+            return
+        self._fout.seek(0)
+        self._write_header()
+        if self._fout.tell() != self._data_start:
+            raise ValueError('%s: the .npy header grew past its reserved size' % self.path)
+        self._fout.close()
+        self._fout = None
+
+
+class NpyActivitySink:
+    # ActivityStream sink writing the arrays above to directory #
+
+    def __init__(self, directory, filename):
+        self.directory = directory
+        self.filename = filename
+        self.time = NpyArrayWriter(os.path.join(directory, filename + '_time.npy'), np.int64)
+        self.xyz = NpyArrayWriter(os.path.join(directory, filename + '_xyz.npy'), np.float32, 3)
+        self.records = NpyArrayWriter(os.path.join(directory, filename + '_records.npy'), np.int64, 2)
+        self.rates = []   # [first record, first sample, sample rate, in g] whenever one of them changes
+        self.record_types = set()
+
+    def write_chunk(self, chunk):
+        counts = chunk.counts
+        starts = np.cumsum(counts) - counts
+        record_ns = np.round(np.asarray(chunk.unix_times, np.float64) * NS).astype(np.int64)
+        self.time.append(chunk.time_ns)
+        self.xyz.append(chunk.xyz)
+
+        first_record = self.records.rows
+        first_sample = self.time.rows - int(counts.sum())
+        self.records.append(np.column_stack((starts + first_sample, record_ns)))
+        self.record_types.add(int(chunk.record_type))
+
+        rates = np.asarray(chunk.sample_rates, np.float64)
+        changes = np.flatnonzero(np.diff(rates)) + 1
+        in_g = bool(chunk.in_g)
+        for k in [0] + changes.tolist():
+            rate = float(rates[k])
+            if not self.rates or self.rates[-1][2:] != [rate, in_g]:
+                self.rates.append([first_record + k, first_sample + int(starts[k]), rate, in_g])
+
+    def close(self, calibrated=False):
+        # calibrated: the device calibration was applied #
+        if self.time is None:
+            return
+        for array in (self.time, self.xyz, self.records):
+            array.close()
+        units = sorted({_units(in_g) for _, _, _, in_g in self.rates})
+        info = {'samples': self.time.rows,
+                'records': self.records.rows,
+                'record_types': sorted(self.record_types),
+                'sample_rates': [{'first_record': r, 'first_sample': s, 'hz': hz, 'units': _units(in_g)}
+                                 for r, s, hz, in_g in self.rates],
+                'calibrated': bool(calibrated),
+                'units': units[0] if len(units) == 1 else 'mixed' if units else None,
+                'time': os.path.basename(self.time.path),
+                'xyz': os.path.basename(self.xyz.path),
+                'record_starts': os.path.basename(self.records.path)}
+        with open(os.path.join(self.directory, self.filename + '.json'), 'w') as fout:
+            json.dump(info, fout, indent=1)
+        self.time = None
+
+
+def _units(in_g):
+    return 'g' if in_g else 'raw'
+
+
+def load_activity(directory, filename, mmap_mode='r'):
+    # (sample times, x/y/z, sidecar info); the arrays are memory mapped
+    # unless mmap_mode is None
+    with open(os.path.join(directory, filename + '.json'), 'r') as fin:
+        info = json.load(fin)
+    time = np.load(os.path.join(directory, info['time']), mmap_mode=mmap_mode)
+    xyz = np.load(os.path.join(directory, info['xyz']), mmap_mode=mmap_mode)
+    return time, xyz, info
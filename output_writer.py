@@ -0,0 +1,443 @@
+import collections
+import concurrent.futures
+import gzip
+import os
+import queue
+import threading
+
+import numpy as np
+
+from streaming import NS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+#######################
+# DURABILITY POLICIES #
+#######################
+FSYNC_PER_FILE = 'file'    # fsync each output when it is closed and at every sync() point
+FSYNC_PER_BATCH = 'batch'  # fsync every output touched by a drained batch
+FSYNC_AT_END = 'end'       # fsync everything once, when the writer is closed
+DURABILITY_POLICIES = (FSYNC_PER_FILE, FSYNC_PER_BATCH, FSYNC_AT_END)
+
+###############
+# COMPRESSION #
+###############
+NO_COMPRESSION = ''
+COMPRESS_GZIP = 'gz'       # written as <name>.gz
+COMPRESS_ZSTD = 'zst'      # written as <name>.zst, needs the zstandard package
+COMPRESSIONS = (NO_COMPRESSION, COMPRESS_GZIP, COMPRESS_ZSTD)
+
+COMPRESS_BLOCK_SIZE = 1 << 22              # Characters compressed as one gzip member/zstd frame
+COMPRESS_WORKERS = min(4, os.cpu_count() or 1)
+COMPRESS_PENDING = 2 * COMPRESS_WORKERS    # Blocks in flight per file before the writer waits
+
+QUEUE_DEPTH = 256            # Pending operations before the parser blocks
+QUEUE_BYTES = 32 << 20       # Pending characters before the parser blocks
+BATCH_SIZE = 512             # Operations drained per writer wake up
+SINK_BUFFER_SIZE = 1 << 16   # Characters buffered by a sink before queueing
+FILE_BUFFER_SIZE = 1 << 20
+
+_OPEN, _WRITE, _CLOSE, _SYNC, _FLUSH, _STOP = range(6)
+
+
+def _gzip_block(data):
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def _zstd_block(data):
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+class _CompressedFile:
+    # Text file written as independently compressed blocks. Blocks are
+    # compressed by a shared thread pool (zlib and zstd release the GIL) and
+    # written in order; concatenated gzip members and zstd frames read back
+    # as a single stream with gzip/zstd tools and pandas.read_csv.
+
+    def __init__(self, path, mode, compress, pool):
+        self.name = path
+        self._raw = open(path, mode + 'b', buffering=FILE_BUFFER_SIZE)
+        self._compress = compress
+        self._pool = pool
+        self._text = []
+        self._text_size = 0
+        self._blocks = collections.deque()
+
+    def write(self, text):
+        self._text.append(text)
+        self._text_size += len(text)
+        if self._text_size >= COMPRESS_BLOCK_SIZE:
+            self._submit_block()
+        while self._blocks and (self._blocks[0].done() or len(self._blocks) > COMPRESS_PENDING):
+            self._raw.write(self._blocks.popleft().result())
+
+    def flush(self):
+        self._submit_block()
+        while self._blocks:
+            self._raw.write(self._blocks.popleft().result())
+        self._raw.flush()
+
+    def fileno(self):
+        return self._raw.fileno()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._raw.close()
+
+    def _submit_block(self):
+        if self._text:
+            data = ''.join(self._text).encode('utf-8')
+            self._text = []
+            self._text_size = 0
+            self._blocks.append(self._pool.submit(self._compress, data))
+
+
+class OutputSink:
+    # File-like handle whose writes are carried out by the BackgroundWriter
+    # thread. A sink must only be written from the thread that opened it.
+
+    def __init__(self, writer, path):
+        self.name = path
+        self._writer = writer
+        self._pending = []
+        self._pending_size = 0
+        self.closed = False
+
+    def write(self, text):
+        self._pending.append(text)
+        self._pending_size += len(text)
+        if self._pending_size >= SINK_BUFFER_SIZE:
+            self._submit_pending()
+        return len(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self._submit_pending()
+
+    def close(self):
+        if not self.closed:
+            self._submit_pending()
+            self._writer._submit((_CLOSE, self, None))
+            self._writer._sinks.discard(self)
+            self.closed = True
+
+    def _submit_pending(self):
+        if self._pending:
+            self._writer._submit((_WRITE, self, ''.join(self._pending)))
+            self._pending = []
+            self._pending_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BackgroundWriter:
+    # Owns every output file of a parse. The parse loop only appends to sink
+    # buffers; a dedicated thread drains the bounded queue in large batches
+    # and performs the actual writes and fsyncs.
+    #
+    # With compression set, outputs opened with compress=True get the
+    # compression suffix and are compressed in a thread pool behind the
+    # writer thread.
+
+    def __init__(self, durability=FSYNC_PER_FILE, queue_depth=QUEUE_DEPTH, queue_bytes=QUEUE_BYTES,
+                 compression=NO_COMPRESSION):
+        if durability not in DURABILITY_POLICIES:
+            raise ValueError('unknown durability policy: %s' % durability)
+        if compression not in COMPRESSIONS:
+            raise ValueError('unknown compression: %s' % compression)
+        if compression == COMPRESS_ZSTD and zstandard is None:
+            raise ValueError('zstd compression needs the zstandard package')
+        self.durability = durability
+        self.compression = compression
+        self._compress = {COMPRESS_GZIP: _gzip_block, COMPRESS_ZSTD: _zstd_block}.get(compression)
+        self._compress_pool = None
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._queue_bytes = queue_bytes
+        self._pending_bytes = 0
+        self._pending_changed = threading.Condition()
+        self._sinks = set()
+        self._files = {}
+        self._closed_paths = []
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='output-writer', daemon=True)
+        self._thread.start()
+
+    ###############
+    # Parser side #
+    ###############
+    def open(self, path, mode='w', compress=True):
+        # Small reports meant to be read or appended to by hand pass compress=False #
+        compressed = bool(self.compression and compress)
+        sink = OutputSink(self, self.output_path(path, compressed))
+        self._submit((_OPEN, sink, (mode, compressed)))
+        self._sinks.add(sink)
+        return sink
+
+    def output_path(self, path, compress=True):
+        # Name the output of path is written under #
+        return path + '.' + self.compression if self.compression and compress else path
+
+    def sync(self, *sinks):
+        for sink in sinks:
+            sink.flush()
+            self._submit((_SYNC, sink, None))
+
+    def wait(self):
+        # Block until everything written so far has reached the OS #
+        for sink in list(self._sinks):
+            sink.flush()
+        self._submit((_FLUSH, None, None))
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        for sink in list(self._sinks):
+            sink.close()
+        if self._thread.is_alive():
+            self._queue.put((_STOP, None, None))
+            self._thread.join()
+        self._raise_error()
+
+    def _submit(self, op):
+        self._raise_error()
+        if op[0] == _WRITE:
+            # Large chunk writes are bounded by size, not only by count #
+            with self._pending_changed:
+                while self._pending_bytes and self._pending_bytes + len(op[2]) > self._queue_bytes:
+                    self._pending_changed.wait()
+                self._pending_bytes += len(op[2])
+        self._queue.put(op)
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    ###############
+    # Writer side #
+    ###############
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            try:
+                if self._error is None:
+                    stop = self._apply(batch)
+                else:
+                    stop = any(op == _STOP for op, _, _ in batch)
+            except Exception as e:
+                self._error = e
+                stop = any(op == _STOP for op, _, _ in batch)
+            finally:
+                written = sum(len(arg) for op, _, arg in batch if op == _WRITE)
+                if written:
+                    with self._pending_changed:
+                        self._pending_bytes -= written
+                        self._pending_changed.notify_all()
+                for _ in batch:
+                    self._queue.task_done()
+
+        try:
+            self._finish()
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+
+    def _apply(self, batch):
+        # Consecutive writes to the same sink are joined into one write #
+        pending = {}
+        dirty = set()
+        stop = False
+
+        for op, sink, arg in batch:
+            if op == _WRITE:
+                pending.setdefault(sink, []).append(arg)
+                continue
+            if sink is None:
+                for other, chunks in pending.items():
+                    self._write(other, chunks, dirty)
+                pending.clear()
+            elif sink in pending:
+                self._write(sink, pending.pop(sink), dirty)
+
+            if op == _OPEN:
+                mode, compressed = arg
+                if compressed:
+                    if self._compress_pool is None:
+                        self._compress_pool = concurrent.futures.ThreadPoolExecutor(
+                            COMPRESS_WORKERS, thread_name_prefix='output-compress')
+                    self._files[sink] = _CompressedFile(sink.name, mode, self._compress, self._compress_pool)
+                else:
+                    self._files[sink] = open(sink.name, mode, buffering=FILE_BUFFER_SIZE)
+            elif op == _CLOSE:
+                f = self._files.pop(sink)
+                if self.durability == FSYNC_PER_BATCH and sink in dirty:
+                    self._fsync(f)
+                dirty.discard(sink)
+                self._close(f)
+            elif op == _SYNC:
+                if self.durability == FSYNC_PER_FILE:
+                    self._fsync(self._files[sink])
+                else:
+                    self._files[sink].flush()
+            elif op == _FLUSH:
+                for f in self._files.values():
+                    f.flush()
+            elif op == _STOP:
+                stop = True
+
+        for sink, chunks in pending.items():
+            self._write(sink, chunks, dirty)
+
+        if self.durability == FSYNC_PER_BATCH:
+            for sink in dirty:
+                self._fsync(self._files[sink])
+        return stop
+
+    def _write(self, sink, chunks, dirty):
+        self._files[sink].write(''.join(chunks))
+        dirty.add(sink)
+
+    def _close(self, f):
+        if self.durability == FSYNC_PER_FILE:
+            self._fsync(f)
+        f.close()
+        if self.durability == FSYNC_AT_END:
+            self._closed_paths.append(f.name)
+
+    def _finish(self):
+        for f in list(self._files.values()):
+            self._close(f)
+        self._files.clear()
+        if self._compress_pool is not None:
+            self._compress_pool.shutdown()
+            self._compress_pool = None
+
+        if self.durability == FSYNC_AT_END:
+            for path in self._closed_paths:
+                try:
+                    with open(path, 'ab') as f:
+                        os.fsync(f.fileno())
+                except OSError:
+                    # The output may have been moved or deleted after it was closed #
+                    pass
+            self._closed_paths = []
+
+    @staticmethod
+    def _fsync(f):
+        f.flush()
+        os.fsync(f.fileno())
+
+
+#######################
+# ACTIVITY CSV OUTPUT #
+#######################
+ACTIVITY_HEADER = 'ts,t,x,y,z,vm\n'
+ACTIVITY_ROW = ',%.3f,%.6f,%.6f,%.6f,%.6f\n'
+SUBSECOND_ROW = '.%09d' + ACTIVITY_ROW
+ACTIVITY_SPLIT_SECONDS = 172800  # 48 h
+MAX_OPEN_PARTS = 4
+
+
+class ActivityCsvSink:
+    # Writes ActivityChunks as ts,t,x,y,z,vm rows, split into parts on
+    # fixed time boundaries. A record goes to the part holding its
+    # timestamp: part k covers [k * split_seconds, (k + 1) * split_seconds)
+    # of unix time, so a daily split cuts at UTC midnight, and the part is
+    # named <filename>-<start of part>.csv whatever the log's first
+    # record is. Each open part has its own BackgroundWriter (thread), with
+    # the durability and compression of writer, so parts are written
+    # concurrently; one the clock jumps back into is reopened for
+    # appending. split_seconds=0 writes a single <filename>.csv. subsecond
+    # adds each sample's exact fraction of a second (ns) to the record's ts.
+
+    def __init__(self, writer, directory, filename, split_seconds=ACTIVITY_SPLIT_SECONDS, subsecond=False):
+        self.writer = writer
+        self.directory = directory
+        self.filename = filename
+        self.split_seconds = int(split_seconds)
+        self.subsecond = subsecond
+        self.parts = collections.OrderedDict()   # open parts' (writer, sink), least recently used first
+        self.written = set()
+
+    def part_path(self, part):
+        if not self.split_seconds:
+            return self.directory + self.filename + '.csv'
+        return self.directory + self.filename + '-' + str(part * self.split_seconds) + '.csv'
+
+    def write_chunk(self, chunk):
+        if self.split_seconds:
+            parts = np.floor_divide(chunk.unix_times, self.split_seconds).astype(np.int64)
+        else:
+            parts = np.zeros(len(chunk.counts), np.int64)
+        if self.subsecond:
+            row = SUBSECOND_ROW
+            values = np.column_stack((chunk.time_ns % NS, chunk.t, chunk.xyz, chunk.vm))
+        else:
+            row = ACTIVITY_ROW
+            values = np.column_stack((chunk.t, chunk.xyz, chunk.vm))
+        ends = np.cumsum(chunk.counts)
+
+        # Runs of records in the same part #
+        runs = np.flatnonzero(np.diff(parts)) + 1
+        for a, b in zip([0] + runs.tolist(), runs.tolist() + [len(parts)]):
+            start = int(ends[a - 1]) if a else 0
+            text = ''.join([(timestamp + row) * count
+                            for timestamp, count in zip(chunk.timestamps[a:b], chunk.counts[a:b].tolist())])
+            if text:
+                self._part(int(parts[a])).write(text % tuple(values[start:int(ends[b - 1])].ravel().tolist()))
+
+    def _part(self, part):
+        if part in self.parts:
+            self.parts.move_to_end(part)
+            return self.parts[part][1]
+        if len(self.parts) >= MAX_OPEN_PARTS:
+            self._close_part(*self.parts.popitem(last=False)[1])
+        # The open parts share the pending write bound of one writer #
+        writer = BackgroundWriter(self.writer.durability, queue_bytes=QUEUE_BYTES // MAX_OPEN_PARTS,
+                                  compression=self.writer.compression)
+        if part in self.written:
+            fout = writer.open(self.part_path(part), 'a')
+        else:
+            fout = writer.open(self.part_path(part))
+            fout.write(ACTIVITY_HEADER)
+            self.written.add(part)
+        self.parts[part] = (writer, fout)
+        return fout
+
+    @staticmethod
+    def _close_part(writer, fout):
+        fout.close()
+        writer.close()
+
+    def close(self):
+        # Waits for every part's writer, raising the first write error #
+        parts = list(self.parts.values())
+        self.parts.clear()
+        error = None
+        for writer, fout in parts:
+            try:
+                self._close_part(writer, fout)
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
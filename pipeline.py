@@ -0,0 +1,47 @@
+#####################################################################
+# Record stream stages. A parse is a chain of generators:
+#
+#     source    log.bin of the container or the raw log (process_file)
+#     framer    logparser3_9.parse(), only the record types some handler
+#               of the requested outputs consumes
+#     filters   the stages below, only chained when their option is on
+#     dispatch  RECORD_HANDLERS, one dict lookup per record
+#     activity  ActivityStream: decode -> calibrate -> detect -> sinks,
+#               a batch at a time, fanned out to every activity sink
+#
+#     records = parse(fin, min_time, max_time, recordTypes)
+#     if job is not None:
+#         records = checkpoints(records)
+#     if not NoFilter:
+#         records = time_window(records, begin, end)
+#
+# An option that is off adds no stage, so it costs nothing per record.
+#####################################################################
+
+
+def time_window(records, begin, end):
+    # Records with begin < timestamp < end. Logs are written in time
+    # order, so the stream stops at the first record after end.
+    for record in records:
+        if record.timestamp > end:
+            return
+        if begin < record.timestamp < end:
+            yield record
+
+
+class Checkpoints:
+    # Calls check(record) every `every` records and stops the stream when
+    # it returns False; stopped tells the stream was cut short.
+
+    def __init__(self, every, check):
+        self.every = every
+        self.check = check
+        self.stopped = False
+
+    def __call__(self, records):
+        every = self.every
+        for n, record in enumerate(records, 1):
+            if not n % every and not self.check(record):
+                self.stopped = True
+                return
+            yield record
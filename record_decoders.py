@@ -0,0 +1,330 @@
+import collections
+
+import numpy as np
+
+
+#####################
+# IMU SCHEMA (24/25) #
+#####################
+# The type 24 record describes the layout of every sample carried by the
+# type 25 records that follow it:
+#   uint16le reserved, uint16le column count, uint16le reserved, then per
+#   column: uint8 flags, uint8 offset (bytes), uint8 size (bits),
+#   uint32be scale factor, char[16] column name
+IMU_SCHEMA_HEADER_SIZE = 6
+IMU_SCHEMA_COLUMN_DTYPE = np.dtype([('flags', 'u1'),
+                                    ('offset', 'u1'),
+                                    ('size', 'u1'),
+                                    ('scale', '>u4'),
+                                    ('name', 'S16')])
+
+# Type 25 payloads start with a 16 bit sequence word ahead of the samples #
+IMU_SAMPLES_OFFSET = 2
+
+# The fourth column (the temperature) is reported relative to 21 degC #
+IMU_TEMPERATURE_COLUMN = 3
+IMU_TEMPERATURE_OFFSET = 21
+
+# Raw IMU column values are big-endian signed integers #
+IMU_RAW_FORMATS = {8: 'i1', 16: '>i2', 32: '>i4'}
+
+ImuSchema = collections.namedtuple('ImuSchema', 'names dtype scale offset')
+
+
+def imu_schema_from_payload(payload):
+    columns = int.from_bytes(payload[2:4], 'little')
+    table = np.frombuffer(payload, dtype=IMU_SCHEMA_COLUMN_DTYPE, count=columns,
+                          offset=IMU_SCHEMA_HEADER_SIZE)
+
+    names = []
+    for c, n in enumerate(table['name']):
+        name = n.split(b'\x00')[0].decode('utf-8', 'replace').strip()
+        names.append(name if name and name not in names else 'column_%d' % c)
+    sizes = table['size'].astype(int) // 8
+    offsets = table['offset'].astype(int)
+
+    # Firmware that leaves the offsets at 0 packs the columns back to back #
+    if len(set(offsets.tolist())) != len(offsets):
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+    itemsize = int(max(sizes.sum(), (offsets + sizes).max())) if columns else 0
+    dtype = np.dtype({'names': names,
+                      'formats': [IMU_RAW_FORMATS[8 * s] for s in sizes],
+                      'offsets': offsets.tolist(),
+                      'itemsize': itemsize})
+
+    # The scale factors are kept as logged but not applied: samples are
+    # written in raw counts, as the bitstring decoder did
+    scale = table['scale'].astype(np.int64)
+    offset = np.zeros(columns, dtype=np.float64)
+    if columns > IMU_TEMPERATURE_COLUMN:
+        offset[IMU_TEMPERATURE_COLUMN] = IMU_TEMPERATURE_OFFSET
+
+    return ImuSchema(names, dtype, scale, offset)
+
+
+def decode_imu_samples(payload, schema):
+    if schema.dtype.itemsize == 0:
+        return np.empty((0, len(schema.names)))
+    count = (len(payload) - IMU_SAMPLES_OFFSET) // schema.dtype.itemsize
+    raw = np.frombuffer(payload, dtype=schema.dtype, count=count, offset=IMU_SAMPLES_OFFSET)
+
+    values = np.empty((count, len(schema.names)), dtype=np.float64)
+    for c, name in enumerate(schema.names):
+        values[:, c] = raw[name]
+    return values + schema.offset
+
+
+##############################################
+# LOW RATE RECORDS (2, 30, 31, 40, 100-203)  #
+##############################################
+BATTERY_DTYPE = np.dtype('<u2')
+BATTERY_SCALE = 0.001  # mV -> V
+
+# Type 30: MCU + ADXL temperature, type 31: TMP117 temperature #
+MCU_ADXL_TEMPERATURE_DTYPE = np.dtype([('mcu_sensor', 'u1'),
+                                       ('mcu', '<u2'),
+                                       ('adxl_sensor', 'u1'),
+                                       ('adxl', '<i2')])
+TMP117_TEMPERATURE_DTYPE = np.dtype([('sensor', 'u1'),
+                                     ('tmp117', '<u2')])
+TEMPERATURE_PERIOD = 4  # Seconds, TODO Make adjustable
+
+CALIBRATION_SAMPLE_DTYPE = np.dtype([('x', '<i2'), ('y', '<i2'), ('z', '<i2')])
+CALIBRATION_ORIENTATION_TYPES = range(100, 114)
+CALIBRATION_SAMPLE_TYPES = (200, 201, 202, 203)
+
+REGISTER_DUMP_DTYPE = np.dtype([('register', 'u1'), ('value', 'u1')])
+REGISTER_DUMP_PAIRS = 36
+
+LOW_RATE_TYPES = frozenset((2, 30, 31, 40) + tuple(CALIBRATION_ORIENTATION_TYPES) + CALIBRATION_SAMPLE_TYPES)
+
+
+def decode_fixed_records(payloads, dtype):
+    # Records are cut (or zero padded) to the dtype size so the whole
+    # batch can be viewed with one np.frombuffer call
+    size = dtype.itemsize
+    buf = b''.join(bytes(p[:size]).ljust(size, b'\x00') for p in payloads)
+    return np.frombuffer(buf, dtype=dtype, count=len(payloads))
+
+
+def decode_battery(payloads):
+    if all(len(p) == BATTERY_DTYPE.itemsize for p in payloads):
+        raw = decode_fixed_records(payloads, BATTERY_DTYPE)
+    else:
+        raw = np.array([int.from_bytes(p, 'little') for p in payloads], dtype=np.float64)
+    return raw * BATTERY_SCALE
+
+
+LOW_RATE_CHUNK_RECORDS = 16384
+
+
+class LowRateRecords:
+    # Collects the low rate records of a file so each kind is decoded in a
+    # single pass. The *_lines methods consume what has been collected so
+    # far; the temperature clock and calibration header state carry over.
+
+    def __init__(self):
+        self.battery = []
+        self.temperature = []
+        self.calibration = []
+        self.register_dumps = []
+        self.temperature_count = 0
+        self.orientation = False
+
+    def __len__(self):
+        return len(self.battery) + len(self.temperature) + len(self.calibration) + len(self.register_dumps)
+
+    def add(self, record_type, timestamp, payload):
+        if record_type == 2:
+            if payload:
+                self.battery.append((timestamp, payload))
+        elif record_type == 30 or record_type == 31:
+            self.temperature.append((record_type, timestamp, payload))
+        elif record_type in CALIBRATION_ORIENTATION_TYPES or record_type in CALIBRATION_SAMPLE_TYPES:
+            self.calibration.append((record_type, payload))
+        elif record_type == 40:
+            self.register_dumps.append((timestamp, payload))
+
+    def battery_lines(self):
+        if not self.battery:
+            return []
+        volts = decode_battery([p for _, p in self.battery])
+        lines = ["%s,%f\n" % (ts, v) for (ts, _), v in zip(self.battery, volts.tolist())]
+        self.battery = []
+        return lines
+
+    def temperature_lines(self, gains=None, offsets=None):
+        # gains/offsets are (MCU, ADXL) vectors from the temperature calibration #
+        lines = [None] * len(self.temperature)
+        types = np.array([t for t, _, _ in self.temperature], dtype=np.uint8)
+        timedelta = TEMPERATURE_PERIOD * (self.temperature_count + np.arange(1, len(types) + 1))
+
+        index = np.flatnonzero(types == 30)
+        if len(index):
+            raw = decode_fixed_records([self.temperature[k][2] for k in index], MCU_ADXL_TEMPERATURE_DTYPE)
+            columns = zip(index.tolist(), timedelta[index].tolist(), raw['mcu_sensor'].tolist(),
+                          raw['mcu'].tolist(), raw['adxl_sensor'].tolist(), raw['adxl'].tolist())
+            if gains is not None:
+                calibrated = np.column_stack((raw['mcu'], raw['adxl'])) * gains + offsets
+                for (k, td, s1, mcu, s2, adxl), (mcu_cal, adxl_cal) in zip(columns, calibrated.tolist()):
+                    lines[k] = "%s,%d,%d,%d,%d,%d,%0.2f,%0.2f\n" % (self.temperature[k][1], td, s1, mcu, s2, adxl,
+                                                                    mcu_cal, adxl_cal)
+            else:
+                for k, td, s1, mcu, s2, adxl in columns:
+                    lines[k] = "%s,%d,%d,%d,%d,%d\n" % (self.temperature[k][1], td, s1, mcu, s2, adxl)
+
+        index = np.flatnonzero(types == 31)
+        if len(index):
+            raw = decode_fixed_records([self.temperature[k][2] for k in index], TMP117_TEMPERATURE_DTYPE)
+            for k, td, s1, tmp117 in zip(index.tolist(), timedelta[index].tolist(), raw['sensor'].tolist(),
+                                         raw['tmp117'].tolist()):
+                lines[k] = "%s,%d,%d,%d\n" % (self.temperature[k][1], td, s1, tmp117)
+
+        self.temperature_count += len(types)
+        self.temperature = []
+        return lines
+
+    def calibration_lines(self):
+        samples = [p for t, p in self.calibration if t in CALIBRATION_SAMPLE_TYPES]
+        if samples:
+            cal = decode_fixed_records(samples, CALIBRATION_SAMPLE_DTYPE)
+            values = iter(np.column_stack((cal['x'], cal['y'], cal['z'])).astype(np.float64).tolist())
+
+        lines = []
+        orientation = self.orientation
+        for record_type, _ in self.calibration:
+            if record_type in CALIBRATION_ORIENTATION_TYPES:
+                lines.append("LOG_CAL_ORIENTATION_%s\n" % str(record_type - 100))
+                orientation = True
+                continue
+            if record_type == 200 and orientation is True:
+                lines.append("32HZ_CAL_DATA\n")
+                orientation = False
+            if record_type == 201 and orientation is False:
+                lines.append("64HZ_CAL_DATA\n")
+                orientation = True
+            if record_type == 202 and orientation is True:
+                lines.append("128HZ_CAL_DATA\n")
+                orientation = False
+            if record_type == 203 and orientation is False:
+                lines.append("256HZ_CAL_DATA\n")
+                orientation = True
+            lines.append("%.6f,%.6f,%.6f\n" % tuple(next(values)))
+        self.orientation = orientation
+        self.calibration = []
+        return lines
+
+    def register_dump_lines(self):
+        if not self.register_dumps:
+            return []
+        dumps = decode_fixed_records([p for _, p in self.register_dumps],
+                                     np.dtype((REGISTER_DUMP_DTYPE, REGISTER_DUMP_PAIRS)))
+        lines = []
+        for (ts, _), dump in zip(self.register_dumps, dumps):
+            lines.append(ts)
+            lines.extend('%02x %02x' % pair for pair in zip(dump['register'].tolist(), dump['value'].tolist()))
+        self.register_dumps = []
+        return lines
+
+
+############################
+# ACTIVITY (0, 26, 27)     #
+############################
+NEBULA = 27
+TASO = 26
+MOSES = 0
+ACTIVITY_TYPES = (MOSES, TASO, NEBULA)
+
+# Bytes per x/y/z sample: packed 12 bit big-endian for Nebula/Moses, int16le for Taso #
+ACTIVITY_SAMPLE_BYTES = {NEBULA: 4.5, MOSES: 4.5, TASO: 6}
+ACTIVITY_SCALE = {NEBULA: 1.0, MOSES: 256.0, TASO: 256.0}
+
+
+def activity_sample_rate(record_type, length):
+    return length / ACTIVITY_SAMPLE_BYTES[record_type]
+
+
+def decode_activity(record_type, payloads):
+    # Decodes a batch of activity records of one type into an (N, 3) array
+    # and the number of samples taken from each record
+    counts = np.array([int(activity_sample_rate(record_type, len(p))) for p in payloads], dtype=np.int64)
+    if record_type == TASO:
+        buf = b''.join(bytes(p[:6 * n]) for p, n in zip(payloads, counts.tolist()))
+        xyz = np.frombuffer(buf, dtype='<i2').reshape(-1, 3).astype(np.float64)
+    else:
+        xyz = unpack_12bit(payloads, 3 * counts).reshape(-1, 3)
+    scale = ACTIVITY_SCALE[record_type]
+    if scale != 1.0:
+        xyz /= scale
+    return xyz, counts
+
+
+def unpack_12bit(payloads, values):
+    # Every 3 bytes hold two big-endian 12 bit two's complement values.
+    # Records are cut (or zero padded) to whole byte triplets and the extra
+    # value of an odd count is dropped afterwards.
+    triplets = (np.asarray(values) + 1) // 2
+    buf = b''.join(bytes(p[:3 * n]).ljust(3 * n, b'\x00') for p, n in zip(payloads, triplets.tolist()))
+    b = np.frombuffer(buf, dtype=np.uint8).reshape(-1, 3).astype(np.int16)
+
+    out = np.empty((len(b), 2), dtype=np.int16)
+    out[:, 0] = (b[:, 0] << 4) | (b[:, 1] >> 4)
+    out[:, 1] = ((b[:, 1] & 0x0F) << 8) | b[:, 2]
+    out[out >= 0x800] -= 0x1000
+    out = out.ravel()
+
+    odd = np.flatnonzero(np.asarray(values) % 2)
+    if len(odd):
+        keep = np.ones(len(out), dtype=bool)
+        keep[2 * np.cumsum(triplets)[odd] - 1] = False
+        out = out[keep]
+    return out.astype(np.float64)
+
+
+#####################
+# CALIBRATION       #
+#####################
+CALIBRATION_RATES = (32, 64, 128, 256)
+
+# Key order of calibration.json, also the row order of a .cal file #
+CALIBRATION_ORDER = ['%s%s_%d' % (name, axis, rate)
+                     for rate in CALIBRATION_RATES
+                     for name, axes in (('negativeZeroGOffset', 'XYZ'),
+                                        ('positiveZeroGOffset', 'XYZ'),
+                                        ('zeroGOffset', 'XYZ'),
+                                        ('offset', 'XYZ'),
+                                        ('sensitivity', ('XX', 'YY', 'ZZ', 'XY', 'XZ', 'YZ')))
+                     for axis in axes]
+
+TEMPERATURE_CALIBRATION_ORDER = ["mcuTempHigh",
+                                 "mcuTempLow",
+                                 "adxlTempHigh",
+                                 "adxlTempLow",
+                                 "tempHigh",
+                                 "tempLow",
+                                 "mcuTempCal1",
+                                 "mcuTempCal2",
+                                 "calibrationMethod",
+                                 "calibrationTime",
+                                 "isCalibrated"
+                                 ]
+
+
+def calibration_matrices(calvals, sample_rate):
+    # calvals holds the 72 values in CalibrationOrder: 18 per sample rate
+    # (zero g offsets, offsets, sensitivities and cross axis terms)
+    block = CALIBRATION_RATES.index(sample_rate)
+    txt = np.asarray(calvals[18 * block:18 * (block + 1)], dtype=np.float64)
+    O = txt[9:12]
+    G = txt[12:15]
+    X = txt[15:18]
+    cross = 1 / (X * 0.01 + 250) - 0.004
+    S = np.array([[1 / (G[0] * 0.01), cross[0], cross[1]],
+                  [cross[0], 1 / (G[1] * 0.01), cross[2]],
+                  [cross[1], cross[2], 1 / (G[2] * 0.01)]])
+    return S, O
+
+
+def apply_calibration(xyz, S, O):
+    return (xyz - O) @ S.T
@@ -0,0 +1,36 @@
+import collections
+
+
+class RecordRegistry:
+    # Maps record type IDs to the handlers that consume them. A handler is
+    # registered for the output it feeds, or for None when it is always
+    # needed (summary events). dispatch_table() resolves the handlers of
+    # the requested outputs once, so each record is dispatched with a
+    # single dict lookup and the parser can skip every other record type.
+    #
+    #     @RECORD_HANDLERS.register((41,), output='battery')
+    #     def handle_new_record(state, record, timestamp, unixTime):
+    #         ...
+
+    def __init__(self):
+        self._handlers = collections.defaultdict(list)
+
+    def register(self, record_types, output=None):
+        def decorator(handler):
+            for record_type in record_types:
+                self._handlers[record_type].append((output, handler))
+            return handler
+        return decorator
+
+    def dispatch_table(self, outputs):
+        # {record type: handlers} for the requested outputs, handlers in
+        # registration order
+        table = {}
+        for record_type, handlers in self._handlers.items():
+            selected = tuple(handler for output, handler in handlers if output is None or output in outputs)
+            if selected:
+                table[record_type] = selected
+        return table
+
+    def record_types(self):
+        return set(self._handlers)
@@ -0,0 +1,176 @@
+import collections
+
+import numpy as np
+
+from detectors import PegDetector, FlatDetector, NonWearDetector, region_transitions
+from record_decoders import decode_activity, activity_sample_rate, apply_calibration, NEBULA, TASO
+
+
+######################
+# MEMORY BUDGET      #
+######################
+MEMORY_BUDGET_MB = 64
+
+# Working set per decoded sample: raw and calibrated x/y/z, t, vm, the
+# detector temporaries and the formatted CSV text
+BYTES_PER_SAMPLE = 512
+
+# time_ns: int64 ns since the unix epoch of every sample, t: the sample clock (s),
+# in_g: xyz is in g (else raw Nebula counts, RAW_VM_SCALE per g)
+ActivityChunk = collections.namedtuple('ActivityChunk', 'record_type timestamps unix_times counts sample_rates '
+                                                        'time_ns t xyz vm pegged flat_region in_g')
+
+NS = 1000000000  # Nanoseconds per second
+
+
+def samples_for_budget(memory_budget_mb):
+    return max(1, int(memory_budget_mb * 2 ** 20) // BYTES_PER_SAMPLE)
+
+
+def periods_ns(samples, rates):
+    # ns spanned by `samples` sample periods at `rates` Hz, in integer
+    # arithmetic (exact to the ns, rounded down) for whole rates
+    samples = np.asarray(samples, np.int64)
+    rates = np.asarray(rates, np.float64)
+    if np.all(rates == np.floor(rates)):
+        return samples * NS // rates.astype(np.int64)
+    return np.floor(samples * (NS / rates)).astype(np.int64)
+
+
+def sample_times_ns(unix_times, counts, sample_rates):
+    # Time of every sample: its record's timestamp plus index * period.
+    # Each record starts from its own timestamp, so nothing accumulates.
+    counts = np.asarray(counts, np.int64)
+    starts = np.cumsum(counts) - counts
+    within = np.arange(counts.sum(), dtype=np.int64) - np.repeat(starts, counts)
+    record_ns = np.round(np.asarray(unix_times, np.float64) * NS).astype(np.int64)
+    return np.repeat(record_ns, counts) + periods_ns(within, np.repeat(sample_rates, counts))
+
+
+class ActivityStream:
+    # Buffers activity records until the memory budget is reached, then
+    # decodes, calibrates and runs the peg/flat/non-wear detectors on the
+    # whole chunk. Detector state, the sample clock and the peg/flat region
+    # states carry across chunks, so the result does not depend on where
+    # the chunks were cut and peak memory does not depend on file length.
+
+    def __init__(self, memory_budget_mb=MEMORY_BUDGET_MB, sinks=()):
+        self.max_samples = samples_for_budget(memory_budget_mb)
+        self.sinks = list(sinks)
+        self.calibration = None   # (S, O) of the Nebula calibration, see calibration_matrices
+        self.calibrated = False   # samples are in g (peg limits)
+        self.drift = None         # TemperatureCompensation of the log, see temperature_drift
+        self.peg = PegDetector()
+        self.flat = FlatDetector()
+        self.nonwear = NonWearDetector()
+        self.clock_ns = 0         # Sample clock at the last sample rate change
+        self.clock_rate = None
+        self.clock_samples = 0    # Samples since the last sample rate change
+        self.pegged = False
+        self.flat_region = False
+        self.pegs = 0
+        self.flats = 0
+        self._clear()
+
+    def _clear(self):
+        self.record_type = None
+        self.timestamps = []
+        self.unix_times = []
+        self.payloads = []
+        self.first = []
+        self.samples = 0
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def needs_flush(self, record_type):
+        # A chunk holds one record type and stays within the memory budget #
+        return bool(self.payloads) and (record_type != self.record_type or self.samples >= self.max_samples)
+
+    def add(self, record_type, timestamp, unix_time, payload, first):
+        self.record_type = record_type
+        self.timestamps.append(timestamp)
+        self.unix_times.append(unix_time)
+        self.payloads.append(payload)
+        self.first.append(first)
+        self.samples += int(activity_sample_rate(record_type, len(payload)))
+
+    def flush(self):
+        # Returns (record, label, timestamp, unix time) summary events in
+        # sample order, record being the index of the record in the chunk
+        if not self.payloads:
+            return []
+        record_type = self.record_type
+        xyz, counts = decode_activity(record_type, self.payloads)
+        sample_rates = np.array([activity_sample_rate(record_type, len(p)) for p in self.payloads])
+
+        if record_type == NEBULA and self.calibration is not None:
+            xyz = apply_calibration(xyz, *self.calibration)
+        if record_type == TASO:
+            self.calibrated = True
+        in_g = record_type != NEBULA or self.calibration is not None
+
+        record = np.repeat(np.arange(len(counts)), counts)
+        first = np.repeat(np.array(self.first, dtype=bool), counts)
+
+        unix_times = np.array(self.unix_times)
+        time_ns = sample_times_ns(unix_times, counts, sample_rates)
+        if self.drift is not None:
+            xyz = self.drift.apply(time_ns, xyz, in_g)
+        t = self._clock(np.repeat(sample_rates, counts)) / NS
+        vm = np.sqrt((xyz ** 2).sum(axis=1))
+
+        pegged = self.peg.update(xyz, first, self.calibrated)
+        flat = self.flat.update(xyz, first, self.calibration is not None, np.repeat(sample_rates, counts))
+        flat_region = region_transitions(flat, pegged, self.flat_region)
+        self.nonwear.update(time_ns, xyz, in_g)
+
+        events = self._events(pegged, flat_region, record)
+        if len(t):
+            self.pegged = bool(pegged[-1])
+            self.flat_region = bool(flat_region[-1])
+
+        chunk = ActivityChunk(record_type, self.timestamps, unix_times, counts, sample_rates,
+                              time_ns, t, xyz, vm, pegged, flat_region, in_g)
+        for sink in self.sinks:
+            sink.write_chunk(chunk)
+
+        self._clear()
+        return events
+
+    def _clock(self, rates):
+        # Sample clock (ns) of every sample, one period per sample from the
+        # start of the file. Computed as the clock at the last rate change
+        # + n * period, so it does not drift over long logs the way a
+        # running sum of 1 / rate does.
+        clock = np.empty(len(rates), np.int64)
+        changes = np.flatnonzero(np.diff(rates)) + 1
+        for a, b in zip([0] + changes.tolist(), changes.tolist() + [len(rates)]):
+            rate = rates[a]
+            if rate != self.clock_rate:
+                if self.clock_rate is not None:
+                    self.clock_ns += int(periods_ns(self.clock_samples, self.clock_rate))
+                self.clock_rate = rate
+                self.clock_samples = 0
+            n = self.clock_samples + np.arange(1, b - a + 1)
+            clock[a:b] = self.clock_ns + periods_ns(n, rate)
+            self.clock_samples += b - a
+        return clock
+
+    def _events(self, pegged, flat_region, record):
+        previous = np.concatenate(([self.pegged], pegged[:-1]))
+        peg_on = np.flatnonzero(pegged & ~previous)
+        peg_off = np.flatnonzero(~pegged & previous)
+        previous = np.concatenate(([self.flat_region], flat_region[:-1]))
+        flat_on = np.flatnonzero(flat_region & ~previous)
+        flat_off = np.flatnonzero(~flat_region & previous)
+        self.pegs += len(peg_on)
+        self.flats += len(flat_on)
+
+        # Pegs are checked before flat regions on every sample #
+        labelled = sorted([(s, 0, 'peg @ : ') for s in peg_on.tolist()]
+                          + [(s, 0, 'peg cleared @ : ') for s in peg_off.tolist()]
+                          + [(s, 1, 'Flat Region @ : ') for s in flat_on.tolist()]
+                          + [(s, 1, 'Flat region cleared @ : ') for s in flat_off.tolist()])
+        return [(int(record[s]), label, self.timestamps[record[s]], self.unix_times[record[s]])
+                for s, _, label in labelled]
@@ -0,0 +1,94 @@
+import json
+
+import numpy as np
+
+from detectors import RAW_VM_SCALE
+from logparser3_9 import parse
+from record_decoders import decode_fixed_records, MCU_ADXL_TEMPERATURE_DTYPE
+from streaming import NS
+
+#####################################################################
+# Temperature drift correction of the acceleration. The accelerometer's
+# offsets drift with its temperature, which the device only reports
+# every few seconds (type 30 records, ADXL sensor calibrated to degC by
+# temperature_calibration.json). The readings are joined to the samples
+# by time and every sample is corrected by
+#
+#     xyz -= slope * (temperature - reference)
+#
+# with per device coefficients from a JSON file keyed by serial number:
+#
+#     {"MOS2C12345678": {"slope": [0.0011, -0.0004, 0.0023], "reference": 25.0}}
+#
+# slope is in g per degC for x, y and z. The join is a searchsorted and
+# a linear interpolation over the two time arrays, one numpy pass per
+# chunk. The readings are collected before the parse by a framing pass
+# (stream_temperatures) that only converts the type 30 records.
+#####################################################################
+
+
+def read_drift_coefficients(path):
+    # {serial: (slope (3,), reference degC)} #
+    with open(path, 'r', encoding='utf-8') as fin:
+        devices = json.load(fin)
+    return {serial: (np.asarray(device['slope'], dtype=np.float64), float(device['reference']))
+            for serial, device in devices.items()}
+
+
+def stream_temperatures(fin, min_time, max_time, gains, offsets):
+    # (ns, degC) of the ADXL readings of an open log stream in time order,
+    # calibrated with the (MCU, ADXL) gains/offsets of the temperature
+    # calibration. Empty when there is none (gains is None).
+    if gains is None:
+        return np.zeros(0, np.int64), np.zeros(0)
+    times, payloads = [], []
+    for record in parse(fin, min_time, max_time, {30}):
+        if record.type == 30:
+            times.append(int(record.timestamp.timestamp()))
+            payloads.append(bytes.fromhex(record.payload))
+    adxl = decode_fixed_records(payloads, MCU_ADXL_TEMPERATURE_DTYPE)['adxl'] if payloads else np.zeros(0)
+    times = np.array(times, dtype=np.int64) * NS
+    order = np.argsort(times, kind='stable')
+    return times[order], (adxl * gains[1] + offsets[1])[order]
+
+
+def log_temperatures(log):
+    # (ns, degC) of the calibrated ADXL readings of a NebulaLog in time
+    # order, empty when the log has no temperature calibration
+    df = log.temperature()
+    if 'adxl_c' not in df:
+        return np.zeros(0, np.int64), np.zeros(0)
+    df = df[df['record_type'] == 30]
+    times = df['time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    order = np.argsort(times, kind='stable')
+    return times[order], df['adxl_c'].to_numpy(np.float64)[order]
+
+
+def interpolate_at(times, values, at):
+    # values (sampled at the sorted int64 times) at every time of `at`,
+    # linearly interpolated, held before the first and after the last
+    right = np.searchsorted(times, at, side='right')
+    hi = np.minimum(right, len(times) - 1)
+    lo = np.maximum(right - 1, 0)
+    span = times[hi] - times[lo]
+    weight = np.where(span > 0, (at - times[lo]) / np.where(span > 0, span, 1), 0.0)
+    weight = np.clip(weight, 0.0, 1.0)
+    return values[lo] + weight * (values[hi] - values[lo])
+
+
+class TemperatureCompensation:
+    # ActivityStream stage: corrects each chunk of samples with the
+    # temperature readings of the whole log, so the result does not
+    # depend on where the chunks were cut
+
+    def __init__(self, times, celsius, slope, reference):
+        self.times = np.asarray(times, dtype=np.int64)
+        self.celsius = np.asarray(celsius, dtype=np.float64)
+        self.slope = np.asarray(slope, dtype=np.float64)
+        self.reference = reference
+
+    def apply(self, time_ns, xyz, in_g):
+        # xyz is in g, or raw Nebula counts (RAW_VM_SCALE per g) #
+        delta = interpolate_at(self.times, self.celsius, time_ns) - self.reference
+        slope = self.slope if in_g else self.slope * RAW_VM_SCALE
+        return xyz - delta[:, None] * slope
@@ -0,0 +1,49 @@
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logparser3_9 import parse, frame, CORRUPT_BYTES
+from synthetic_logs import activity_records, inject_corruption, MIN_TIME, MAX_TIME
+
+#####################################################################
+# Times parse() and frame() on a synthetic log with injected corruption:
+#
+#     python tests/benchmark_corruption.py --hours 24 --every 5
+#
+# --every 5 corrupts about one record in five.
+#####################################################################
+
+
+def main():
+    argParser = argparse.ArgumentParser(description='Time parsing a corrupted synthetic log')
+    argParser.add_argument('--hours', type=float, default=6, help='Log length at 30 Hz')
+    argParser.add_argument('--every', type=int, default=5, help='Corrupt about one in this many records')
+    argParser.add_argument('--seed', type=int, default=0)
+    args = argParser.parse_args()
+
+    data, injected, intact = inject_corruption(activity_records(int(args.hours * 3600), seed=args.seed),
+                                               args.seed, args.every)
+    print('%.1f MB, %d corrupt ranges, %d intact records' % (len(data) / 2 ** 20, len(injected), len(intact)))
+
+    start = time.perf_counter()
+    records = corrupt = 0
+    for record in parse(io.BytesIO(data), MIN_TIME, MAX_TIME, payloads=False):
+        records += record.type < CORRUPT_BYTES
+        corrupt += record.type == CORRUPT_BYTES
+    elapsed = time.perf_counter() - start
+    print('parse(): %.2f s, %.1f MB/s, %d records, %d corrupt ranges'
+          % (elapsed, len(data) / 2 ** 20 / elapsed, records, corrupt))
+
+    start = time.perf_counter()
+    types, _, _, _, ranges = frame(data, MIN_TIME, MAX_TIME)
+    elapsed = time.perf_counter() - start
+    print('frame(): %.2f s, %.1f MB/s, %d records, %d corrupt ranges'
+          % (elapsed, len(data) / 2 ** 20 / elapsed, len(types), len(ranges)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+# The modules are flat files at the top of the repository #
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def parser_script():
+    # Parse_Device_Log-GUI-CPIW.py as a module, when its GUI and plotting
+    # dependencies are installed
+    for module in ('PySimpleGUI', 'plotly', 'bitstring'):
+        pytest.importorskip(module)
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Parse_Device_Log-GUI-CPIW.py')
+    spec = importlib.util.spec_from_file_location('parse_device_log', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
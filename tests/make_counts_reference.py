@@ -0,0 +1,30 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from agcounts.extract import get_counts
+from activity_counts import COUNT_EPOCHS
+from test_activity_counts import RATES, REFERENCE, signal
+
+#####################################################################
+# Writes the reference counts of test_activity_counts.py, computed by
+# the agcounts package:
+#
+#     python tests/make_counts_reference.py
+#####################################################################
+
+
+def main():
+    os.makedirs(os.path.dirname(REFERENCE), exist_ok=True)
+    with open(REFERENCE, 'w') as fout:
+        fout.write('{\n' + ',\n'.join('"%d": %s' % (rate, json.dumps({str(epoch): get_counts(signal(rate), rate, epoch)
+                                                                      .tolist() for epoch in COUNT_EPOCHS},
+                                                                     separators=(',', ':')))
+                                      for rate in RATES) + '\n}\n')
+
+
+if __name__ == '__main__':
+    main()
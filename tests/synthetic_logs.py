@@ -0,0 +1,167 @@
+import json
+import struct
+import zipfile
+
+import numpy as np
+
+from logparser3_9 import SYNC, HEADER
+from record_decoders import CALIBRATION_ORDER
+
+#####################################################################
+# Synthetic Nebula logs for the tests: framed records as the devices
+# write them, built in memory.
+#####################################################################
+T0 = 1672531200          # 2023-01-01 00:00:00 UTC
+MIN_TIME = 1262304000    # parse() time range used by the tests
+MAX_TIME = 2000000000
+
+
+def record(record_type, timestamp, payload=b''):
+    # Framed bytes of one record: sync byte, header, payload and checksum #
+    buf = bytes((SYNC,)) + HEADER.pack(record_type, timestamp, len(payload)) + bytes(payload)
+    return buf + bytes((255 - int(np.bitwise_xor.reduce(np.frombuffer(buf, np.uint8))),))
+
+
+def pack12(values):
+    # Nebula (type 27) payload of signed 12 bit x/y/z samples #
+    v = (np.asarray(values, dtype=np.int64).ravel() & 0xFFF).reshape(-1, 2)
+    out = np.empty((len(v), 3), dtype=np.uint8)
+    out[:, 0] = v[:, 0] >> 4
+    out[:, 1] = ((v[:, 0] & 0xF) << 4) | (v[:, 1] >> 8)
+    out[:, 2] = v[:, 1] & 0xFF
+    return out.tobytes()
+
+
+def activity_records(seconds, fs=30, seed=0, t0=T0):
+    # (type, timestamp, payload) of a log: a reset event, one Nebula
+    # activity record per second, a battery record per minute and a
+    # temperature record every 4 s
+    rng = np.random.default_rng(seed)
+    records = [(3, t0, b'\x0d')]
+    for k in range(seconds):
+        xyz = rng.normal(0, 100, (fs, 3))
+        xyz[:, 2] += 250
+        records.append((27, t0 + k, pack12(np.clip(np.round(xyz), -2048, 2047))))
+        if k % 60 == 0:
+            records.append((2, t0 + k, struct.pack('<H', 3700 + k % 100)))
+        if k % 4 == 0:
+            records.append((30, t0 + k, struct.pack('<BHBh', 1, 1000 + k % 7, 2, k % 3)))
+    return records
+
+
+def activity_log(seconds, fs=30, seed=0, t0=T0):
+    return b''.join(record(*r) for r in activity_records(seconds, fs, seed, t0))
+
+
+def eventful_records(seconds=8000, fs=30, seed=0, t0=T0):
+    # (type, timestamp, payload) of a log with something for every
+    # summary column: expected and unexpected resets, USB dock records,
+    # pegs, flat regions, a clock going back and a repeated timestamp,
+    # and a still 93 minutes (non-wear) from 1000 s, plus battery and
+    # temperature records
+    rng = np.random.default_rng(seed)
+    records = [(3, t0, b'\x0d')]
+    ts = t0
+    for k in range(seconds):
+        if k in (300, seconds - 1000):
+            ts += 5
+            records.append((3, ts, b'\x01'))
+            ts += 3
+        if k in (150, seconds - 700):
+            records.append((27, ts, b''))
+        if k == seconds - 500:
+            ts -= 10
+        if k == seconds - 300:
+            ts -= 1
+        if 1000 <= k < 6600:
+            xyz = rng.normal(0, 1, (fs, 3)) + [0, 0, 250]
+        else:
+            xyz = rng.normal(0, 100, (fs, 3)) + [0, 0, 250]
+            if k % 97 < 8:
+                xyz[:] = 300
+            if k % 131 == 5:
+                xyz[:, 0] = 2047
+        records.append((27, ts, pack12(np.clip(np.round(xyz), -2048, 2047))))
+        if k % 60 == 0:
+            records.append((2, ts, struct.pack('<H', 3700 + k % 100)))
+        if k % 4 == 0:
+            records.append((30, ts, struct.pack('<BHBh', 1, 1000 + k % 7, 2, k % 3)))
+        ts += 1
+    return records
+
+
+def write_container(path, data, members=None, last_sample=None):
+    # .agdc holding data as log.bin, an info.json, a calibration.json and
+    # the other members ({name: JSON-able dict}). The last sample time
+    # defaults to one after every record of the tests.
+    info = {'firmware': '1.7.2', 'serialNumber': 'MOS2C12345678',
+            'lastSampleTime': last_sample or MAX_TIME - 86400 * 2}
+    with zipfile.ZipFile(str(path), 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('log.bin', data)
+        zf.writestr('info.json', json.dumps(info))
+        zf.writestr('calibration.json', json.dumps(dict.fromkeys(CALIBRATION_ORDER, 0)))
+        for name, member in (members or {}).items():
+            zf.writestr(name, json.dumps(member))
+    return str(path)
+
+
+def inject_corruption(records, seed=0, every=20):
+    # Log of the records with about one in every records corrupted:
+    # random garbage inserted before it, one of its bytes flipped or its
+    # head cut off. The size field is never touched, a record spanning
+    # different bytes would pass its 8 bit checksum one time in 256.
+    # Returns (data, corrupt (start, end) ranges, intact
+    # records). Runs of corrupt bytes are one range. The first and last
+    # records are kept intact and the garbage holds no sync byte, so it
+    # cannot hold a record.
+    rng = np.random.default_rng(seed)
+    out = bytearray()
+    intact, ranges = [], []
+
+    def corrupt(data):
+        start = len(out)
+        if ranges and ranges[-1][1] == start:
+            start = ranges.pop()[0]
+        out.extend(data)
+        ranges.append((start, len(out)))
+
+    for k, r in enumerate(records):
+        framed = record(*r)
+        kind = rng.integers(every) if 0 < k < len(records) - 1 else every
+        if kind == 0:
+            garbage = rng.integers(0, 256, int(rng.integers(1, 200)), dtype=np.uint8)
+            corrupt(garbage[garbage != SYNC].tobytes())
+        elif kind == 1:
+            damaged = bytearray(framed)
+            flip = int(rng.integers(len(damaged) - 2))
+            damaged[flip + 2 * (flip >= 6)] ^= 0x55
+            corrupt(damaged)
+            continue
+        elif kind == 2:
+            corrupt(framed[int(rng.integers(1, len(framed))):])
+            continue
+        out.extend(framed)
+        intact.append(r)
+    return bytes(out), ranges, intact
+
+
+def write_long_log(path, seconds, fs=256, seed=0, t0=T0, block=4096):
+    # Writes a log of one Nebula record per second to path, built a block
+    # of records at a time with numpy so multi-GB logs take seconds. The
+    # payloads cycle through 64 random ones. Returns the size in bytes.
+    rng = np.random.default_rng(seed)
+    xyz = np.clip(np.round(rng.normal(0, 100, (64, fs, 3)) + [0, 0, 250]), -2048, 2047)
+    payloads = np.frombuffer(b''.join(pack12(x) for x in xyz), np.uint8).reshape(64, -1)
+    size = payloads.shape[1]
+    with open(path, 'wb') as fout:
+        for start in range(0, seconds, block):
+            k = np.arange(start, min(start + block, seconds))
+            rows = np.empty((len(k), 1 + HEADER.size + size + 1), np.uint8)
+            rows[:, 0] = SYNC
+            rows[:, 1] = 27
+            rows[:, 2:6] = (t0 + k).astype('<u4').view(np.uint8).reshape(-1, 4)
+            rows[:, 6:8] = np.frombuffer(struct.pack('<H', size), np.uint8)
+            rows[:, 8:-1] = payloads[k % 64]
+            rows[:, -1] = 255 - np.bitwise_xor.reduce(rows[:, :-1], axis=1)
+            fout.write(rows.tobytes())
+        return fout.tell()
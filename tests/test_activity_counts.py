@@ -0,0 +1,100 @@
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+
+from streaming import ActivityChunk, NS
+from record_decoders import NEBULA
+from synthetic_logs import T0
+
+pytest.importorskip('scipy')
+from activity_counts import ActivityCounts, COUNT_EPOCHS   # noqa: E402
+
+#####################################################################
+# Activity counts against reference counts of the agcounts package,
+# stored in data/activity_counts_reference.json for every supported rate
+# (regenerated by make_counts_reference.py).
+#####################################################################
+RATES = (30, 40, 50, 60, 70, 80, 90, 100, 32, 64, 128, 256)
+SECONDS = 125
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'activity_counts_reference.json')
+
+
+def signal(rate, seconds=SECONDS, seed=0):
+    # x/y/z in g: triangle waves of 0.5, 0.38 and 0.25 Hz plus noise, built
+    # from integers (mg) so every platform gets the same samples
+    k = np.arange(seconds * rate, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    mg = np.empty((len(k), 3), np.int64)
+    for axis, (period, amplitude) in enumerate(((10, 500), (13, 300), (20, 200))):
+        phase = k * 10 * 1000 // (period * rate) % 2000
+        mg[:, axis] = amplitude * (np.abs(phase - 1000) - 500) // 500
+    mg[:, 2] += 1000
+    mg += rng.integers(-60, 61, mg.shape)
+    return mg / 1000.0
+
+
+class _Writer:
+    # BackgroundWriter stand-in keeping the outputs in memory #
+
+    def __init__(self):
+        self.files = {}
+
+    def open(self, path, mode='w'):
+        fout = self.files[path] = io.StringIO()
+        fout.close = lambda: None
+        return fout
+
+
+def counts(xyz, rate, chunk_records=None):
+    # {epoch: (epochs, 3) X/Y/Z counts} of xyz fed as one record per second #
+    writer = _Writer()
+    sink = ActivityCounts(writer, 'log')
+    records = len(xyz) // rate
+    chunk_records = chunk_records or records
+    for a in range(0, records, chunk_records):
+        b = min(records, a + chunk_records)
+        time_ns = T0 * NS + np.arange(a * rate, b * rate, dtype=np.int64) * NS // rate
+        sink.write_chunk(ActivityChunk(NEBULA, None, None, np.full(b - a, rate), np.full(b - a, float(rate)),
+                                       time_ns, None, xyz[a * rate:b * rate], None, None, None, True))
+    sink.close()
+    result = {}
+    for epoch in COUNT_EPOCHS:
+        rows = writer.files['log_counts_%ds.csv' % epoch].getvalue().splitlines()[1:]
+        result[epoch] = np.array([[int(v) for v in row.split(',')[2:5]] for row in rows]).reshape(-1, 3)
+    return result
+
+
+@pytest.fixture(scope='module')
+def reference():
+    with open(REFERENCE, 'r') as fin:
+        return json.load(fin)
+
+
+@pytest.mark.parametrize('rate', RATES)
+def test_counts_match_reference(rate, reference):
+    result = counts(signal(rate), rate)
+    for epoch in COUNT_EPOCHS:
+        assert result[epoch].tolist() == reference[str(rate)][str(epoch)], epoch
+
+
+@pytest.mark.parametrize('rate', RATES)
+def test_counts_do_not_depend_on_chunking(rate):
+    xyz = signal(rate, seed=1)
+    whole = counts(xyz, rate)
+    for chunk_records in (1, 7, 113):
+        chunked = counts(xyz, rate, chunk_records)
+        for epoch in COUNT_EPOCHS:
+            assert np.array_equal(chunked[epoch], whole[epoch]), (chunk_records, epoch)
+
+
+@pytest.mark.parametrize('rate', RATES)
+def test_counts_match_agcounts(rate):
+    extract = pytest.importorskip('agcounts.extract')
+    xyz = signal(rate, 600, seed=2)
+    result = counts(xyz, rate, 97)
+    for epoch in COUNT_EPOCHS:
+        assert np.array_equal(result[epoch], extract.get_counts(xyz, rate, epoch)), epoch
+
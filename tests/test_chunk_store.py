@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from synthetic_logs import T0
+
+pytest.importorskip('h5py')
+from chunk_store import ChunkStore, read_window, ACTIVITY, BATTERY   # noqa: E402
+
+CHUNK_ROWS = 100
+
+
+def write_store(path, times, appends=7):
+    # times written as activity rows (x = row number) in uneven appends #
+    values = np.column_stack((np.arange(len(times)), np.zeros(len(times)), np.ones(len(times)), np.ones(len(times))))
+    with ChunkStore(str(path), CHUNK_ROWS) as store:
+        for a, b in zip([0] + list(range(13, len(times), len(times) // appends)),
+                        list(range(13, len(times), len(times) // appends)) + [len(times)]):
+            store.append(ACTIVITY, times[a:b], values[a:b])
+    return values
+
+
+def check_window(path, times, values, start, end):
+    window = read_window(str(path), ACTIVITY, start, end)
+    keep = (times >= start) & (times < end)
+    assert window['x'].tolist() == values[keep, 0].tolist(), (start, end)
+    assert window['time'].tolist() == pd.to_datetime(times[keep], unit='s', utc=True).tolist()
+
+
+def test_windows_across_chunk_boundaries(tmp_path):
+    times = T0 + np.arange(1050) / 4
+    values = write_store(tmp_path / 'log.h5', times)
+    for start, end in ((T0, T0 + 1), (T0 + 24.75, T0 + 25.25), (T0 + 20, T0 + 150),
+                       (T0 + 24.9, T0 + 25), (T0 + 262, T0 + 300), (T0 - 10, T0 + 1000)):
+        check_window(tmp_path / 'log.h5', times, values, start, end)
+    assert len(read_window(str(tmp_path / 'log.h5'), ACTIVITY)) == len(times)
+    assert len(read_window(str(tmp_path / 'log.h5'), ACTIVITY, T0 + 300, T0 + 400)) == 0
+
+
+def test_windows_when_the_clock_goes_back(tmp_path):
+    # 600 rows, then the clock goes back 100 s for 450 rows mid-chunk #
+    times = T0 + np.concatenate((np.arange(630), np.arange(420) + 530))
+    values = write_store(tmp_path / 'log.h5', times)
+    for start, end in ((T0 + 540, T0 + 560), (T0 + 600, T0 + 700), (T0 + 520, T0 + 535),
+                       (T0 + 629, T0 + 631), (T0, T0 + 2000)):
+        check_window(tmp_path / 'log.h5', times, values, start, end)
+    # Both runs of the repeated seconds are returned, in row order #
+    assert read_window(str(tmp_path / 'log.h5'), ACTIVITY, T0 + 600, T0 + 601)['x'].tolist() == [600, 700]
+
+
+def test_window_bounds_accept_datetimes(tmp_path):
+    times = T0 + np.arange(300, dtype=np.float64)
+    values = write_store(tmp_path / 'log.h5', times)
+    start = str(np.datetime64(T0 + 100, 's'))
+    window = read_window(str(tmp_path / 'log.h5'), ACTIVITY, start, T0 + 200)
+    assert window['x'].tolist() == values[100:200, 0].tolist()
+    assert len(read_window(str(tmp_path / 'log.h5'), BATTERY)) == 0
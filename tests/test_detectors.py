@@ -0,0 +1,105 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from detectors import NonWearDetector, TimestampGapDetector, RAW_VM_SCALE, GAP, BACKWARDS, DUPLICATE
+from streaming import NS
+from synthetic_logs import T0, pack12, record
+
+FS = 10
+
+
+def wear_signal(seconds, still, gaps=(), seed=0):
+    # time_ns and x/y/z (g) at FS Hz: moving, except for the still
+    # (start, end) periods, with no samples in the gaps (start, end)
+    rng = np.random.default_rng(seed)
+    k = np.arange(seconds * FS, dtype=np.int64)
+    s = k / FS
+    keep = np.ones(len(k), dtype=bool)
+    for a, b in gaps:
+        keep &= (s < a) | (s >= b)
+    xyz = rng.normal(0, 0.1, (len(k), 3))
+    for a, b in still:
+        quiet = (s >= a) & (s < b)
+        xyz[quiet] = rng.normal(0, 0.002, (quiet.sum(), 3))
+    xyz[:, 2] += 1.0
+    return T0 * NS + k[keep] * NS // FS, xyz[keep]
+
+
+def nonwear(time_ns, xyz, size, in_g=True):
+    detector = NonWearDetector()
+    values = xyz if in_g else np.round(xyz * RAW_VM_SCALE)
+    for a in range(0, len(time_ns), size):
+        detector.update(time_ns[a:a + size], values[a:a + size], in_g)
+    start, end = detector.intervals()
+    return list(zip(((start - T0 * NS) / NS).tolist(), ((end - T0 * NS) / NS).tolist()))
+
+
+# Still 1 h to 3.5 h, and 4.5 h to 6.4 h around a 40 minute gap #
+STILL = ((3600, 12600), (16000, 23000))
+GAPS = ((18000, 20400),)
+
+
+def test_nonwear_periods():
+    time_ns, xyz = wear_signal(24000, STILL, GAPS)
+    # Only the first still period fills whole windows, the gap splits the second #
+    assert nonwear(time_ns, xyz, len(time_ns)) == [(3600, 12600 - 1 / FS)]
+    time_ns, xyz = wear_signal(24000, STILL)
+    assert nonwear(time_ns, xyz, len(time_ns)) == [(3600, 12600 - 1 / FS), (16200, 22500 - 1 / FS)]
+
+
+@pytest.mark.parametrize('in_g', (True, False))
+def test_nonwear_does_not_depend_on_chunk_size(in_g):
+    time_ns, xyz = wear_signal(24000, STILL, GAPS, seed=1)
+    whole = nonwear(time_ns, xyz, len(time_ns), in_g)
+    assert whole == [(3600, 12600 - 1 / FS)]
+    for size in (1000, 9000, 9001, 16384 + 7, 50000):
+        assert nonwear(time_ns, xyz, size, in_g) == whole, size
+
+
+# Activity record timestamps (s from T0): a repeated second, the clock
+# going back, a gap around an unexpected reset and a gap with no event
+GAP_TIMES = list(range(10)) + [9, 5, 6] + list(range(300, 305)) + [1000]
+RESET_TIME = 200
+
+
+def test_timestamp_gaps_do_not_depend_on_chunking():
+    expected = [(10, 9, 9, 0, DUPLICATE, ''), (11, 5, 9, -4, BACKWARDS, ''),
+                (13, 300, 6, 294, GAP, 'Unexpected Reset'), (18, 1000, 304, 696, GAP, '')]
+    for split in range(1, len(GAP_TIMES)):
+        detector = TimestampGapDetector()
+        found = []
+        for a, b in ((0, split), (split, len(GAP_TIMES))):
+            for t in GAP_TIMES[a:b]:
+                if t == 300:
+                    detector.add_event(T0 + RESET_TIME, 'Unexpected Reset')
+                detector.add(T0 + t)
+            gaps = detector.update()
+            found += list(zip((gaps.index + a).tolist(), (gaps.current - T0).tolist(), (gaps.previous - T0).tolist(),
+                              gaps.delta.tolist(), gaps.kind.tolist(), gaps.event.tolist()))
+        assert found == expected, split
+        assert detector.count == 3
+
+
+def test_gap_csv_rows_and_summary_counts(tmp_path, parser_script):
+    records = [(27, T0 + t, pack12(np.zeros((30, 3)))) for t in GAP_TIMES]
+    records.insert(GAP_TIMES.index(300), (3, T0 + RESET_TIME, b'\x01'))
+    (tmp_path / 'MOS2C12345678.bin').write_bytes(b''.join(record(*r) for r in records))
+    parser_script.main_process(True, 1, False, False, str(tmp_path), '', '')
+
+    def when(t):
+        return str(datetime.fromtimestamp(T0 + t, tz=timezone.utc))
+    out = tmp_path / 'output_files'
+    rows = (out / 'Time Gap Files' / 'MOS2C12345678_datetime_Gap.csv').read_text().splitlines()
+    assert rows == ['Current Time Stamp,Previous Time Stamp, Delta,Type,Nearest Event,Event Time Stamp',
+                    '%s,%s,0.0,Duplicate,,' % (when(9), when(9)),
+                    '%s,%s,-4.0,Backwards,,' % (when(5), when(9)),
+                    '%s,%s,294.0,Gap,Unexpected Reset,%s' % (when(300), when(6), when(RESET_TIME)),
+                    '%s,%s,696.0,Gap,,' % (when(1000), when(304))]
+
+    summary = pd.read_csv(str(out / 'summary_file.csv'))
+    assert summary['Timestamp Gaps'].tolist() == [3]
+    assert summary['Unexpected Resets'].tolist() == [1]
+    assert summary['Activity records'].tolist() == [len(GAP_TIMES)]
@@ -0,0 +1,94 @@
+import sqlite3
+
+import pandas as pd
+
+import event_store
+from event_store import EventStore, merge_event_databases, query_events, CORRUPT_BYTES, INVALID_RECORD, PEG, \
+    TIMESTAMP_GAP
+from synthetic_logs import activity_records, record, T0
+
+
+def store(db, path, events, complete=True, device='MOS2C12345678', firmware='1.7.2'):
+    events_store = EventStore(str(db), path, device, firmware)
+    for event, unix_time in events:
+        events_store.add(event, unix_time)
+    events_store.close(complete)
+
+
+def files(db):
+    with sqlite3.connect(str(db)) as connection:
+        return connection.execute('SELECT path, complete FROM files ORDER BY path').fetchall()
+
+
+def test_parsing_a_log_again_replaces_its_events(tmp_path):
+    db = tmp_path / 'events.sqlite'
+    store(db, tmp_path / 'a.agdc', [(PEG, T0), (PEG, T0 + 1)])
+    store(db, tmp_path / 'b.agdc', [(PEG, T0 + 2)])
+    store(db, tmp_path / 'a.agdc', [(TIMESTAMP_GAP, T0 + 3)])
+    events = query_events(str(db))
+    assert events['event'].tolist() == [PEG, TIMESTAMP_GAP]
+    assert [p.endswith(n) for p, n in zip(events['path'], ('b.agdc', 'a.agdc'))] == [True, True]
+    assert len(files(db)) == 2
+
+
+def test_incomplete_parse_is_not_merged(tmp_path):
+    first, second = tmp_path / 'w1.sqlite', tmp_path / 'w2.sqlite'
+    store(first, tmp_path / 'a.agdc', [(PEG, T0)])
+    store(second, tmp_path / 'b.agdc', [(PEG, T0 + 1)], complete=False)
+    assert [complete for _, complete in files(second)] == [0]
+    # Its events are kept in its own database, the merge skips the file #
+    assert len(query_events(str(second))) == 1
+    merged = tmp_path / 'merged.sqlite'
+    assert merge_event_databases(str(merged), [str(first), str(second)]) == 1
+    assert query_events(str(merged))['time'].tolist() == [pd.Timestamp(T0, unit='s', tz='UTC')]
+
+
+def test_merge_keeps_the_latest_parse(tmp_path, monkeypatch):
+    # The same log (by file name) parsed by two workers at different times #
+    sources = [tmp_path / 'w1.sqlite', tmp_path / 'w2.sqlite', tmp_path / 'w3.sqlite']
+    for k, (source, parsed) in enumerate(zip(sources, (200.0, 300.0, 100.0))):
+        monkeypatch.setattr(event_store.time, 'time', lambda parsed=parsed: parsed)
+        (tmp_path / str(k)).mkdir()
+        store(source, tmp_path / str(k) / 'a.agdc', [(PEG, T0 + k)] * (k + 1))
+    merged = tmp_path / 'merged.sqlite'
+    assert merge_event_databases(str(merged), [str(s) for s in sources]) == 1
+    events = query_events(str(merged))
+    assert events['time'].tolist() == [pd.Timestamp(T0 + 1, unit='s', tz='UTC')] * 2
+    # Merging again replaces the merged database #
+    assert merge_event_databases(str(merged), [str(sources[0])]) == 1
+    assert len(query_events(str(merged))) == 1
+
+
+def test_query_filters_and_time_bounds(tmp_path):
+    db = tmp_path / 'events.sqlite'
+    store(db, tmp_path / 'a.agdc', [(PEG, T0), (PEG, T0 + 10), (TIMESTAMP_GAP, T0 + 20)])
+    store(db, tmp_path / 'b.agdc', [(PEG, T0 + 5)], device='MOS2C00000002', firmware='1.8.0')
+
+    def times(**filters):
+        return [int(t.timestamp()) - T0 for t in query_events(str(db), **filters)['time']]
+
+    assert times() == [0, 5, 10, 20]
+    assert times(event=PEG) == [0, 5, 10]
+    assert times(device='MOS2C00000002') == [5]
+    assert times(firmware='1.7.2', event=PEG) == [0, 10]
+    # start is inclusive, end exclusive, as unix seconds or date strings #
+    assert times(start=T0 + 5, end=T0 + 20) == [5, 10]
+    assert times(start='2023-01-01 00:00:10', end=pd.Timestamp(T0 + 21, unit='s', tz='UTC')) == [10, 20]
+    assert times(event='Unexpected Reset') == []
+
+
+def test_corrupt_bytes_after_an_invalid_record_are_stored(parser_script, tmp_path):
+    # A record with a flipped payload byte: an invalid record, then the
+    # bytes skipped to the next one
+    records = activity_records(60)
+    damaged = bytearray(record(*records[30]))
+    damaged[12] ^= 0x55
+    data = b''.join(record(*r) for r in records[:30]) + bytes(damaged) + b''.join(record(*r) for r in records[31:])
+    (tmp_path / 'MOS2C12345678.bin').write_bytes(data)
+    parser_script.main_process(True, 1, False, False, str(tmp_path), '', '')
+
+    events = query_events(str(tmp_path / 'output_files' / event_store.EVENT_DB_NAME))
+    assert events['event'].tolist().count(INVALID_RECORD) == 1
+    corrupt = events[events['event'] == CORRUPT_BYTES]
+    assert corrupt['value'].tolist() == [len(damaged)]
+    assert corrupt['detail'].tolist() == [hex(len(b''.join(record(*r) for r in records[:30])))]
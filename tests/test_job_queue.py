@@ -0,0 +1,101 @@
+import threading
+import time
+
+from job_queue import JobQueue, QUEUED, RUNNING, DONE, CANCELLED, FAILED
+
+TIMEOUT = 10
+
+
+def wait_for(condition):
+    deadline = time.time() + TIMEOUT
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.005)
+
+
+def test_jobs_on_the_same_folder_run_one_at_a_time():
+    queue = JobQueue(workers=3)
+    lock = threading.Lock()
+    running = {}
+    overlaps = []
+
+    def parse(name, key, job):
+        with lock:
+            if running.get(key):
+                overlaps.append(name)
+            running[key] = running.get(key, 0) + 1
+        time.sleep(0.02)
+        with lock:
+            running[key] -= 1
+        return name
+
+    jobs = [queue.submit('job %d' % k, parse, k, 'a' if k % 3 else 'b', key='a' if k % 3 else 'b')
+            for k in range(9)]
+    wait_for(lambda: all(job.status == DONE for job in jobs))
+    queue.close()
+    assert overlaps == []
+    assert [job.result for job in jobs] == list(range(9))
+    # The folders themselves are parsed side by side #
+    a = [job for job in jobs if job.key == 'a']
+    b = [job for job in jobs if job.key == 'b']
+    assert min(job.started for job in b) < max(job.finished for job in a)
+
+
+def test_queued_jobs_start_by_priority_then_submission():
+    queue = JobQueue(workers=1)
+    release = threading.Event()
+    order = []
+    blocker = queue.submit('blocker', lambda job: release.wait(TIMEOUT))
+    wait_for(lambda: blocker.status == RUNNING)
+    jobs = [queue.submit(name, lambda name, job: order.append(name), name, priority=priority)
+            for name, priority in (('late', 5), ('first', 0), ('second', 0), ('urgent', -1))]
+    queue.set_priority(jobs[0], -2)
+    release.set()
+    wait_for(lambda: all(job.status == DONE for job in jobs))
+    queue.close()
+    assert order == ['late', 'urgent', 'first', 'second']
+
+
+def test_cancelling_queued_and_running_jobs():
+    queue = JobQueue(workers=1)
+    started = threading.Event()
+    batches = []
+
+    def parse(job):
+        started.set()
+        while not job.cancelled:
+            batches.append(len(batches))
+            job.set_part_progress(0.5)
+            time.sleep(0.001)
+        return 'stopped'
+
+    running = queue.submit('running', parse, key='a')
+    queued = queue.submit('queued', parse, key='a')
+    started.wait(TIMEOUT)
+    queue.cancel(queued)
+    assert queued.status == CANCELLED and queued.finished is not None
+    queue.cancel(running)
+    wait_for(lambda: running.status == CANCELLED)
+    assert running.result == 'stopped' and running.progress == 0.5
+    queue.close()
+    assert queued.started is None
+
+
+def test_failed_job_does_not_stop_its_worker():
+    queue = JobQueue(workers=1)
+    failed = queue.submit('failed', lambda job: 1 / 0, key='a')
+    after = queue.submit('after', lambda job: 'ok', key='a')
+    wait_for(lambda: after.status == DONE)
+    queue.close()
+    assert failed.status == FAILED and 'ZeroDivisionError' in failed.error
+    assert after.result == 'ok'
+
+
+def test_close_cancels_queued_jobs():
+    queue = JobQueue(workers=1)
+    running = queue.submit('running', lambda job: job._cancel.wait(TIMEOUT))
+    wait_for(lambda: running.status == RUNNING)
+    queued = queue.submit('queued', lambda job: 'ran')
+    queue.close()
+    assert running.status == CANCELLED and running.result is True
+    assert queued.status == QUEUED and queued.cancelled and queued.result is None
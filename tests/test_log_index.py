@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+import nebula_log
+from log_index import index_path
+from nebula_log import NebulaLog
+from synthetic_logs import activity_log, activity_records, inject_corruption, write_container
+
+
+@pytest.fixture
+def frames(monkeypatch):
+    # Counts the times NebulaLog frames a log instead of reading its index #
+    calls = []
+    frame = nebula_log.frame
+
+    def counted(*args, **kwargs):
+        calls.append(1)
+        return frame(*args, **kwargs)
+    monkeypatch.setattr(nebula_log, 'frame', counted)
+    return calls
+
+
+def persisted_index(path, **kwargs):
+    with NebulaLog.open(path, persist_index=True, **kwargs) as log:
+        return list(log.index) + [log.minutes]
+
+
+def fresh_index(path):
+    with NebulaLog.open(path) as log:
+        return list(log.index) + [log.minutes]
+
+
+def assert_same(a, b):
+    assert len(a) == len(b) and all(np.array_equal(x, y) for x, y in zip(a, b))
+
+
+@pytest.mark.parametrize('kind', ['bin', 'agdc', 'agdc in cache'])
+def test_reused_index_equals_a_fresh_one(tmp_path, frames, kind):
+    # A .bin is framed up to the current time, so its index is only reused
+    # without corrupt bytes (see log_index._settled)
+    if kind == 'bin':
+        path = str(tmp_path / 'MOS2C12345678.bin')
+        with open(path, 'wb') as fout:
+            fout.write(activity_log(900))
+    else:
+        path = write_container(tmp_path / 'MOS2C12345678.agdc', inject_corruption(activity_records(900), 1)[0])
+    index_dir = str(tmp_path / 'cache') if kind == 'agdc in cache' else None
+
+    built = persisted_index(path, index_dir=index_dir)
+    assert os.path.isfile(index_path(path, index_dir))
+    reused = persisted_index(path, index_dir=index_dir)
+    assert len(frames) == 1
+    fresh = fresh_index(path)
+    assert_same(built, reused)
+    assert_same(reused, fresh)
+    assert len(fresh[0]) > 900 and (kind == 'bin') == (len(fresh[4]) == 0)
+
+
+def test_changed_source_rebuilds_the_index(tmp_path, frames):
+    path = tmp_path / 'MOS2C12345678.bin'
+    path.write_bytes(activity_log(300))
+    persisted_index(path)
+    assert len(frames) == 1
+
+    # Same size and mtime, different samples: only the hash changes #
+    stat = os.stat(str(path))
+    path.write_bytes(activity_log(300, seed=1))
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(str(path)).st_size == stat.st_size
+    changed = persisted_index(path)
+    assert len(frames) == 2
+    assert_same(changed, fresh_index(path))
+
+    # Records appended: the size and mtime change #
+    with open(str(path), 'ab') as fout:
+        fout.write(activity_log(60, t0=int(changed[1][-1]) + 1))
+    appended = persisted_index(path)
+    assert len(frames) == 4
+    assert len(appended[0]) > len(changed[0])
+    assert_same(appended, fresh_index(path))
+
+    persisted_index(path)
+    assert len(frames) == 5   # Unchanged since: reused
@@ -0,0 +1,66 @@
+import io
+
+import numpy as np
+
+from logparser3_9 import parse
+from log_merge import merge_logs
+from synthetic_logs import activity_records, record, T0, MIN_TIME, MAX_TIME
+
+
+def write_log(path, records):
+    path.write_bytes(b''.join(record(*r) for r in records))
+    return str(path)
+
+
+def merged(path):
+    return [(r.type, int(r.timestamp.timestamp()), bytes.fromhex(r.payload))
+            for r in parse(io.BytesIO(path.read_bytes()), MIN_TIME, MAX_TIME)]
+
+
+def reset_flash(seed=0):
+    # 20 records, a reset and 5 records whose clock went back 15 s #
+    rng = np.random.default_rng(seed)
+    flash = [(27, T0 + k, rng.integers(0, 256, 45, dtype=np.uint8).tobytes()) for k in range(20)]
+    flash.append((3, T0 + 5, b'\x01'))
+    flash += [(27, T0 + k, rng.integers(0, 256, 45, dtype=np.uint8).tobytes()) for k in range(5, 10)]
+    return flash
+
+
+def test_merge_across_clock_reset(tmp_path):
+    flash = reset_flash()
+    first = write_log(tmp_path / 'first.bin', flash[:23])
+    second = write_log(tmp_path / 'second.bin', flash[18:])
+    report = merge_logs([first, second], str(tmp_path / 'merged.bin'))
+    assert merged(tmp_path / 'merged.bin') == flash
+    assert (report.records, report.duplicates, report.conflicts) == (26, 5, [])
+
+
+def test_merge_later_download_after_reset(tmp_path):
+    # The later download starts after the reset, within the timestamps
+    # the first one holds from before it
+    flash = reset_flash()
+    first = write_log(tmp_path / 'first.bin', flash[:24])
+    second = write_log(tmp_path / 'second.bin', flash[22:])
+    report = merge_logs([second, first], str(tmp_path / 'merged.bin'))
+    assert merged(tmp_path / 'merged.bin') == flash
+    assert report.conflicts == []
+
+
+def test_merge_overlap_and_conflict(tmp_path):
+    flash = activity_records(300)
+    changed = list(flash[150:])
+    changed[10] = changed[10][:2] + (bytes(len(changed[10][2])),)
+    first = write_log(tmp_path / 'first.bin', flash[:200])
+    second = write_log(tmp_path / 'second.bin', changed)
+    report = merge_logs([first, second], str(tmp_path / 'merged.bin'))
+    assert merged(tmp_path / 'merged.bin') == flash
+    assert report.duplicates == 49
+    assert [(c.timestamp.timestamp(), c.record_type) for c in report.conflicts] == [(flash[160][1], flash[160][0])]
+
+
+def test_merge_logs_without_overlap(tmp_path):
+    flash = activity_records(100)
+    later = write_log(tmp_path / 'later.bin', flash[60:])
+    earlier = write_log(tmp_path / 'earlier.bin', flash[:60])
+    merge_logs([later, earlier], str(tmp_path / 'merged.bin'))
+    assert merged(tmp_path / 'merged.bin') == flash
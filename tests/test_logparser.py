@@ -0,0 +1,76 @@
+import io
+
+import pytest
+
+from logparser3_9 import parse, frame, CORRUPT_BYTES, INVALID_RECORD
+from synthetic_logs import activity_log, activity_records, inject_corruption, record, \
+    MIN_TIME, MAX_TIME, T0
+
+
+def corrupt_ranges(data):
+    return [(r.payload, r.payload + r.size) for r in parse(io.BytesIO(data), MIN_TIME, MAX_TIME)
+            if r.type == CORRUPT_BYTES]
+
+
+def test_frame_reports_trailing_garbage():
+    log = activity_log(10)
+    data = log + bytes(50)
+    assert corrupt_ranges(data) == [(len(log), len(data))]
+    assert frame(data, MIN_TIME, MAX_TIME)[4].tolist() == [[len(log), len(data)]]
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_corrupt_ranges_match_injected(seed):
+    data, injected, _ = inject_corruption(activity_records(600, seed=seed), seed)
+    assert len(injected) > 50
+    assert corrupt_ranges(data) == injected
+    assert [tuple(r) for r in frame(data, MIN_TIME, MAX_TIME)[4].tolist()] == injected
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_intact_records_recovered(seed):
+    data, _, intact = inject_corruption(activity_records(600, seed=seed), seed)
+    expected = [(t, ts, bytes(p).hex()) for t, ts, p in intact]
+    assert [(r.type, int(r.timestamp.timestamp()), r.payload)
+            for r in parse(io.BytesIO(data), MIN_TIME, MAX_TIME) if r.type < CORRUPT_BYTES] == expected
+
+    types, times, offsets, sizes, _ = frame(data, MIN_TIME, MAX_TIME)
+    assert [(t, ts, data[o:o + s].hex()) for t, ts, o, s in zip(types.tolist(), times.tolist(),
+                                                                offsets.tolist(), sizes.tolist())] == expected
+
+
+def test_truncated_last_record_is_not_corrupt():
+    log = activity_log(10)
+    data = log + record(27, T0 + 10, bytes(45))[:-20]
+    assert corrupt_ranges(data) == []
+    assert len(frame(data, MIN_TIME, MAX_TIME)[0]) == len(list(parse(io.BytesIO(log), MIN_TIME, MAX_TIME)))
+
+
+def spaced_records(count, step=10):
+    return [(27, T0 + step * k, bytes(range(k, k + 45))) for k in range(count)]
+
+
+def corrupt_times(data, **kwargs):
+    return [int(r.timestamp.timestamp()) for r in parse(io.BytesIO(data), MIN_TIME, MAX_TIME, **kwargs)
+            if r.type == CORRUPT_BYTES]
+
+
+def test_corrupt_bytes_keep_the_previous_timestamp():
+    records = [record(*r) for r in spaced_records(8)]
+    data = b''.join(records[:4]) + bytes(30) + b''.join(records[4:6]) + b'\x1e\x01' + b''.join(records[6:])
+    assert corrupt_times(data) == [T0 + 30, T0 + 50]
+
+    # The header of an invalid record is not a timestamp to keep #
+    damaged = bytearray(records[4])
+    damaged[12] ^= 0x55
+    data = b''.join(records[:4]) + bytes(damaged) + b''.join(records[5:])
+    assert [(r.type, int(r.timestamp.timestamp())) for r in parse(io.BytesIO(data), MIN_TIME, MAX_TIME)
+            if r.type >= CORRUPT_BYTES] == [(INVALID_RECORD, T0 + 40), (CORRUPT_BYTES, T0 + 30)]
+
+
+def test_corrupt_bytes_at_the_start_take_the_next_timestamp():
+    data = bytes(30) + b''.join(record(*r) for r in spaced_records(3))
+    assert corrupt_times(data) == [T0]
+    # Unless parsing resumes after a known record #
+    assert corrupt_times(data, last_timestamp=T0 - 5) == [T0 - 5]
+    assert corrupt_times(bytes(30)) == []
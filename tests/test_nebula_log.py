@@ -0,0 +1,78 @@
+import mmap
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nebula_log import NebulaLog
+from synthetic_logs import activity_log, activity_records, pack12, record, write_container, T0
+
+
+@pytest.fixture
+def logs(tmp_path):
+    # The same 10 minute log as a .bin and an .agdc #
+    data = activity_log(600)
+    raw = tmp_path / 'MOS2C12345678.bin'
+    raw.write_bytes(data)
+    return str(raw), write_container(tmp_path / 'MOS2C12345678.agdc', data)
+
+
+def ns(times):
+    return times.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+def frames_equal(a, b):
+    pd.testing.assert_frame_equal(a.reset_index(drop=True), b.reset_index(drop=True))
+
+
+def test_container_and_bin_give_the_same_data(logs):
+    with NebulaLog.open(logs[0]) as raw, NebulaLog.open(logs[1]) as agdc:
+        assert agdc.firmware_version == '1.7.2'
+        assert isinstance(agdc.data, mmap.mmap)   # log.bin is mapped, not read into memory
+        for name in ('activity', 'battery', 'temperature', 'events', 'imu'):
+            frames_equal(getattr(raw, name)(), getattr(agdc, name)())
+        day = '2023-01-01 00:02', '2023-01-01 00:05'
+        frames_equal(raw.between(*day).activity(), agdc.between(*day).activity())
+
+
+def test_activity_decodes_the_samples(tmp_path):
+    xyz = np.arange(90).reshape(30, 3) - 40
+    path = tmp_path / 'one.bin'
+    path.write_bytes(record(27, T0, pack12(xyz)))
+    with NebulaLog.open(path) as log:
+        df = log.activity()
+    assert df[['x', 'y', 'z']].to_numpy().tolist() == xyz.tolist()
+    assert ns(df['time']).tolist() == (T0 * 10 ** 9 + np.arange(30) * 10 ** 9 // 30).tolist()
+
+
+def test_between_selects_the_window(logs):
+    with NebulaLog.open(logs[1]) as log:
+        whole = log.activity()
+        view = log.between(T0 + 100, T0 + 160)
+        window = view.activity()
+        assert len(window) == 60 * 30
+        expected = whole[(whole['time'] >= pd.Timestamp(T0 + 100, unit='s', tz='UTC'))
+                         & (whole['time'] < pd.Timestamp(T0 + 160, unit='s', tz='UTC'))]
+        frames_equal(window, expected)
+        # Strings are UTC, views of views narrow the window further #
+        frames_equal(log.between('2023-01-01 00:01:40', '2023-01-01 00:02:40').activity(), window)
+        assert len(view.between(end=T0 + 130).activity()) == 30 * 30
+        assert log.between(T0 + 1000).activity().empty
+
+
+def test_accessors_only_hold_their_record_types(logs):
+    records = activity_records(600)
+    with NebulaLog.open(logs[1]) as log:
+        battery = log.battery()
+        assert ns(battery['time']).tolist() == [t * 10 ** 9 for k, t, _ in records if k == 2]
+        assert battery['voltage'].notna().all()
+        temperature = log.temperature()
+        assert (temperature['record_type'] == 30).all()
+        assert len(temperature) == sum(1 for k, _, _ in records if k == 30)
+        assert temperature['mcu'].tolist() == [1000 + k % 7 for k in range(0, 600, 4)]
+        assert temperature['adxl'].tolist() == [k % 3 for k in range(0, 600, 4)]
+        assert 'adxl_c' not in temperature    # No temperature calibration in the container
+        events = log.events()
+        assert events['event'].tolist() == ['Expected Reset']
+        assert log.between(T0 + 1).events().empty
+        assert len(log.index.types) == len(records)
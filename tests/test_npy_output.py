@@ -0,0 +1,40 @@
+import numpy as np
+
+from npy_output import NpyActivitySink, load_activity
+from record_decoders import MOSES, NEBULA
+from streaming import ActivityStream
+from synthetic_logs import pack12, T0
+
+
+def write_activity(directory, records):
+    sink = NpyActivitySink(str(directory), 'log')
+    stream = ActivityStream(sinks=[sink])
+    for k, (record_type, unix_time, payload) in enumerate(records):
+        if stream.needs_flush(record_type):
+            stream.flush()
+        stream.add(record_type, None, unix_time, payload, k == 0)
+    stream.flush()
+    sink.close(stream.calibration is not None)
+    return load_activity(str(directory), 'log', mmap_mode=None)
+
+
+def payload(fs, value):
+    return pack12(np.full((fs, 3), value))
+
+
+def test_units_of_moses_samples(tmp_path):
+    time, xyz, info = write_activity(tmp_path, [(MOSES, T0 + k, payload(30, 256)) for k in range(5)])
+    assert info['units'] == 'g' and not info['calibrated']
+    assert [r['units'] for r in info['sample_rates']] == ['g']
+    assert np.allclose(xyz, 1.0) and len(time) == 150
+
+
+def test_units_per_rate_segment(tmp_path):
+    records = [(MOSES, T0 + k, payload(30, 256)) for k in range(3)]
+    records += [(NEBULA, T0 + 3 + k, payload(30, 250)) for k in range(3)]
+    records += [(NEBULA, T0 + 6 + k, payload(60, 250)) for k in range(2)]
+    _, xyz, info = write_activity(tmp_path, records)
+    assert info['units'] == 'mixed'
+    assert [(r['first_record'], r['first_sample'], r['hz'], r['units']) for r in info['sample_rates']] == \
+        [(0, 0, 30.0, 'g'), (3, 90, 30.0, 'raw'), (6, 180, 60.0, 'raw')]
+    assert np.allclose(xyz[:90], 1.0) and np.allclose(xyz[90:], 250.0)
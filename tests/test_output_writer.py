@@ -0,0 +1,154 @@
+import concurrent.futures
+import gzip
+import io
+import os
+
+import numpy as np
+import pytest
+
+import output_writer
+from output_writer import BackgroundWriter, ActivityCsvSink, ACTIVITY_HEADER, COMPRESS_GZIP, COMPRESS_ZSTD
+from streaming import ActivityChunk, NS
+from synthetic_logs import T0
+
+FS = 2
+
+
+def chunks(unix_times, size):
+    # ActivityChunks of FS samples per record at unix_times, size records each #
+    unix_times = np.asarray(unix_times, dtype=np.int64)
+    for a in range(0, len(unix_times), size):
+        times = unix_times[a:a + size]
+        n = len(times) * FS
+        time_ns = np.repeat(times * NS, FS) + np.tile(np.arange(FS) * NS // FS, len(times))
+        xyz = np.column_stack((np.arange(a * FS, a * FS + n), np.zeros(n), np.ones(n))) / 1000
+        yield ActivityChunk(27, [str(t) for t in times.tolist()], times.astype(np.float64), np.full(len(times), FS),
+                            np.full(len(times), float(FS)), time_ns, (time_ns - T0 * NS) / NS, xyz,
+                            np.sqrt((xyz ** 2).sum(axis=1)), None, None, True)
+
+
+def write_csvs(directory, unix_times, size, split_seconds, compression=''):
+    writer = BackgroundWriter(compression=compression)
+    sink = ActivityCsvSink(writer, str(directory) + os.sep, 'log', split_seconds)
+    for chunk in chunks(unix_times, size):
+        sink.write_chunk(chunk)
+    sink.close()
+    writer.close()
+    return {name: (directory / name).read_bytes() if compression else (directory / name).read_text()
+            for name in sorted(os.listdir(str(directory)))}
+
+
+def record_times(text):
+    assert text.startswith(ACTIVITY_HEADER)
+    return [int(line.split(',')[0]) for line in text.splitlines()[1:]]
+
+
+def test_parts_start_on_split_boundaries(tmp_path):
+    # 25 minutes from 50 minutes past midnight, one chunk crossing 01:00 #
+    times = T0 + 3000 + np.arange(1500)
+    parts = write_csvs(tmp_path, times, 1000, 3600)
+    assert sorted(parts) == ['log-%d.csv' % T0, 'log-%d.csv' % (T0 + 3600)]
+    first, second = record_times(parts['log-%d.csv' % T0]), record_times(parts['log-%d.csv' % (T0 + 3600)])
+    assert first == np.repeat(times[times < T0 + 3600], FS).tolist()
+    assert second == np.repeat(times[times >= T0 + 3600], FS).tolist()
+
+
+@pytest.mark.parametrize('size', [1, 7, 600])
+def test_parts_do_not_depend_on_chunking(tmp_path, size):
+    times = T0 + 3000 + np.arange(1500)
+    (tmp_path / 'whole').mkdir()
+    (tmp_path / 'chunked').mkdir()
+    assert write_csvs(tmp_path / 'chunked', times, size, 3600) == write_csvs(tmp_path / 'whole', times, 1500, 3600)
+
+
+def test_short_log_is_named_by_its_part(tmp_path):
+    # A log shorter than the split still names its part by the boundary #
+    parts = write_csvs(tmp_path, T0 + 100000 + np.arange(600), 100, 172800)
+    assert list(parts) == ['log-%d.csv' % (T0 // 172800 * 172800)]
+
+
+def test_clock_going_back_appends_to_the_earlier_part(tmp_path):
+    times = np.concatenate((T0 + 3500 + np.arange(200), T0 + 3550 + np.arange(20)))
+    parts = write_csvs(tmp_path, times, 50, 3600)
+    first = record_times(parts['log-%d.csv' % T0])
+    assert parts['log-%d.csv' % T0].count(ACTIVITY_HEADER) == 1
+    assert first == np.repeat(np.concatenate((times[:100], times[200:])), FS).tolist()
+    assert record_times(parts['log-%d.csv' % (T0 + 3600)]) == np.repeat(times[100:200], FS).tolist()
+
+
+def test_no_split_writes_one_file(tmp_path):
+    times = T0 + 3000 + np.arange(1500)
+    parts = write_csvs(tmp_path, times, 400, 0)
+    assert list(parts) == ['log.csv']
+    assert record_times(parts['log.csv']) == np.repeat(times, FS).tolist()
+
+
+def test_each_open_part_has_its_own_writer(tmp_path):
+    writer = BackgroundWriter()
+    sink = ActivityCsvSink(writer, str(tmp_path) + os.sep, 'log', 60)
+    # Six one minute parts, then back into the first: at most four stay open #
+    for chunk in chunks(T0 + np.concatenate((np.arange(360), np.arange(30))), 45):
+        sink.write_chunk(chunk)
+    threads = [part_writer._thread for part_writer, _ in sink.parts.values()]
+    assert len(threads) == 4 and len(set(threads)) == 4 and writer._thread not in threads
+    sink.close()
+    writer.close()
+    assert not any(thread.is_alive() for thread in threads)
+    assert sorted(os.listdir(str(tmp_path))) == ['log-%d.csv' % (T0 + 60 * k) for k in range(6)]
+    assert len(record_times((tmp_path / ('log-%d.csv' % T0)).read_text())) == 90 * FS
+
+
+def decompress(data, compression):
+    # Every gzip member/zstd frame, read back as one stream #
+    if compression == COMPRESS_GZIP:
+        return gzip.decompress(data)
+    zstandard = pytest.importorskip('zstandard')
+    return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True).read()
+
+
+@pytest.mark.parametrize('compression', (COMPRESS_GZIP, COMPRESS_ZSTD))
+def test_compressed_parts_decompress_to_the_plain_parts(tmp_path, monkeypatch, compression):
+    if compression == COMPRESS_ZSTD:
+        pytest.importorskip('zstandard')
+    # Small blocks, so a part can be several gzip members/zstd frames #
+    monkeypatch.setattr(output_writer, 'COMPRESS_BLOCK_SIZE', 1000)
+    times = T0 + np.concatenate((np.arange(500), np.arange(100)))
+    (tmp_path / 'plain').mkdir()
+    (tmp_path / compression).mkdir()
+    plain = write_csvs(tmp_path / 'plain', times, 70, 240)
+    compressed = write_csvs(tmp_path / compression, times, 70, 240, compression)
+    assert list(compressed) == [name + '.' + compression for name in plain]
+    for name, text in plain.items():
+        data = compressed[name + '.' + compression]
+        assert len(data) < len(text)
+        assert decompress(data, compression) == text.encode('utf-8')
+
+
+@pytest.mark.parametrize('compression', (COMPRESS_GZIP, COMPRESS_ZSTD))
+def test_blocks_are_written_in_order(tmp_path, monkeypatch, compression):
+    if compression == COMPRESS_ZSTD:
+        pytest.importorskip('zstandard')
+    monkeypatch.setattr(output_writer, 'COMPRESS_BLOCK_SIZE', 1000)
+    compress = {COMPRESS_GZIP: output_writer._gzip_block, COMPRESS_ZSTD: output_writer._zstd_block}[compression]
+    path = str(tmp_path / ('rows.csv.' + compression))
+    lines = ['%d,%d\n' % (k, k * k) for k in range(20000)]
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        fout = output_writer._CompressedFile(path, 'w', compress, pool)
+        for a in range(0, len(lines), 37):
+            fout.write(''.join(lines[a:a + 37]))
+        fout.close()
+    data = (tmp_path / ('rows.csv.' + compression)).read_bytes()
+    if compression == COMPRESS_GZIP:
+        assert data.count(b'\x1f\x8b\x08\x00') > 100
+    assert decompress(data, compression) == ''.join(lines).encode('utf-8')
+
+
+def test_uncompressed_outputs_keep_their_name(tmp_path):
+    writer = BackgroundWriter(compression=COMPRESS_GZIP)
+    with writer.open(str(tmp_path / 'report.txt'), compress=False) as fout:
+        fout.write('report\n')
+    with writer.open(str(tmp_path / 'data.csv')) as fout:
+        fout.write('a,b\n')
+    writer.close()
+    assert (tmp_path / 'report.txt').read_text() == 'report\n'
+    assert gzip.decompress((tmp_path / 'data.csv.gz').read_bytes()) == b'a,b\n'
@@ -0,0 +1,53 @@
+import collections
+
+from pipeline import time_window, Checkpoints
+
+Record = collections.namedtuple('Record', 'type timestamp')
+
+
+def stream(timestamps, consumed):
+    for k, timestamp in enumerate(timestamps):
+        consumed.append(k)
+        yield Record(26, timestamp)
+
+
+def test_time_window_excludes_both_bounds():
+    consumed = []
+    records = time_window(stream([1, 2, 3, 4, 5, 5, 6, 7], consumed), 2, 6)
+    assert [r.timestamp for r in records] == [3, 4, 5, 5]
+
+
+def test_time_window_keeps_records_at_end_and_stops_after_it():
+    consumed = []
+    timestamps = [1, 5, 5, 4, 6, 9, 5, 3]
+    records = time_window(stream(timestamps, consumed), 2, 6)
+    # A record at end does not stop the stream, the first one after it does #
+    assert [r.timestamp for r in records] == [5, 5, 4]
+    assert consumed == [0, 1, 2, 3, 4, 5]
+
+
+def test_time_window_of_records_before_begin_is_empty():
+    consumed = []
+    assert list(time_window(stream([1, 1, 2], consumed), 2, 6)) == []
+    assert consumed == [0, 1, 2]
+
+
+def test_checkpoints_stop_the_stream_when_check_fails():
+    consumed = []
+    checked = []
+
+    def check(record):
+        checked.append(record.timestamp)
+        return len(checked) < 3
+
+    checkpoints = Checkpoints(4, check)
+    records = list(checkpoints(stream(range(100), consumed)))
+    assert checked == [3, 7, 11]
+    assert [r.timestamp for r in records] == list(range(11))
+    assert checkpoints.stopped and len(consumed) == 12
+
+
+def test_checkpoints_pass_every_record_through():
+    checkpoints = Checkpoints(4, lambda record: True)
+    assert [r.timestamp for r in checkpoints(stream(range(10), []))] == list(range(10))
+    assert not checkpoints.stopped
@@ -0,0 +1,99 @@
+import struct
+import types
+
+import numpy as np
+
+from output_writer import BackgroundWriter
+from record_decoders import imu_schema_from_payload, decode_imu_samples, IMU_TEMPERATURE_OFFSET
+from synthetic_logs import activity_records, record, T0
+
+# The layout of the STM32 IMU logs: accelerometer, temperature, gyro and
+# magnetometer words, then a sequence byte, 21 bytes per sample
+IMU_COLUMNS = (('ax', 16), ('ay', 16), ('az', 16), ('temp', 16), ('gx', 16), ('gy', 16), ('gz', 16),
+               ('mx', 16), ('my', 16), ('mz', 16), ('seq', 8))
+
+
+def schema_payload(columns=IMU_COLUMNS, offsets=True, scale=1000):
+    # Type 24 payload: reserved, column count, reserved, then per column
+    # flags, offset, size (bits), big-endian scale and a 16 byte name
+    payload = struct.pack('<HHH', 0, len(columns), 0)
+    offset = 0
+    for name, bits in columns:
+        payload += struct.pack('>BBBI16s', 1, offset if offsets else 0, bits, scale, name.encode())
+        offset += bits // 8
+    return payload
+
+
+def samples_payload(samples):
+    # Type 25 payload: a sequence word, then big-endian samples #
+    return struct.pack('>H', 7) + b''.join(struct.pack('>10hb', *sample) for sample in samples)
+
+
+SAMPLES = [(1000, -2000, 16384, -3, 120, -121, 32767, -32768, 5, -5, 1),
+           (-1, 0, 1, 14, 0, 0, 0, 300, 301, 302, -2)]
+
+
+def test_imu_schema_of_a_known_payload():
+    schema = imu_schema_from_payload(schema_payload())
+    assert schema.names == [name for name, _ in IMU_COLUMNS]
+    assert schema.dtype.itemsize == 21
+    assert [schema.dtype.fields[name][1] for name in schema.names] == list(range(0, 21, 2))
+    assert schema.scale.tolist() == [1000] * 11
+
+
+def test_imu_samples_of_a_known_payload():
+    expected = np.array(SAMPLES, dtype=np.float64)
+    expected[:, 3] += IMU_TEMPERATURE_OFFSET
+    for offsets in (True, False):   # Firmware that leaves the offsets at 0 packs the columns
+        schema = imu_schema_from_payload(schema_payload(offsets=offsets))
+        values = decode_imu_samples(samples_payload(SAMPLES), schema)
+        assert values.tolist() == expected.tolist()
+    assert values[0, 3] == 18.0 and values[1, 3] == 35.0
+
+
+def test_imu_samples_ignore_a_partial_sample():
+    schema = imu_schema_from_payload(schema_payload())
+    assert len(decode_imu_samples(samples_payload(SAMPLES)[:-1], schema)) == 1
+    assert decode_imu_samples(b'\x00\x07', schema).shape == (0, 11)
+
+
+def imu_record(record_type, payload):
+    return types.SimpleNamespace(type=record_type, payload=payload.hex())
+
+
+def test_changed_imu_schema_starts_a_new_part(tmp_path, parser_script):
+    writer = BackgroundWriter()
+    state = parser_script.ParseState(outPutPath=str(tmp_path), imu_dir='/', filename='log', writer=writer,
+                                     isIMUdata=0, imuParts=[], timedelta=0.0)
+    schema, samples = imu_record(24, schema_payload()), imu_record(25, samples_payload(SAMPLES))
+    parser_script.handle_imu_schema(state, schema, 'ts1', 0)
+    parser_script.handle_imu(state, samples, 'ts1', 0)
+    parser_script.handle_imu_schema(state, schema, 'ts2', 0)   # Repeated, same part
+    parser_script.handle_imu(state, samples, 'ts2', 0)
+    parser_script.handle_imu_schema(state, imu_record(24, schema_payload(IMU_COLUMNS[:4] + IMU_COLUMNS[-1:])), 'ts3', 0)
+    parser_script.handle_imu(state, imu_record(25, struct.pack('>H4hb', 7, 1, 2, 3, 4, 5)), 'ts3', 0)
+    state.fout_imu.close()
+    writer.close()
+
+    assert [name for _, _, name in state.imuParts] == ['log_imu', 'log_imu-2']
+    first = (tmp_path / 'log_imu.csv').read_text().splitlines()
+    assert first[0] == 'Timestamp,t,' + ','.join(name for name, _ in IMU_COLUMNS)
+    assert len(first) == 5 and all(len(row.split(',')) == 13 for row in first)
+    second = (tmp_path / 'log_imu-2.csv').read_text().splitlines()
+    assert second == ['Timestamp,t,ax,ay,az,temp,seq', 'ts3,3.000000,1.000000,2.000000,3.000000,25.000000,5.000000']
+
+
+def test_register_dumps_are_printed_in_record_order(tmp_path, capsys, parser_script):
+    dump = bytes(range(72))
+    records = activity_records(60)
+    at = records.index(next(r for r in records if r[:2] == (27, T0 + 10)))
+    records[at + 1:at + 1] = [(40, T0 + 10, dump), (3, T0 + 10, b'\x01'), (40, T0 + 10, dump)]
+    (tmp_path / 'MOS2C12345678.bin').write_bytes(b''.join(record(*r) for r in records))
+    parser_script.main_process(True, 1, False, False, str(tmp_path), '', '')
+
+    lines = capsys.readouterr().out.splitlines()
+    first = lines.index('2023/01/01 00:00:10')
+    pairs = ['%02x %02x' % (2 * k, 2 * k + 1) for k in range(36)]
+    assert lines[first + 1:first + 37] == pairs
+    assert lines[first + 37].startswith('Unexpected Reset @ :')
+    assert lines[first + 38:first + 75] == ['2023/01/01 00:00:10'] + pairs
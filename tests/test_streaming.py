@@ -0,0 +1,73 @@
+import numpy as np
+
+from streaming import ActivityStream, sample_times_ns, NS
+from synthetic_logs import T0, pack12
+
+
+class _Collect:
+    # ActivityStream sink keeping every chunk's sample times #
+
+    def __init__(self):
+        self.time_ns = []
+        self.t = []
+
+    def write_chunk(self, chunk):
+        self.time_ns.append(chunk.time_ns)
+        self.t.append(chunk.t)
+
+
+def test_sample_times_are_exact_ns():
+    unix_times = [T0, T0 + 1, T0 + 86400 * 365 + 1]
+    time_ns = sample_times_ns(unix_times, [30, 32, 256], [30, 32, 256])
+    k = np.arange(256)
+    expected = np.concatenate((T0 * NS + k[:30] * NS // 30, (T0 + 1) * NS + k[:32] * NS // 32,
+                               (T0 + 86400 * 365 + 1) * NS + k * NS // 256))
+    assert time_ns.dtype == np.int64
+    assert np.array_equal(time_ns, expected)
+    # 1/30 s is not a whole number of ns: every sample rounds down, none drifts #
+    assert time_ns[29] - time_ns[0] == 966666666
+
+
+def test_sample_times_of_a_fractional_rate():
+    time_ns = sample_times_ns([T0], [3], [2.5])
+    assert time_ns.tolist() == [T0 * NS, T0 * NS + 400000000, T0 * NS + 800000000]
+
+
+def activity(seconds_per_rate, seed=0):
+    # (timestamp, rate, payload) of one Nebula record per second, the clock
+    # going back 30 s at every change of rate
+    rng = np.random.default_rng(seed)
+    records = []
+    t = T0
+    for seconds, rate in seconds_per_rate:
+        for _ in range(seconds):
+            records.append((t, rate, pack12(rng.integers(-500, 500, (rate, 3)))))
+            t += 1
+        t -= 30
+    return records
+
+
+def stream_times(records, max_samples):
+    sink = _Collect()
+    stream = ActivityStream(sinks=[sink])
+    stream.max_samples = max_samples
+    for k, (timestamp, _, payload) in enumerate(records):
+        if stream.needs_flush(27):
+            stream.flush()
+        stream.add(27, str(timestamp), float(timestamp), payload, k == 0)
+    stream.flush()
+    return np.concatenate(sink.time_ns), np.concatenate(sink.t)
+
+
+def test_sample_times_do_not_depend_on_chunk_size():
+    records = activity(((100, 30), (60, 100), (40, 32)))
+    time_ns, t = stream_times(records, 10 ** 9)
+    rates = [rate for _, rate, _ in records]
+    assert np.array_equal(time_ns, sample_times_ns([ts for ts, _, _ in records], rates, rates))
+    for max_samples in (1, 29, 100, 3001):
+        chunked_ns, chunked_t = stream_times(records, max_samples)
+        assert np.array_equal(chunked_ns, time_ns), max_samples
+        assert np.array_equal(chunked_t, t), max_samples
+    # The sample clock runs on through the clock going back #
+    assert np.all(np.diff(t) > 0)
+    assert t[-1] == (100 * 30 * NS // 30 + 60 * 100 * NS // 100 + 40 * 32 * NS // 32) / NS
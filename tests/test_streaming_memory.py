@@ -0,0 +1,69 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+resource = pytest.importorskip('resource')   # Unix only
+
+#####################################################################
+# Peak RSS of a streaming parse must not grow with the log. Logs of two
+# lengths are parsed into activity CSVs in child processes under a small
+# memory budget and their peak RSS compared. NEBULA_STREAM_TEST_MB sets
+# the length of the longer log (default 32 MB, e.g. 4096 for a multi-GB
+# run), the shorter one is a quarter of it.
+#####################################################################
+LONG_MB = int(os.environ.get('NEBULA_STREAM_TEST_MB', 32))
+MEMORY_BUDGET_MB = 4
+RSS_GROWTH_MB = 24   # Allowed peak RSS difference between the two logs
+RSS_CAP_MB = 400     # Address space limit of the child parses
+
+
+def parse_log(path, directory, memory_budget_mb):
+    # Parses the activity of the log at path into CSVs in directory the
+    # way the parser script does. Returns the peak RSS in MB.
+    from logparser3_9 import parse
+    from output_writer import BackgroundWriter, ActivityCsvSink
+    from record_decoders import ACTIVITY_TYPES
+    from streaming import ActivityStream
+    from synthetic_logs import MIN_TIME, MAX_TIME
+
+    writer = BackgroundWriter()
+    sink = ActivityCsvSink(writer, directory + os.sep, 'log')
+    stream = ActivityStream(memory_budget_mb, [sink])
+    with open(path, 'rb') as fin:
+        for k, record in enumerate(parse(fin, MIN_TIME, MAX_TIME)):
+            if record.type in ACTIVITY_TYPES:
+                if stream.needs_flush(record.type):
+                    stream.flush()
+                stream.add(record.type, str(record.timestamp), record.timestamp.timestamp(),
+                           bytes.fromhex(record.payload), k == 0)
+    stream.flush()
+    sink.close()
+    writer.close()
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def peak_rss(tmp_path, megabytes):
+    from synthetic_logs import write_long_log
+    log = str(tmp_path / ('%d.bin' % megabytes))
+    size = write_long_log(log, megabytes * 2 ** 20 // 1161)
+    out = tmp_path / ('%d_csv' % megabytes)
+    out.mkdir()
+    result = subprocess.run([sys.executable, __file__, log, str(out)], capture_output=True, text=True, check=True)
+    os.remove(log)
+    assert sum(f.stat().st_size for f in out.iterdir()) > 2 * size   # The CSVs were written
+    return float(result.stdout)
+
+
+def test_peak_rss_does_not_grow_with_log_length(tmp_path):
+    short = peak_rss(tmp_path, LONG_MB // 4)
+    long = peak_rss(tmp_path, LONG_MB)
+    assert long - short < RSS_GROWTH_MB, (short, long)
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    resource.setrlimit(resource.RLIMIT_AS, (RSS_CAP_MB * 2 ** 20, RSS_CAP_MB * 2 ** 20))
+    print(parse_log(sys.argv[1], sys.argv[2], MEMORY_BUDGET_MB))
@@ -0,0 +1,53 @@
+import io
+
+import numpy as np
+import pytest
+
+from detectors import RAW_VM_SCALE
+from nebula_log import NebulaLog
+from streaming import NS
+from synthetic_logs import activity_log, write_container, MIN_TIME, MAX_TIME, T0
+from temperature_drift import TemperatureCompensation, interpolate_at, log_temperatures, stream_temperatures
+
+TIMES = np.array([10, 20, 20, 40], dtype=np.int64) * NS
+VALUES = np.array([25.0, 27.0, 29.0, 33.0])
+TEMPERATURE_CALIBRATION = {'mcuTempHigh': 1800, 'mcuTempLow': 1000, 'adxlTempHigh': 40, 'adxlTempLow': -40,
+                           'tempHigh': 50, 'tempLow': 10, 'mcuTempCal1': 0, 'mcuTempCal2': 0,
+                           'calibrationMethod': 0, 'calibrationTime': 0, 'isCalibrated': 1}
+
+
+def test_interpolate_at_edges():
+    at = np.array([0, 10, 15, 20, 30, 40, 50], dtype=np.int64) * NS
+    # Held before the first and after the last reading. At a duplicate
+    # time the last reading counts, and interpolation starts from it.
+    assert interpolate_at(TIMES, VALUES, at).tolist() == [25.0, 25.0, 26.0, 29.0, 31.0, 33.0, 33.0]
+    assert interpolate_at(TIMES[:1], VALUES[:1], at).tolist() == [25.0] * len(at)
+
+
+@pytest.mark.parametrize('in_g', [True, False])
+def test_compensation_does_not_depend_on_chunking(in_g):
+    rng = np.random.default_rng(0)
+    time_ns = np.arange(0, 50 * NS, NS // 30, dtype=np.int64)
+    xyz = rng.normal(0, 1 if in_g else RAW_VM_SCALE, (len(time_ns), 3))
+    drift = TemperatureCompensation(TIMES, VALUES, [0.001, -0.002, 0.003], 25.0)
+    whole = drift.apply(time_ns, xyz, in_g)
+    for size in (1, 7, 30, 449):
+        chunks = [drift.apply(time_ns[a:a + size], xyz[a:a + size], in_g) for a in range(0, len(time_ns), size)]
+        assert np.array_equal(np.concatenate(chunks), whole), size
+    # 33 degC after the last reading, 8 degC above the reference #
+    expected = 8 * np.array([0.001, -0.002, 0.003]) * (1 if in_g else RAW_VM_SCALE)
+    assert np.allclose(xyz[-1] - whole[-1], expected)
+
+
+def test_framing_pass_matches_the_log_readings(tmp_path):
+    data = activity_log(300)
+    path = write_container(tmp_path / 'MOS2C12345678.agdc', data,
+                           {'temperature_calibration.json': TEMPERATURE_CALIBRATION})
+    with NebulaLog.open(path) as log:
+        times, celsius = log_temperatures(log)
+        gains, offsets = log.temperature_calibration
+    assert len(times) == 75
+    streamed = stream_temperatures(io.BytesIO(data), MIN_TIME, MAX_TIME, gains, offsets)
+    assert np.array_equal(streamed[0], times) and np.array_equal(streamed[1], celsius)
+    assert streamed[0][0] == T0 * NS
+    assert len(stream_temperatures(io.BytesIO(data), MIN_TIME, MAX_TIME, None, None)[0]) == 0
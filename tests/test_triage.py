@@ -0,0 +1,40 @@
+import csv
+
+import pytest
+
+from synthetic_logs import eventful_records, inject_corruption, record, write_container
+
+
+def write_log(path, seed, corrupt):
+    records = eventful_records(seed=seed)
+    if corrupt:
+        data = inject_corruption(records, seed, every=400)[0]
+    else:
+        data = b''.join(record(*r) for r in records)
+    if path.suffix == '.agdc':
+        return write_container(path, data)
+    path.write_bytes(data)
+    return str(path)
+
+
+def summary_rows(folder):
+    with open(str(folder / 'output_files' / 'summary_file.csv'), 'r') as fin:
+        return fin.readlines()[1:]
+
+
+@pytest.mark.parametrize('name, corrupt', [('MOS2C00000001.bin', False), ('MOS2C00000002.bin', True),
+                                           ('MOS2C00000003.agdc', True)])
+def test_triage_row_matches_full_parse(parser_script, tmp_path, name, corrupt):
+    path = write_log(tmp_path / name, int(name[-6]), corrupt)
+    parser_script.main_process(True, 1, False, name.endswith('.agdc'), str(tmp_path), '', '')
+    row, report = parser_script.triage_file(path)
+    assert [row] == summary_rows(tmp_path)
+
+    # Every summary column has something to count #
+    values = next(csv.reader([row]))
+    activity, unexpected, expected, pegs, flats, gaps, nonwear = (float(v) for v in values[4:11])
+    assert activity > 7000 and unexpected == 2 and expected == 1
+    assert pegs > 10 and flats > 10 and gaps >= 3
+    if not corrupt:
+        assert nonwear >= 1
+    assert ('Corrupt byte ranges: ' in report) and (corrupt == (report.split()[-1] != '0'))
@@ -0,0 +1,88 @@
+import json
+import os
+
+from watch_folder import FolderWatcher, ProcessedLedger, LEDGER_NAME, SETTLE_SCANS
+
+
+def watcher(tmp_path):
+    incoming = tmp_path / 'incoming'
+    incoming.mkdir(exist_ok=True)
+    return FolderWatcher([str(incoming)], None, lambda folder: os.path.join(folder, 'output_files'),
+                         'report.txt', 'summary.csv', 'file,rows\n', interval=0)
+
+
+def ready_paths(w):
+    return [path for _, path, _, _ in w.scan()]
+
+
+def test_file_is_ready_once_unchanged_for_settle_scans(tmp_path):
+    w = watcher(tmp_path)
+    log = tmp_path / 'incoming' / 'a.bin'
+    log.write_bytes(b'\x1e' * 10)
+    for _ in range(SETTLE_SCANS - 1):
+        assert ready_paths(w) == []
+    assert ready_paths(w) == [str(log)]
+
+    # A file still growing starts settling again #
+    with open(str(log), 'ab') as fout:
+        fout.write(b'\x1e' * 10)
+    assert ready_paths(w) == []
+    assert ready_paths(w) == [str(log)]
+
+
+def test_empty_other_and_incomplete_zip_files_are_not_ready(tmp_path):
+    w = watcher(tmp_path)
+    incoming = tmp_path / 'incoming'
+    (incoming / 'empty.bin').write_bytes(b'')
+    (incoming / 'notes.txt').write_bytes(b'notes')
+    (incoming / 'copying.agdc').write_bytes(b'PK\x03\x04 not yet a full zip')
+    for _ in range(SETTLE_SCANS + 1):
+        assert ready_paths(w) == []
+
+
+def test_ledger_skips_parsed_files_until_replaced(tmp_path):
+    w = watcher(tmp_path)
+    log = tmp_path / 'incoming' / 'a.bin'
+    log.write_bytes(b'\x1e' * 10)
+    stat = log.stat()
+    folder = str(tmp_path / 'incoming')
+    w.ledgers[folder].add(str(log), stat.st_size, stat.st_mtime_ns)
+
+    # A restarted watcher reads the ledger back #
+    w = watcher(tmp_path)
+    for _ in range(SETTLE_SCANS + 1):
+        assert ready_paths(w) == []
+
+    log.write_bytes(b'\x1e' * 20)
+    for _ in range(SETTLE_SCANS - 1):
+        assert ready_paths(w) == []
+    assert ready_paths(w) == [str(log)]
+
+
+def test_ledger_ignores_a_torn_last_line(tmp_path):
+    path = str(tmp_path / LEDGER_NAME)
+    with open(path, 'w') as fout:
+        fout.write(json.dumps({'path': 'a.bin', 'size': 1, 'mtime': 2}) + '\n{"path": "b.b')
+    ledger = ProcessedLedger(path)
+    assert ('a.bin', 1, 2) in ledger
+    assert list(ledger.entries) == ['a.bin']
+
+
+def test_recover_adds_summary_rows_missing_from_the_ledger(tmp_path):
+    incoming = tmp_path / 'incoming'
+    out = incoming / 'output_files'
+    out.mkdir(parents=True)
+    log = incoming / 'a.bin'
+    log.write_bytes(b'\x1e' * 10)
+    gone = str(incoming / 'deleted.bin')
+    # The watcher appended the row, then crashed before the ledger entry #
+    (out / 'summary.csv').write_text('file,rows\n%s,1\n%s,1\n' % (log, gone))
+
+    w = watcher(tmp_path)
+    ledger = w.ledgers[str(incoming)]
+    stat = log.stat()
+    assert (str(log), stat.st_size, stat.st_mtime_ns) in ledger
+    assert gone not in ledger.entries
+    assert ProcessedLedger(str(out / LEDGER_NAME)).entries == ledger.entries
+    for _ in range(SETTLE_SCANS + 1):
+        assert ready_paths(w) == []
@@ -0,0 +1,121 @@
+import os
+import time
+
+from work_queue import SharedQueue, merge_fragments, run_worker
+
+LEASE = 0.5
+HEARTBEAT = 0.05
+
+
+def shared_folder(tmp_path, *names):
+    folder = tmp_path / 'study'
+    folder.mkdir()
+    for name in names:
+        (folder / name).write_bytes(name.encode())
+    return str(folder), str(tmp_path / 'queue')
+
+
+def queues(folder, queue_dir, count=2, **lease):
+    lease = dict({'lease': LEASE, 'heartbeat': HEARTBEAT}, **lease)
+    return [SharedQueue(folder, queue_dir, 'worker%d' % k, **lease) for k in range(count)]
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.01)
+
+
+def age(path, seconds):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_a_claim_is_held_while_its_heartbeat_runs(tmp_path):
+    first, second = queues(*shared_folder(tmp_path, 'a.bin'))
+    claim = first.claim()
+    assert claim.name == 'a.bin' and claim.held()
+    time.sleep(3 * LEASE)
+    assert second.claim() is None and not claim.cancelled
+
+    # A crashed worker stops renewing its claim: it is taken over once the lease ran out #
+    claim._stop.set()
+    claim._thread.join()
+    assert second.claim() is None
+    time.sleep(1.5 * LEASE)
+    taken = second.claim()
+    assert taken.name == 'a.bin' and taken.held() and not claim.held()
+    assert not first.complete(claim, 'report', 'row')
+    assert second.complete(taken, 'report', 'row')
+    assert first.pending() == [] and first.claim() is None
+
+
+def test_a_lost_claim_cancels_its_parse(tmp_path):
+    first, second = queues(*shared_folder(tmp_path, 'a.bin'))
+    claim = first.claim()
+    # The file server lost touch with the first worker for longer than the lease #
+    claim._stop.set()
+    claim._thread.join()
+    age(claim.lock, 2 * LEASE)
+    taken = second.claim()
+    assert taken is not None
+    # Its next heartbeat finds the claim gone #
+    claim._stop.clear()
+    claim.start_heartbeat()
+    wait_for(lambda: claim.cancelled)
+    assert taken.held() and not taken.cancelled
+    claim.release()
+    assert os.path.exists(taken.lock)   # Releasing the lost claim leaves the new one alone
+    taken.release()
+
+
+def test_parse_stops_when_the_claim_is_lost(tmp_path):
+    folder, queue_dir = shared_folder(tmp_path, 'a.bin', 'b.bin')
+    first, second = queues(folder, queue_dir)
+    seen = []
+
+    def parse_job(path, claim):
+        # The second worker takes the claim over mid parse #
+        if not seen:
+            age(claim.lock, 2 * LEASE)
+            taken = second.claim()
+            assert taken.name == claim.name
+            second.complete(taken, 'report by worker1\n', 'row by worker1\n')
+        wait_for(lambda: claim.cancelled or len(seen) > 0)
+        seen.append(os.path.basename(path))
+        return 'report by worker0\n', 'row by worker0\n'
+
+    assert run_worker(first, parse_job, poll=0.01) == 1
+    assert seen == ['a.bin', 'b.bin']
+    summary, report = str(tmp_path / 'summary.csv'), str(tmp_path / 'report.txt')
+    assert merge_fragments(queue_dir, summary, report, 'header\n') == 2
+    with open(summary) as fin:
+        assert fin.read() == 'header\nrow by worker1\nrow by worker0\n'
+
+
+def test_merge_keeps_the_latest_version_of_a_log(tmp_path):
+    folder, queue_dir = shared_folder(tmp_path, 'a.bin', 'b.bin')
+    first, second = queues(folder, queue_dir)
+    for claim in iter(first.claim, None):
+        first.complete(claim, 'old %s\n' % claim.name, 'old %s\n' % claim.name)
+
+    # a.bin is downloaded again: its new version is parsed by the other worker #
+    path = os.path.join(folder, 'a.bin')
+    with open(path, 'ab') as fout:
+        fout.write(b'more')
+    later = os.stat(path).st_mtime_ns + 10 ** 9
+    os.utime(path, ns=(later, later))
+    assert [p[0] for p in second.pending()] == ['a.bin']
+    claim = second.claim()
+    second.complete(claim, 'new a.bin\n', 'new a.bin\n')
+    # A torn line of a worker that died mid append is skipped #
+    with open(first.fragment, 'a') as fout:
+        fout.write('{"name": "b.bin", "tok')
+
+    summary, report = str(tmp_path / 'summary.csv'), str(tmp_path / 'report.txt')
+    assert merge_fragments(queue_dir, summary, report, 'header\n', 'REPORT\n') == 2
+    with open(summary) as fin:
+        assert fin.read() == 'header\nnew a.bin\nold b.bin\n'
+    with open(report) as fin:
+        assert fin.read() == 'REPORT\nnew a.bin\nold b.bin\n'
@@ -0,0 +1,178 @@
+import concurrent.futures
+import json
+import os
+import signal
+import time
+import zipfile
+
+
+WATCH_INTERVAL = 10          # Seconds between folder scans
+SETTLE_SCANS = 2             # Scans a file must stay unchanged before it is parsed
+LEDGER_NAME = 'processed_files.jsonl'
+ZIP_EXTENSIONS = ('.agdc', '.gt3x')
+LOG_EXTENSIONS = ZIP_EXTENSIONS + ('.bin', '.dat')
+
+
+def append_atomic(path, text, header=''):
+    # Appends text with a single O_APPEND write, so a reader (or another
+    # appender) never sees half a row. header is written first when the
+    # file is new or empty.
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        if header and os.fstat(fd).st_size == 0:
+            text = header + text
+        data = text.encode('utf-8')
+        while data:
+            data = data[os.write(fd, data):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _ignore_interrupt():
+    # Ctrl+C stops the watcher, which lets running workers finish #
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class ProcessedLedger:
+    # Files that have been parsed, one JSON line per file, so a restarted
+    # watcher parses every file exactly once. A file is identified by its
+    # path, size and modification time; a file replaced by a new download
+    # is parsed again.
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as ledger:
+                for line in ledger:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line of an interrupted append
+                    self.entries[entry['path']] = (entry['size'], entry['mtime'])
+
+    def __contains__(self, item):
+        path, size, mtime = item
+        return self.entries.get(path) == (size, mtime)
+
+    def add(self, path, size, mtime):
+        self.entries[path] = (size, mtime)
+        append_atomic(self.path, json.dumps({'path': path, 'size': size, 'mtime': mtime}) + '\n')
+
+
+class FolderWatcher:
+    # Polls folders for new log files and parses each complete one once in
+    # a process pool. parse_job(path, folder) runs in a worker and returns
+    # (report, row); the watcher appends them to the folder's report and
+    # summary files itself, then records the file in the ledger.
+
+    def __init__(self, folders, parse_job, output_folder, report_name, summary_name, summary_header,
+                 workers=None, interval=WATCH_INTERVAL, extensions=LOG_EXTENSIONS):
+        self.folders = [os.path.abspath(f) for f in folders]
+        self.parse_job = parse_job
+        self.output_folder = output_folder        # folder -> its output folder
+        self.report_name = report_name
+        self.summary_name = summary_name
+        self.summary_header = summary_header
+        self.workers = workers
+        self.interval = interval
+        self.extensions = extensions
+        self.ledgers = {}
+        self.seen = {}      # path -> (size, mtime, unchanged scans)
+        self.failed = {}    # path -> (size, mtime) of a file that could not be parsed
+        self.pending = {}   # future -> (folder, path, size, mtime)
+        for folder in self.folders:
+            out = self.output_folder(folder)
+            os.makedirs(out, exist_ok=True)
+            self.ledgers[folder] = ProcessedLedger(os.path.join(out, LEDGER_NAME))
+            self._recover(folder)
+
+    def _recover(self, folder):
+        # A row appended just before a crash has no ledger entry yet #
+        summary = os.path.join(self.output_folder(folder), self.summary_name)
+        if not os.path.exists(summary):
+            return
+        ledger = self.ledgers[folder]
+        with open(summary, 'r', encoding='utf-8', errors='replace') as rows:
+            parsed = {row.split(',', 1)[0] for row in rows}
+        for path in parsed:
+            if path not in ledger.entries and os.path.isfile(path):
+                stat = os.stat(path)
+                ledger.add(path, stat.st_size, stat.st_mtime_ns)
+
+    def scan(self):
+        # Complete files not parsed yet: unchanged for SETTLE_SCANS scans and,
+        # for zip containers, with a readable central directory
+        ready = []
+        busy = {path for _, path, _, _ in self.pending.values()}
+        for folder in self.folders:
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith(self.extensions):
+                    continue
+                path = entry.path
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                size, mtime = stat.st_size, stat.st_mtime_ns
+                if path in busy or (path, size, mtime) in self.ledgers[folder]:
+                    continue
+                if self.failed.get(path) == (size, mtime):
+                    continue
+
+                previous = self.seen.get(path)
+                scans = previous[2] + 1 if previous and previous[:2] == (size, mtime) else 0
+                self.seen[path] = (size, mtime, scans)
+                if scans + 1 < SETTLE_SCANS or size == 0:
+                    continue
+                if path.lower().endswith(ZIP_EXTENSIONS) and not zipfile.is_zipfile(path):
+                    continue
+                ready.append((folder, path, size, mtime))
+        return ready
+
+    def run(self, stop=lambda: False):
+        with concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_ignore_interrupt) as pool:
+            try:
+                while not stop():
+                    for folder, path, size, mtime in self.scan():
+                        print('Queued %s' % path)
+                        self.pending[pool.submit(self.parse_job, path, folder)] = (folder, path, size, mtime)
+
+                    if self.pending:
+                        done, _ = concurrent.futures.wait(self.pending, timeout=self.interval,
+                                                          return_when=concurrent.futures.FIRST_COMPLETED)
+                    else:
+                        done = ()
+                        time.sleep(self.interval)
+                    for future in done:
+                        self._finish(future, *self.pending.pop(future))
+            except KeyboardInterrupt:
+                pass
+
+            # Files not started yet are picked up again on the next run #
+            for future in list(self.pending):
+                if future.cancel():
+                    del self.pending[future]
+            if self.pending:
+                print('Waiting for %d running files' % len(self.pending))
+            for future in concurrent.futures.as_completed(list(self.pending)):
+                self._finish(future, *self.pending.pop(future))
+
+    def _finish(self, future, folder, path, size, mtime):
+        try:
+            report, row = future.result()
+        except Exception as e:
+            print('Failed to parse %s: %s' % (path, e))
+            self.failed[path] = (size, mtime)
+            return
+        out = self.output_folder(folder)
+        append_atomic(os.path.join(out, self.report_name), report)
+        append_atomic(os.path.join(out, self.summary_name), row, header=self.summary_header)
+        self.ledgers[folder].add(path, size, mtime)
+        self.seen.pop(path, None)
+        print('Parsed %s' % path)
@@ -0,0 +1,296 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from watch_folder import append_atomic, LOG_EXTENSIONS
+
+#####################################################################
+# Work queue in a shared (network) folder, so workers on several
+# machines can parse one study folder together without coordination:
+#
+#     python Parse_Device_Log-GUI-CPIW.py --distributed //server/study --workers 4
+#
+# started on every machine. Everything lives in <output folder>/queue:
+#   claims/<log>.lock        a worker's claim on a log, created with
+#                            O_CREAT | O_EXCL so only one worker gets it
+#   done/<log>.<size>.<mtime>.json
+#                            the claim that parsed that version of the log
+#   failed/<log>.<size>.<mtime>.json
+#                            logs that could not be parsed
+#   workers/<worker>.alive   touched by each worker as its clock
+#   fragments/<worker>.jsonl report and summary row of every log the
+#                            worker parsed, only written by that worker
+#
+# A claim is a lease: its worker touches the lock file every
+# HEARTBEAT_SECONDS. A lock not touched for LEASE_SECONDS (by the file
+# server's clock, so the machines' clocks do not matter) belongs to a
+# dead worker and is taken over. Workers check on every heartbeat that
+# they still hold their claim and stop the parse when they do not.
+# SQLite is not used for the claims as its locking is not reliable on
+# network shares. Once every log is done, the fragments are merged into
+# the usual summary file and report, in log name order.
+#####################################################################
+QUEUE_DIR = 'queue'
+LEASE_SECONDS = 300
+HEARTBEAT_SECONDS = 30
+POLL_SECONDS = 10   # Wait between looks at the queue while other workers hold the last claims
+
+
+def worker_name():
+    return '%s-%d-%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:6])
+
+
+def write_atomic(path, text):
+    # Readers on any machine see the old or the new file, never half of it #
+    tmp = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+    with open(tmp, 'w', encoding='utf-8') as fout:
+        fout.write(text)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as fin:
+            return json.load(fin)
+    except (OSError, ValueError):
+        return None
+
+
+class Claim:
+    # A worker's lease on one log. Passed to the parse as its job: the
+    # parse checks claim.cancelled between record batches, which turns
+    # True once the lease was lost.
+
+    def __init__(self, queue, name, path, size, mtime):
+        self.queue = queue
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.token = uuid.uuid4().hex
+        self.progress = 0.0
+        self._lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def lock(self):
+        return self.queue.lock_path(self.name)
+
+    @property
+    def cancelled(self):
+        return self._lost.is_set()
+
+    def set_part_progress(self, fraction):
+        self.progress = fraction
+
+    def held(self):
+        lock = _read_json(self.lock)
+        return lock is not None and lock.get('token') == self.token
+
+    def start_heartbeat(self):
+        self._thread = threading.Thread(target=self._beat, name='claim-heartbeat', daemon=True)
+        self._thread.start()
+
+    def _beat(self):
+        while not self._stop.wait(self.queue.heartbeat):
+            try:
+                if not self.held():
+                    self._lost.set()
+                    return
+                os.utime(self.lock)
+            except OSError:
+                pass   # A network hiccup, the lease lasts several heartbeats
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            if self.held():
+                os.remove(self.lock)
+        except OSError:
+            pass
+
+
+class SharedQueue:
+
+    def __init__(self, folder, queue_dir, worker=None, extensions=LOG_EXTENSIONS,
+                 lease=LEASE_SECONDS, heartbeat=HEARTBEAT_SECONDS):
+        self.folder = os.path.abspath(folder)
+        self.queue_dir = queue_dir
+        self.worker = worker or worker_name()
+        self.extensions = extensions
+        self.lease = lease
+        self.heartbeat = heartbeat
+        for sub in ('claims', 'done', 'failed', 'workers', 'fragments'):
+            os.makedirs(os.path.join(queue_dir, sub), exist_ok=True)
+        self.fragment = os.path.join(queue_dir, 'fragments', self.worker + '.jsonl')
+        self._now = None   # Server time, read once per claim()
+
+    def lock_path(self, name):
+        return os.path.join(self.queue_dir, 'claims', name + '.lock')
+
+    def _marker(self, kind, name, size, mtime):
+        return os.path.join(self.queue_dir, kind, '%s.%d.%d.json' % (name, size, mtime))
+
+    def server_time(self):
+        # Current time of the file server: the mtime of a file just touched #
+        alive = os.path.join(self.queue_dir, 'workers', self.worker + '.alive')
+        with open(alive, 'a'):
+            pass
+        os.utime(alive)
+        return os.stat(alive).st_mtime
+
+    def pending(self):
+        # (name, path, size, mtime) of the logs of the folder that are
+        # neither done nor failed in their current version, claimed or not
+        finished = set(os.listdir(os.path.join(self.queue_dir, 'done')))
+        finished.update(os.listdir(os.path.join(self.queue_dir, 'failed')))
+        logs = []
+        for entry in sorted(os.scandir(self.folder), key=lambda e: e.name):
+            if not entry.is_file() or not entry.name.lower().endswith(self.extensions):
+                continue
+            stat = entry.stat()
+            if os.path.basename(self._marker('done', entry.name, stat.st_size, stat.st_mtime_ns)) in finished:
+                continue
+            logs.append((entry.name, entry.path, stat.st_size, stat.st_mtime_ns))
+        return logs
+
+    def claim(self):
+        # A Claim on the next unclaimed log (taking over stale claims), None
+        # when every pending log is claimed by a live worker
+        self._now = None
+        for name, path, size, mtime in self.pending():
+            claim = Claim(self, name, path, size, mtime)
+            if self._take(claim):
+                claim.start_heartbeat()
+                return claim
+        return None
+
+    def _take(self, claim):
+        lock = claim.lock
+        for _ in range(2):
+            try:
+                fd = os.open(lock, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+            except FileExistsError:
+                if not self._reclaim(lock):
+                    return False
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as fout:
+                json.dump({'worker': self.worker, 'token': claim.token, 'claimed': time.time()}, fout)
+            # The log may have been finished between pending() and the claim #
+            if os.path.exists(self._marker('done', claim.name, claim.size, claim.mtime)):
+                os.remove(lock)
+                return False
+            return True
+        return False
+
+    def _reclaim(self, lock):
+        # Removes lock if its lease ran out. The stale lock is renamed away
+        # first, only one of the workers racing for it succeeds.
+        if self._now is None:
+            self._now = self.server_time()
+        try:
+            stale = os.stat(lock).st_mtime < self._now - self.lease
+        except OSError:
+            return True   # Released meanwhile
+        if not stale:
+            return False
+        owner = _read_json(lock)
+        tomb = '%s.%s.stale' % (lock, self.worker)
+        try:
+            os.rename(lock, tomb)
+        except OSError:
+            return False
+        if _read_json(tomb) != owner and not os.path.exists(lock):
+            os.rename(tomb, lock)   # A fresh claim was made in between, put it back
+            return False
+        print('Took over the stale claim of %s on %s' % ((owner or {}).get('worker'),
+                                                         os.path.basename(lock)[:-len('.lock')]))
+        os.remove(tomb)
+        return True
+
+    def complete(self, claim, report, row):
+        # Records the parse of a claimed log. False when the claim was lost
+        # meanwhile, the result is then dropped.
+        if claim.cancelled or not claim.held():
+            claim.release()
+            return False
+        append_atomic(self.fragment, json.dumps({'name': claim.name, 'token': claim.token,
+                                                 'report': report, 'row': row}) + '\n')
+        write_atomic(self._marker('done', claim.name, claim.size, claim.mtime),
+                     json.dumps({'name': claim.name, 'version': [claim.size, claim.mtime], 'token': claim.token,
+                                 'worker': self.worker}))
+        claim.release()
+        return True
+
+    def fail(self, claim, error):
+        if claim.held():
+            write_atomic(self._marker('failed', claim.name, claim.size, claim.mtime),
+                         json.dumps({'name': claim.name, 'worker': self.worker, 'error': error}))
+        claim.release()
+
+
+def merge_fragments(queue_dir, summary_path, report_path, summary_header, report_header=''):
+    # Rebuilds the summary and report from the fragments, one entry per
+    # log: the one of the claim that finished its latest version. Every
+    # machine merges when it runs out of work, the last one merges
+    # everything. Returns the number of logs merged.
+    entries = {}
+    fragments = os.path.join(queue_dir, 'fragments')
+    for fragment in sorted(os.listdir(fragments)):
+        with open(os.path.join(fragments, fragment), 'r', encoding='utf-8') as fin:
+            for line in fin:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue   # Torn last line of a worker that died mid append
+                entries[entry['token']] = entry
+
+    latest = {}
+    done = os.path.join(queue_dir, 'done')
+    for marker in os.listdir(done):
+        info = _read_json(os.path.join(done, marker)) if marker.endswith('.json') else None
+        if info is not None and info['token'] in entries:
+            if info['name'] not in latest or info['version'][1] > latest[info['name']]['version'][1]:
+                latest[info['name']] = info
+    rows, reports = [], []
+    for name in sorted(latest):
+        entry = entries[latest[name]['token']]
+        rows.append(entry['row'])
+        reports.append(entry['report'])
+    write_atomic(summary_path, summary_header + ''.join(rows))
+    write_atomic(report_path, report_header + ''.join(reports))
+    return len(rows)
+
+
+def run_worker(queue, parse_job, poll=POLL_SECONDS, stop=lambda: False):
+    # Claims and parses logs until every log of the folder is done or
+    # failed. parse_job(path, claim) returns (report, summary row).
+    # Returns the number of logs this worker parsed.
+    parsed = 0
+    while not stop():
+        claim = queue.claim()
+        if claim is None:
+            if not queue.pending():
+                break
+            time.sleep(poll)   # Wait for the other workers' claims to finish or go stale
+            continue
+        print('%s: parsing %s' % (queue.worker, claim.name))
+        try:
+            report, row = parse_job(claim.path, claim)
+        except Exception as e:
+            print('%s: failed to parse %s: %r' % (queue.worker, claim.name, e))
+            queue.fail(claim, repr(e))
+            continue
+        if queue.complete(claim, report, row):
+            parsed += 1
+        else:
+            print('%s: lost the claim on %s, another worker parses it' % (queue.worker, claim.name))
+    return parsed